@@ -60,7 +60,8 @@ setup(
             "dbcopy-client=scripts.dbcopy_client:main",
             "gifts-client=scripts.gifts_client:main",
             "handover-client=scripts.handover_client:main",
-            "metadata-client=scripts.metadata_client:main",
+            "metadata-client=scripts.genomemetadata_client:main",
+            "prodinf=scripts.prodinf:main",
         ]
     }
 )
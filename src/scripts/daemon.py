@@ -0,0 +1,61 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import argparse
+import logging
+import sys
+
+from scripts.utils.daemon import ClientDaemon, default_socket_path, request
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the client scripts from a long-lived local process')
+    parser.add_argument('-a', '--action', choices=['start', 'stop', 'status'], required=True,
+                        help='Action to take. start runs the daemon in the foreground until stopped')
+    parser.add_argument('-s', '--socket', default=default_socket_path(),
+                        help='Unix socket of the daemon, shared with the clients through PRODINF_DAEMON_SOCKET')
+    parser.add_argument('-v', '--verbose', help='Verbose output', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    if args.action == 'start':
+        try:
+            server = ClientDaemon(args.socket)
+        except RuntimeError as e:
+            logging.basicConfig(level=logging.INFO, format='%(message)s')
+            logging.error(e)
+            sys.exit(1)
+        logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+        logging.info('Listening on %s', args.socket)
+        # Usage messages of the commands run by the daemon are named after the argv[0] of the process
+        sys.argv[:1] = ['prodinf']
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    else:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        answer = request({'command': args.action}, args.socket)
+        if answer is None:
+            logging.info('No daemon listening on %s', args.socket)
+            sys.exit(1)
+        if args.action == 'status':
+            logging.info('Daemon %s listening on %s, loaded: %s', answer['pid'], args.socket,
+                         ', '.join(answer['modules']) or 'nothing yet')
+
+
+if __name__ == '__main__':
+    main()
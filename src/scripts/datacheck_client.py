@@ -12,54 +12,367 @@
 #    limitations under the License.
 
 import argparse
+import json
 import logging
+import sys
 
-from ensembl.production.core.clients.datachecks import DatacheckClient
+from scripts.utils import fastjson
+from scripts.utils.concurrency import run_bounded
+from scripts.utils.cli import add_event_arguments, add_outbox_arguments, add_transport_arguments
+from scripts.utils.columnar import SUMMARY_COLUMNS, ResultColumns, write_table
+from scripts.utils.daemon import run_in_daemon
+from scripts.utils.events import follow
+from scripts.utils.datachecks import (compare_results, expand_matrix, has_results, iter_results, job_tag,
+                                      parse_dbname, submission_label)
+from scripts.utils.manifest import read_lines, split_list
+from scripts.utils.mysql import list_databases
+from scripts.utils.result_store import DatacheckResultStore, default_store_path
+from scripts.utils.streaming import copy_response, iter_json_file, iter_json_records
 
+DEFAULT_STORE = 'default'
+SOURCE_KINDS = ('tag', 'job', 'file')
+REPORT_DIMENSIONS = ('datacheck', 'division', 'db_type', 'species')
+# 'incomplete' jobs still have datachecks running or ready to run
+FINISHED_STATUSES = ('complete', 'failed')
+FAILURE_STATUSES = ('failed',)
+
+
+def job_payload(args, submission=None):
+    """Arguments of ``DatacheckClient.submit_job`` for a matrix submission, or for the command line ones."""
+    submission = submission or {'dbname': args.dbname, 'species': args.species, 'db_type': args.db_type,
+                                'datacheck_groups': args.datacheck_groups}
+    return {'server_url': args.server_url, 'dbname': submission['dbname'], 'species': submission['species'],
+            'division': args.division, 'db_type': submission['db_type'], 'datacheck_names': args.datacheck_names,
+            'datacheck_groups': submission['datacheck_groups'], 'datacheck_types': args.datacheck_types,
+            'email': args.email, 'tag': args.tag, 'target_url': args.target_url}
+
+
+def bulk_submit(client, args):
+    dbnames = split_list(args.dbname)
+    if args.dbname_file:
+        dbnames.extend(read_lines(args.dbname_file))
+    if args.dbname_pattern:
+        dbnames.extend(list_databases(args.server_url, args.dbname_pattern))
+    if (args.dbname or args.dbname_file or args.dbname_pattern) and not dbnames:
+        logging.error('No database matches the given names, file or pattern')
+        sys.exit(1)
+    submissions = list(expand_matrix(list(dict.fromkeys(dbnames)), split_list(args.species),
+                                     split_list(args.db_type), split_list(args.datacheck_groups)))
+    logging.info('Submitting %s datacheck jobs', len(submissions))
+
+    job_ids = {}
+    failures = 0
+    if args.outbox:
+        from scripts.outbox import queue_submissions
+        sent, failures = queue_submissions(args, [('datacheck', args.uri, job_payload(args, submission), None)
+                                                  for submission in submissions])
+        job_ids = {submission_label(submission): job_id for submission, job_id in zip(submissions, sent)
+                   if job_id is not None}
+    else:
+        for outcome in run_bounded(lambda submission: client.submit_job(**job_payload(args, submission)),
+                                   submissions, concurrency=args.concurrency, rate=args.rate_limit):
+            label = submission_label(outcome.item)
+            if outcome.error:
+                failures += 1
+                logging.error('%s failed: %s', label, outcome.error)
+            else:
+                job_ids[label] = outcome.result
+                logging.info('%s submitted with ID %s', label, outcome.result)
+    if args.output_file:
+        json.dump({args.tag: job_ids}, args.output_file, indent=2, sort_keys=True)
+    if failures:
+        logging.error('%s of %s submissions failed', failures, len(submissions))
+        sys.exit(1)
+
+
+def is_finished(status):
+    return status in FINISHED_STATUSES
+
+
+def watch_jobs(client, args):
+    from scripts.utils.http import ConditionalFetcher, shared_session
+
+    job_ids = split_list(args.job_id)
+    fetcher = ConditionalFetcher(shared_session())
+
+    def on_change(job_id, old_status, new_status, job):
+        if old_status is None:
+            logging.info('Job %s: %s', job_id, new_status)
+        else:
+            logging.info('Job %s: %s -> %s', job_id, old_status, new_status)
+
+    statuses = follow(job_ids, lambda job_id: fetcher.get_json(client.jobs_id.format(client.uri, job_id)),
+                      lambda job: job.get('status'), is_finished, on_change,
+                      lambda job: str(job.get('id')), broker_url=args.broker_url, exchange=args.exchange,
+                      routing_key=args.routing_key, resync=args.resync, concurrency=args.concurrency,
+                      initial=args.poll_interval, maximum=args.max_poll_interval, timeout=args.timeout)
+    failed = [job_id for job_id in job_ids if statuses.get(job_id) in FAILURE_STATUSES]
+    unfinished = [job_id for job_id in job_ids if statuses.get(job_id) not in FINISHED_STATUSES]
+    logging.info('%s job(s) complete, %s failed, %s unfinished',
+                 len(job_ids) - len(failed) - len(unfinished), len(failed), len(unfinished))
+    if failed:
+        sys.exit(1)
+    if unfinished:
+        sys.exit(2)
+
+
+def open_store(client, args):
+    return DatacheckResultStore(default_store_path(client.uri) if args.store == DEFAULT_STORE else args.store)
+
+
+def sync_store(client, store, tag=None):
+    """Bring the local result store up to date with the service listing.
+
+    The datacheck service has no way to list only some jobs, so the whole
+    listing is downloaded at every sync. Jobs below the watermark, the lowest
+    job id still unfinished at the previous sync, are then skipped, and only the
+    new or changed jobs are stored and have their details retrieved.
+    """
+    from scripts.utils.http import shared_session
+
+    scope = tag or ''
+    since = store.watermark(scope)
+    bounds = {'unfinished': None, 'last': since}
+
+    def listed(jobs):
+        for job in jobs:
+            if tag and job_tag(job) != tag:
+                continue
+            number = int(job['id'])
+            if since is not None and number < since:
+                continue
+            if not is_finished(job.get('status')) and (bounds['unfinished'] is None or number < bounds['unfinished']):
+                bounds['unfinished'] = number
+            if bounds['last'] is None or number > bounds['last']:
+                bounds['last'] = number
+            yield job
+
+    listing = iter_json_records(shared_session(), client.jobs.format(client.uri), {'tag': tag} if tag else None)
+    synced = store.sync(listed(listing), lambda job: client.retrieve_job(job['id']), lambda job: not has_results(job))
+    watermark = bounds['unfinished'] if bounds['unfinished'] is not None else bounds['last']
+    if watermark is not None:
+        store.set_watermark(scope, watermark)
+    logging.debug('Synced %s new or changed jobs, watermark %s', len(synced), watermark)
+
+
+def list_from_store(client, args):
+    with open_store(client, args) as store:
+        if not args.offline:
+            sync_store(client, store, args.tag)
+        jobs = list(store.jobs(args.tag, args.failure_only))
+    if args.output_file is None:
+        print(fastjson.dumps(jobs, indent=2))
+    else:
+        args.output_file.write(fastjson.dumps(jobs))
+
+
+def list_jobs(client, args):
+    """List jobs as ``DatacheckClient.list_jobs`` does, copying the service answer as is when nothing is filtered."""
+    if args.output_file is None or args.tag or args.failure_only:
+        client.list_jobs(args.output_file, args.tag, args.failure_only)
+        return
+    from scripts.utils.http import shared_session
+
+    args.output_file.flush()
+    copy_response(shared_session(), client.jobs.format(client.uri), args.output_file.buffer)
+
+
+def iter_source_jobs(client, args, source):
+    """Stream the job documents, with their results, of a result set.
+
+    Sources are ``tag:<tag>``, ``job:<job id>`` or ``file:<path>`` of a JSON
+    array or JSON lines job list, e.g. from ``list --output_file``. A source
+    without prefix is a tag. Listed jobs without results have their details
+    retrieved ``--concurrency`` at a time, so jobs are not yielded in listing order.
+    """
+    kind, _, value = source.partition(':')
+    if kind not in SOURCE_KINDS:
+        kind, value = 'tag', source
+    if kind == 'file':
+        yield from iter_json_file(value)
+    elif kind == 'job':
+        yield client.retrieve_job(value)
+    elif args.store:
+        with open_store(client, args) as store:
+            if not args.offline:
+                sync_store(client, store, value)
+            yield from store.jobs(value)
+    else:
+        from scripts.utils.http import shared_session
+
+        listing = iter_json_records(shared_session(), client.jobs.format(client.uri), {'tag': value})
+        tagged = (job for job in listing if job_tag(job) == value)
+
+        def with_results(job):
+            return job if has_results(job) else client.retrieve_job(job['id'])
+
+        for outcome in run_bounded(with_results, tagged, concurrency=args.concurrency):
+            if outcome.error:
+                raise outcome.error
+            yield outcome.result
+
+
+def iter_source_results(client, args, source):
+    for job in iter_source_jobs(client, args, source):
+        yield from iter_results(job)
+
+
+def compare(client, args):
+    base, head = args.compare
+    diff = compare_results(iter_source_results(client, args, base), iter_source_results(client, args, head))
+    for dbname, datacheck in diff['new_failures']:
+        logging.info('New failure: %s %s', dbname, datacheck)
+    for dbname, datacheck in diff['fixed']:
+        logging.debug('Fixed: %s %s', dbname, datacheck)
+    logging.info('%s new failures, %s fixed, %s still failing, %s failures of databases not checked again',
+                 len(diff['new_failures']), len(diff['fixed']), len(diff['still_failing']), diff['unmatched'])
+    if args.output_file:
+        report = {category: [{'dbname': dbname, 'datacheck': datacheck} for dbname, datacheck in diff[category]]
+                  for category in ('new_failures', 'fixed', 'still_failing')}
+        report['unmatched'] = diff['unmatched']
+        json.dump(report, args.output_file, indent=2)
+    return diff
+
+
+def iter_report_rows(jobs):
+    for job in jobs:
+        division = (job.get('input') or {}).get('division')
+        for dbname, datacheck, status in iter_results(job):
+            if datacheck is None:
+                continue
+            species, db_type = parse_dbname(dbname)
+            yield dbname, species, db_type, division, datacheck, status
+
+
+def report(client, args):
+    columns = ResultColumns()
+    columns.extend(iter_report_rows(iter_source_jobs(client, args, args.tag)))
+    failed = sum(columns.mask('status', 'failed'))
+    logging.info('%s results, %s failed', len(columns), failed)
+    for dimension in REPORT_DIMENSIONS:
+        rows = [row for row in columns.aggregate(dimension) if row[1]]
+        if rows:
+            logging.info('Failures per %s:', dimension)
+        for value, failures, total in rows[:args.report_top]:
+            logging.info('  %s: %s/%s', value, failures, total)
+    if args.report_file:
+        write_table(args.report_file, SUMMARY_COLUMNS, columns.summary(REPORT_DIMENSIONS))
+
+
+def main(argv=None):
+    if argv is None:
+        run_in_daemon('scripts.datacheck_client', sys.argv[1:])
 
-def main():
     parser = argparse.ArgumentParser(description='Run datachecks via a REST service')
 
     parser.add_argument('-u', '--uri', help='Datacheck REST service URI', required=True)
     parser.add_argument('-a', '--action', help='Action to take',
-                        choices=['submit', 'retrieve', 'list'], required=True)
-    parser.add_argument('-i', '--job_id', help='Datacheck job identifier to retrieve')
+                        choices=['submit', 'bulk-submit', 'retrieve', 'watch', 'list', 'compare', 'report'],
+                        required=True)
+    parser.add_argument('-i', '--job_id', help='Datacheck job identifier to retrieve. For watch, multiple '
+                                               'identifiers comma-separated')
     parser.add_argument('-v', '--verbose', help='Verbose output', action='store_true')
-    parser.add_argument('-o', '--output_file', help='File to write output as JSON', type=argparse.FileType('w'))
+    parser.add_argument('-o', '--output_file', help='File to write output as JSON. For bulk-submit, the tag to job '
+                                                    'identifiers map', type=argparse.FileType('w'))
     parser.add_argument('-s', '--server_url', help='URL of database server', required=True)
-    parser.add_argument('-db', '--dbname', help='Database name')
-    parser.add_argument('-sp', '--species', help='Species production name')
+    parser.add_argument('-db', '--dbname', help='Database name. For bulk-submit, multiple names comma-separated')
+    parser.add_argument('--dbname_file', help='For bulk-submit, file listing database names, one per line')
+    parser.add_argument('--dbname_pattern',
+                        help='For bulk-submit, shell-style patterns (comma-separated) of databases on the server, '
+                             'e.g. "*_core_110_*"')
+    parser.add_argument('-sp', '--species', help='Species production name. For bulk-submit, multiple names '
+                                                 'comma-separated')
     parser.add_argument('-div', '--division', help='Division')
-    parser.add_argument('-dbt', '--db_type', help='Database type')
+    parser.add_argument('-dbt', '--db_type', help='Database type. For bulk-submit, multiple types comma-separated: '
+                                                  'databases of other types are skipped')
     parser.add_argument('-n', '--datacheck_names', help='Datacheck names, multiple names comma-separated')
-    parser.add_argument('-g', '--datacheck_groups', help='Datacheck groups, multiple names comma-separated')
+    parser.add_argument('-g', '--datacheck_groups', help='Datacheck groups, multiple names comma-separated. '
+                                                         'For bulk-submit, each group is submitted as its own job')
     parser.add_argument('-dct', '--datacheck_types', help='Datacheck type (advisory or critical)')
     parser.add_argument('-e', '--email', help='Email address for pipeline reports')
-    parser.add_argument('-t', '--tag', help='Tag to collate results and facilitate filtering')
+    parser.add_argument('-t', '--tag', help='Tag to collate results and facilitate filtering. For report, also '
+                                            'job:<job id> or file:<path> of a list output file')
     parser.add_argument('-f', '--failure_only', help='Show failures only', action='store_true')
     parser.add_argument('--target_url', help="Optional location of 'ancillary' server, for related database")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'),
+                        help='Result sets to compare: tag:<tag>, job:<job id> or file:<path> of a list output file. '
+                             'A value without prefix is a tag')
+    parser.add_argument('--report_file',
+                        help='File to write the report failure counts per datacheck, division, database type and '
+                             'species to, as CSV, or as Parquet if the name ends with .parquet')
+    parser.add_argument('--report_top', type=int, default=20, help='Number of report lines per dimension to log')
+    parser.add_argument('--store', nargs='?', const=DEFAULT_STORE,
+                        help='Answer list from a local SQLite result store, updated from the full service listing '
+                             'with the jobs new or changed since the previous run, whose details only are retrieved. '
+                             'The tag is then matched exactly rather than as a regular expression. '
+                             'Optionally the path of the store, by default one per service URI in the user cache')
+    parser.add_argument('--offline', action='store_true', help='Query the local result store without syncing it')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Number of concurrent bulk submissions, or job retrievals of compare and report')
+    parser.add_argument('--rate_limit', type=float, help='Maximum bulk submissions per second')
+    parser.add_argument('--poll_interval', type=float, default=5,
+                        help='Initial seconds between two polls of a watched job')
+    parser.add_argument('--max_poll_interval', type=float, default=300,
+                        help='Maximum seconds between two polls of a watched job')
+    parser.add_argument('--timeout', type=float,
+                        help='Stop watching after this many seconds. Exit status is 1 if any job failed, '
+                             '2 if any job is unfinished')
 
-    args = parser.parse_args()
+    add_transport_arguments(parser)
+    add_event_arguments(parser, 'datacheck')
+    add_outbox_arguments(parser)
+
+    args = parser.parse_args(argv)
 
     if args.verbose is True:
         logging.basicConfig(level=logging.DEBUG, format='%(message)s')
     else:
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-    client = DatacheckClient(args.uri)
+    from ensembl.production.core.clients.datachecks import DatacheckClient
+    from scripts.utils.http import transport_from_args, use_transport
+
+    client = use_transport(DatacheckClient(args.uri), transport_from_args(args))
 
     if args.action == 'submit':
-        job_id = client.submit_job(args.server_url, args.dbname, args.species, args.division, args.db_type,
-                                   args.datacheck_names, args.datacheck_groups, args.datacheck_types,
-                                   args.email, args.tag, args.target_url)
-        logging.info('Job submitted with ID ' + str(job_id))
+        if args.outbox:
+            from scripts.outbox import queue_submissions
+            _, failures = queue_submissions(args, [('datacheck', args.uri, job_payload(args), None)])
+            if failures:
+                sys.exit(1)
+        else:
+            job_id = client.submit_job(**job_payload(args))
+            logging.info('Job submitted with ID ' + str(job_id))
+
+    elif args.action == 'bulk-submit':
+        bulk_submit(client, args)
 
     elif args.action == 'retrieve':
         job = client.retrieve_job(args.job_id)
         client.print_job(job, print_results=True, print_input=True)
 
+    elif args.action == 'watch':
+        if not args.job_id:
+            parser.error('--job_id is required for watch')
+        watch_jobs(client, args)
+
     elif args.action == 'list':
-        jobs = client.list_jobs(args.output_file, args.tag, args.failure_only)
+        if args.store:
+            list_from_store(client, args)
+        else:
+            list_jobs(client, args)
+
+    elif args.action == 'compare':
+        if not args.compare:
+            parser.error('--compare BASE HEAD is required for compare')
+        diff = compare(client, args)
+        if diff['new_failures']:
+            sys.exit(1)
+
+    elif args.action == 'report':
+        if not args.tag:
+            parser.error('--tag is required for report')
+        report(client, args)
 
 
 if __name__ == '__main__':
@@ -12,10 +12,28 @@
 #    limitations under the License.
 
 import argparse
+import itertools
 import logging
+import os
 import sys
 
-from ensembl.production.core.clients.dbcopy import DbCopyRestClient
+from scripts.utils.cache import TTLCache, default_cache_dir
+from scripts.utils.cli import add_event_arguments, add_outbox_arguments, add_transport_arguments
+from scripts.utils.concurrency import run_bounded
+from scripts.utils.daemon import run_in_daemon
+from scripts.utils.events import follow
+from scripts.utils.manifest import Journal, read_manifest, row_key, split_list
+from scripts.utils.pipeline import DONE, FAILED, RUNNING, Checkpoint, Stage, run_pipeline
+from scripts.utils.scheduling import format_size, plan_copies, target_loads
+from scripts.utils.streaming import iter_json_records, parse_datetime, write_ndjson
+
+MANIFEST_FIELDS = ('src_host', 'src_incl_db', 'src_skip_db', 'src_incl_tables', 'src_skip_tables', 'tgt_host',
+                   'tgt_db_name', 'skip_optimize', 'wipe_target', 'convert_innodb', 'email_list', 'user')
+# Fields identifying a copy: resubmitting with another email or user is still the same copy
+MANIFEST_KEY_FIELDS = MANIFEST_FIELDS[:7]
+SUCCESS_STATUSES = ('complete',)
+FAILURE_STATUSES = ('failed',)
+JOB_DATE_FIELD = 'request_date'
 
 
 def handle_runtime_error(error):
@@ -28,19 +46,302 @@ def handle_key_error(error, job):
     logging.error(msg)
 
 
-def main():
+def host_error(host, host_port_map):
+    """Why ``host`` (host:port) is not one of the hosts of a host list, or ``None``.
+
+    Same rules as ``DbCopyRestClient.check_hosts``: short host names only, with
+    the port the service lists for them.
+    """
+    name, _, port = host.partition(':')
+    if name.endswith('.ebi.ac.uk'):
+        return f'Invalid domain: {name}'
+    actual_port = host_port_map.get(name.split('.')[0])
+    if actual_port is None:
+        return f'Invalid hostname: {name}'
+    if not port.isdigit() or int(port) != int(actual_port):
+        return f'Invalid port for hostname: {name}. Please use port: {actual_port}'
+    return None
+
+
+def check_hosts(client, src_hosts, tgt_hosts, cache=None, refresh=False):
+    """Validate source and target hosts, retrieving the source and target host lists concurrently.
+
+    Each host list is retrieved once and every host is validated against it.
+    Hosts which passed validation are remembered in ``cache`` (keyed by service
+    URI, role and host:port) and are not checked again until the entry expires,
+    unless ``refresh`` is set. Failed validations are never cached.
+    """
+    logging.info('Checking source and target hostname validity...')
+    pending = {}
+    for role, hosts in (('source', src_hosts), ('target', tgt_hosts)):
+        for host in dict.fromkeys(hosts):
+            key = f"{client.uri}|{role}|{host}"
+            if cache is not None and not refresh and cache.get(key) is not None:
+                logging.debug('%s host %s valid (cached)', role.capitalize(), host)
+            else:
+                pending.setdefault(role, []).append((host, key))
+    valid = True
+    for outcome in run_bounded(client.retrieve_host_list, list(pending), concurrency=2):
+        if outcome.error:
+            raise outcome.error
+        role = outcome.item
+        host_port_map = {host['name']: host['port'] for host in outcome.result['results']}
+        for host, key in pending[role]:
+            err = host_error(host, host_port_map)
+            if err:
+                valid = False
+                logging.error('%s hostname error: %s', role.capitalize(), err)
+            elif cache is not None:
+                cache.set(key, True)
+    return valid
+
+
+def host_cache(args):
+    if args.host_cache_ttl <= 0:
+        return None
+    return TTLCache(os.path.join(default_cache_dir(), 'dbcopy_hosts.sqlite'), ttl=args.host_cache_ttl)
+
+
+def submit(client, job):
+    return client.submit_job(job['src_host'], job['src_incl_db'], job['src_skip_db'], job['src_incl_tables'],
+                             job['src_skip_tables'], job['tgt_host'], job['tgt_db_name'], job['skip_optimize'],
+                             job['wipe_target'], job['convert_innodb'], job['email_list'], job['user'])
+
+
+def manifest_jobs(args):
+    defaults = {field: getattr(args, field) for field in MANIFEST_FIELDS}
+    for number, row in enumerate(read_manifest(args.manifest), start=1):
+        unknown = set(row).difference(MANIFEST_FIELDS)
+        if unknown:
+            raise ValueError(f"Manifest row {number}: unknown field(s) {', '.join(sorted(unknown))}")
+        job = dict(defaults, **row)
+        for field, value in job.items():
+            if isinstance(value, (list, tuple)):
+                job[field] = ','.join(str(v) for v in value)
+            elif isinstance(value, bool):
+                job[field] = int(value)
+        if not job['src_host'] or not job['tgt_host']:
+            raise ValueError(f"Manifest row {number}: src_host and tgt_host are required")
+        yield number, job
+
+
+def bulk_submit(client, args):
+    jobs = list(manifest_jobs(args))
+    if not args.skip_check:
+        src_hosts = sorted({job['src_host'] for _, job in jobs})
+        tgt_hosts = sorted({host for _, job in jobs for host in job['tgt_host'].split(',')})
+        if not check_hosts(client, src_hosts, tgt_hosts, host_cache(args), args.refresh_host_cache):
+            sys.exit(1)
+    if args.outbox:
+        from scripts.outbox import queue_submissions
+        _, failures = queue_submissions(args, [('dbcopy', args.uri, job, row_key(job, MANIFEST_KEY_FIELDS))
+                                               for _, job in jobs])
+        if failures:
+            sys.exit(1)
+        return
+    with Journal(args.results_file) as journal:
+        pending = []
+        for number, job in jobs:
+            key = row_key(job, MANIFEST_KEY_FIELDS)
+            if journal.is_done(key):
+                logging.info('Row %s already submitted with ID %s, skipping', number, journal.completed[key]['job_id'])
+            else:
+                pending.append((number, key, job))
+        logging.info('Submitting %s of %s manifest rows', len(pending), len(jobs))
+        failures = 0
+        for outcome in run_bounded(lambda item: submit(client, item[2]), pending,
+                                   concurrency=args.concurrency, rate=args.rate_limit):
+            number, key, job = outcome.item
+            record = {'row': number, 'key': key, 'src_host': job['src_host'], 'src_incl_db': job['src_incl_db'],
+                      'tgt_host': job['tgt_host'], 'tgt_db_name': job['tgt_db_name'], 'job_id': outcome.result,
+                      'error': str(outcome.error) if outcome.error else None}
+            journal.write(record)
+            if outcome.error:
+                failures += 1
+                logging.error('Row %s (%s -> %s) failed: %s', number, job['src_host'], job['tgt_host'], outcome.error)
+            else:
+                logging.info('Row %s (%s -> %s) submitted with ID %s', number, job['src_host'], job['tgt_host'],
+                             outcome.result)
+    if failures:
+        logging.error('%s of %s submissions failed', failures, len(pending))
+        sys.exit(1)
+
+
+def job_identifier(job):
+    return str(job.get('job_id') or job['url'].rstrip('/').rsplit('/', 1)[-1])
+
+
+def job_status(job):
+    return job.get('overall_status')
+
+
+def is_finished(status):
+    return (status or '').lower() in SUCCESS_STATUSES + FAILURE_STATUSES
+
+
+def job_state(client, fetcher, job_id):
+    """DONE, FAILED or RUNNING for a copy job, as used by :func:`scripts.utils.pipeline.run_pipeline`."""
+    status = (job_status(fetcher.get_json(client.jobs_id.format(client.uri, job_id))) or '').lower()
+    return DONE if status in SUCCESS_STATUSES else FAILED if status in FAILURE_STATUSES else RUNNING
+
+
+def watch_jobs(client, args):
+    if args.job_id:
+        job_ids = split_list(args.job_id)
+    else:
+        job_ids = [job_identifier(job) for job in client.list_jobs()
+                   if job.get('user') == args.user and not is_finished(job_status(job))]
+    if not job_ids:
+        logging.info('No job to watch')
+        return
+    logging.info('Watching %s job(s)', len(job_ids))
+    from scripts.utils.http import ConditionalFetcher, shared_session
+
+    fetcher = ConditionalFetcher(shared_session())
+
+    def on_change(job_id, old_status, new_status, job):
+        if old_status is None:
+            logging.info('Job %s: %s', job_id, new_status)
+        else:
+            logging.info('Job %s: %s -> %s', job_id, old_status, new_status)
+
+    statuses = follow(job_ids, lambda job_id: fetcher.get_json(client.jobs_id.format(client.uri, job_id)),
+                      job_status, is_finished, on_change, job_identifier, broker_url=args.broker_url,
+                      exchange=args.exchange, routing_key=args.routing_key, resync=args.resync,
+                      concurrency=args.concurrency, initial=args.poll_interval, maximum=args.max_poll_interval,
+                      timeout=args.timeout)
+    failed = [job_id for job_id in job_ids if (statuses.get(job_id) or '').lower() in FAILURE_STATUSES]
+    unfinished = [job_id for job_id in job_ids if not is_finished(statuses.get(job_id))]
+    logging.info('%s job(s) complete, %s failed, %s unfinished',
+                 len(job_ids) - len(failed) - len(unfinished), len(failed), len(unfinished))
+    if failed:
+        sys.exit(1)
+    if unfinished:
+        sys.exit(2)
+
+
+def job_filter(args):
+    statuses = {status.strip().lower() for status in args.status.split(',')} if args.status else None
+    since = parse_datetime(args.since) if args.since else None
+
+    def matches(job):
+        if job.get('user') != args.user:
+            return False
+        if statuses and (job_status(job) or '').lower() not in statuses:
+            return False
+        if since and job.get(JOB_DATE_FIELD) and parse_datetime(job[JOB_DATE_FIELD]) < since:
+            return False
+        return True
+
+    return matches
+
+
+def list_jobs(client, args):
+    """Stream the service job list, keeping only one job in memory at a time.
+
+    Filters are sent to the service as query parameters, and applied again to the
+    streamed jobs for services which ignore them.
+    """
+    params = {'user': args.user}
+    if args.status:
+        params['status'] = args.status
+    if args.since:
+        params['since'] = args.since
+    from scripts.utils.http import shared_session
+
+    records = iter_json_records(shared_session(), client.jobs.format(client.uri), params)
+    jobs = filter(job_filter(args), records)
+    if args.limit:
+        jobs = itertools.islice(jobs, args.limit)
+    if args.format == 'ndjson':
+        write_ndjson(jobs, sys.stdout)
+    else:
+        for job in jobs:
+            try:
+                client.print_job(job, args.user)
+            except KeyError as err:
+                handle_key_error(err, job)
+
+
+def copy_plan(args):
+    from scripts.utils.mysql import database_sizes
+
+    sizes = database_sizes(args.src_server_url, args.src_incl_db)
+    for dbname in split_list(args.src_skip_db):
+        sizes.pop(dbname, None)
+    if not sizes:
+        raise ValueError(f'No database of {args.src_host} matches --src_incl_db')
+    return plan_copies(sizes, split_list(args.tgt_host), args.max_per_target)
+
+
+def print_plan(plan, args):
+    if args.format == 'ndjson':
+        write_ndjson((assignment._asdict() for assignment in plan), sys.stdout)
+        return
+    logging.info('Copy plan of %s database(s), %s copies at a time per target:', len(plan), args.max_per_target)
+    for assignment in plan:
+        logging.info('%s\t%s\t%s', assignment.target, assignment.dbname, format_size(assignment.size))
+    for target, (count, total, end) in target_loads(plan).items():
+        logging.info('Target %s: %s database(s), %s, %s on its busiest slot', target, count, format_size(total),
+                     format_size(end))
+
+
+def submit_plan(client, args):
+    """Submit the copies of the plan, keeping at most ``--max_per_target`` in flight per target.
+
+    Further copies are submitted as earlier ones complete, largest first. Jobs are
+    recorded in ``--checkpoint``, so that running the same command again follows
+    the copies already submitted rather than submitting them again.
+    """
+    plan = copy_plan(args)
+    print_plan(plan, args)
+    targets = {assignment.dbname: assignment.target for assignment in plan}
+    if not args.skip_check:
+        if not check_hosts(client, (args.src_host,), list(dict.fromkeys(targets.values())), host_cache(args),
+                           args.refresh_host_cache):
+            sys.exit(1)
+    from scripts.utils.http import ConditionalFetcher, shared_session
+
+    fetcher = ConditionalFetcher(shared_session())
+
+    def submit_copy(dbname):
+        return submit(client, dict(vars(args), src_incl_db=dbname, tgt_host=targets[dbname]))
+
+    stage = Stage('copy', submit_copy, lambda dbname, job_id: job_state(client, fetcher, job_id),
+                  args.max_per_target, targets.get)
+    with Checkpoint(args.checkpoint) as checkpoint:
+        results = run_pipeline(list(targets), [stage], checkpoint, concurrency=args.concurrency,
+                               initial=args.poll_interval, maximum=args.max_poll_interval, timeout=args.timeout)
+    failed = [dbname for dbname, (_, status) in results.items() if status == FAILED]
+    unfinished = [dbname for dbname, (_, status) in results.items() if status == RUNNING]
+    logging.info('%s copies complete, %s failed, %s unfinished',
+                 len(results) - len(failed) - len(unfinished), len(failed), len(unfinished))
+    if failed:
+        sys.exit(1)
+    if unfinished:
+        sys.exit(2)
+
+
+def main(argv=None):
+    if argv is None:
+        run_in_daemon('scripts.dbcopy_client', sys.argv[1:])
+
     parser = argparse.ArgumentParser(description='Copy Databases via a REST service')
 
     parser.add_argument('-u', '--uri', required=True,
                         help='Copy database REST service URI')
-    parser.add_argument('-a', '--action', choices=['submit', 'retrieve', 'list', 'delete', 'email', 'kill_job'],
+    parser.add_argument('-a', '--action',
+                        choices=['submit', 'bulk-submit', 'plan', 'submit-plan', 'retrieve', 'watch', 'list', 'delete',
+                                 'email', 'kill_job'],
                         required=True, help='Action to take')
-    parser.add_argument('-j', '--job_id', help='Copy job identifier to retrieve')
+    parser.add_argument('-j', '--job_id',
+                        help='Copy job identifier to retrieve. For watch, a comma-separated list of identifiers; '
+                             'defaults to all unfinished jobs of --user')
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
-    parser.add_argument('-s', '--src_host', required=True,
-                        help='Source host for the copy in the form host:port')
-    parser.add_argument('-t', '--tgt_host', required=True,
-                        help='List of hosts to copy to in the form host:port,host:port')
+    parser.add_argument('-s', '--src_host',
+                        help='Source host for the copy in the form host:port. Required for submit')
+    parser.add_argument('-t', '--tgt_host',
+                        help='List of hosts to copy to in the form host:port,host:port. Required for submit')
     parser.add_argument('-i', '--src_incl_db',
                         help='List of databases to include in the copy. If not defined all the databases from the server will be copied')
     parser.add_argument('-k', '--src_skip_db', help='List of database to exclude from the copy')
@@ -58,32 +359,87 @@ def main():
     parser.add_argument('-r', '--user', required=True, help='User name')
     parser.add_argument('--skip-check', action='store_true', default=False,
                         help='Skip host:port server validation')
+    parser.add_argument('--refresh-host-cache', action='store_true', default=False,
+                        help='Validate all hosts again, ignoring previously cached validations')
+    parser.add_argument('--host-cache-ttl', type=int, default=600,
+                        help='Seconds a successful host validation is cached for. 0 disables the cache')
+    parser.add_argument('-m', '--manifest',
+                        help='YAML, TSV or JSONL file of copies to submit with bulk-submit, one row per copy. '
+                             'Columns: ' + ', '.join(MANIFEST_FIELDS) + '. Missing values default to the '
+                             'command line arguments')
+    parser.add_argument('--results_file',
+                        help='JSONL file recording bulk-submit job IDs. Rows already submitted are skipped on re-run')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent bulk submissions')
+    parser.add_argument('--rate_limit', type=float, help='Maximum bulk submissions per second')
+    parser.add_argument('--status', help='List only jobs with these comma-separated statuses')
+    parser.add_argument('--since', help='List only jobs requested on or after this ISO 8601 date or date/time')
+    parser.add_argument('--limit', type=int, help='List at most this many jobs')
+    parser.add_argument('--format', choices=['text', 'ndjson'], default='text',
+                        help='List output format: text log lines, or one JSON job per line on standard output')
+    parser.add_argument('--src_server_url',
+                        help='Source server URL, e.g. mysql://user@host:port/, read for database sizes by plan and '
+                             'submit-plan, which copy the --src_incl_db databases (shell-style patterns) one by one, '
+                             'largest first, spread over the --tgt_host hosts')
+    parser.add_argument('--max_per_target', type=int, default=2,
+                        help='Maximum copies in flight per target host with submit-plan')
+    parser.add_argument('--checkpoint', default='dbcopy_plan.sqlite',
+                        help='SQLite file recording submit-plan jobs. Running again follows the copies submitted')
+    parser.add_argument('--poll_interval', type=float, default=5,
+                        help='Initial seconds between two polls of a watched job')
+    parser.add_argument('--max_poll_interval', type=float, default=300,
+                        help='Maximum seconds between two polls of a watched job')
+    parser.add_argument('--timeout', type=float,
+                        help='Stop watching after this many seconds. Exit status is 1 if any job failed, '
+                             '2 if any job is unfinished')
+
+    add_transport_arguments(parser)
+    add_event_arguments(parser, 'dbcopy')
+    add_outbox_arguments(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.action == 'submit' and not (args.src_host and args.tgt_host):
+        parser.error('--src_host and --tgt_host are required for submit')
+    if args.action == 'bulk-submit' and not args.manifest:
+        parser.error('--manifest is required for bulk-submit')
+    if args.action in ('plan', 'submit-plan') and not (args.src_host and args.tgt_host and args.src_server_url):
+        parser.error(f'--src_host, --tgt_host and --src_server_url are required for {args.action}')
+    if args.action in ('plan', 'submit-plan') and args.tgt_db_name:
+        parser.error(f'--tgt_db_name cannot be used with {args.action}, databases keep their names')
 
     if args.verbose == True:
         logging.basicConfig(level=logging.DEBUG, format='%(message)s')
     else:
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-    client = DbCopyRestClient(args.uri)
+    from ensembl.production.core.clients.dbcopy import DbCopyRestClient
+    from scripts.utils.http import transport_from_args, use_transport
+
+    client = use_transport(DbCopyRestClient(args.uri), transport_from_args(args))
     try:
         if args.action == 'submit':
             logging.info('Submitting %s -> %s', args.src_host, args.tgt_host)
             if not args.skip_check:
-                logging.info('Checking source and target hostname validity...')
-                source_errs = client.check_hosts('source', (args.src_host,))
-                target_errs = client.check_hosts('target', args.tgt_host.split(','))
-                for err in source_errs:
-                    logging.error('Source hostname error: %s', err)
-                for err in target_errs:
-                    logging.error('Target hostname error: %s', err)
-                if source_errs or target_errs:
+                if not check_hosts(client, (args.src_host,), args.tgt_host.split(','), host_cache(args),
+                                   args.refresh_host_cache):
+                    sys.exit(1)
+            if args.outbox:
+                from scripts.outbox import queue_submissions
+                job = {field: getattr(args, field) for field in MANIFEST_FIELDS}
+                _, failures = queue_submissions(args, [('dbcopy', args.uri, job, None)])
+                if failures:
                     sys.exit(1)
-            job_id = client.submit_job(args.src_host, args.src_incl_db, args.src_skip_db, args.src_incl_tables,
-                                       args.src_skip_tables, args.tgt_host, args.tgt_db_name, args.skip_optimize,
-                                       args.wipe_target, args.convert_innodb, args.email_list, args.user)
-            logging.info('Job submitted with ID %s', job_id)
+            else:
+                job_id = submit(client, vars(args))
+                logging.info('Job submitted with ID %s', job_id)
+
+        elif args.action == 'bulk-submit':
+            bulk_submit(client, args)
+
+        elif args.action == 'plan':
+            print_plan(copy_plan(args), args)
+
+        elif args.action == 'submit-plan':
+            submit_plan(client, args)
 
         elif args.action == 'retrieve':
             job = client.retrieve_job(args.job_id)
@@ -91,14 +447,11 @@ def main():
                 client.print_job(job, args.user, print_results=True)
             except KeyError as err:
                 handle_key_error(err, job)
+        elif args.action == 'watch':
+            watch_jobs(client, args)
         elif args.action == 'list':
-            jobs = client.list_jobs()
-            for job in jobs:
-                try:
-                    client.print_job(job, args.user)
-                except KeyError as err:
-                    handle_key_error(err, job)
-    except RuntimeError as err:
+            list_jobs(client, args)
+    except (RuntimeError, ValueError) as err:
         handle_runtime_error(err)
 
 
@@ -12,10 +12,21 @@
 #    limitations under the License.
 
 import argparse
+import hashlib
 import logging
+import os
 import sys
 import json
-from ensembl.production.core.clients.genomemetadata import GenomeMetadataRestClient
+
+from scripts.utils.cache import TTLCache, default_cache_dir
+from scripts.utils.cli import add_transport_arguments
+from scripts.utils.columnar import TableWriter
+from scripts.utils.concurrency import run_bounded
+from scripts.utils.daemon import run_in_daemon
+from scripts.utils.manifest import Journal, read_lines, read_manifest, row_key, split_list
+from scripts.utils.metadata import (dataset_key, dataset_payload, group_attribute_updates, missing_fields,
+                                    update_payload)
+from scripts.utils.streaming import iter_pages, project, write_ndjson
 
 
 def handle_runtime_error(error):
@@ -28,13 +39,215 @@ def handle_key_error(error, job):
     logging.error(msg)
 
 
-def main():
+DEFAULT_CACHE = 'default'
+UUID_FIELDS = {'genomes': 'genome_uuid', 'datasets': 'dataset_uuid'}
+
+
+def open_cache(client, args):
+    path = args.cache
+    if path == DEFAULT_CACHE:
+        digest = hashlib.sha1(client.uri.encode('utf-8')).hexdigest()[:12]
+        path = os.path.join(default_cache_dir(), f'metadata-{digest}.sqlite')
+    return TTLCache(path, ttl=args.cache_ttl)
+
+
+def table_endpoint(client, table):
+    return client.dataset_endpoint if table == 'datasets' else client.genome_endpoint
+
+
+def warm(client, args):
+    """Fill the cache with every record of the table from a single paged sweep."""
+    from scripts.utils.http import shared_session
+
+    uuid_field = UUID_FIELDS[args.table]
+    cache = open_cache(client, args)
+    count = 0
+    try:
+        cache.purge()
+        for page in iter_pages(shared_session(), table_endpoint(client, args.table).format(client.uri),
+                               {'page_size': args.page_size} if args.page_size else None):
+            cache.set_many((f'{args.table}:{record[uuid_field]}', record) for record in page
+                           if record.get(uuid_field))
+            count += len(page)
+    finally:
+        cache.close()
+    logging.info('Cached %s %s', count, args.table)
+
+
+def retrieve(client, args):
+    """Print the records of many UUIDs, served from the cache when enabled, fetching only the misses."""
+    uuids = split_list(args.duuid if args.table == 'datasets' else args.guuid)
+    if args.uuid_file:
+        uuids = list(dict.fromkeys(uuids + read_lines(args.uuid_file)))
+    if not uuids:
+        raise ValueError("Argument missing. Required arguments for dataset get is duuid" if args.table == 'datasets'
+                         else "Argument missing. Required arguments for genome  is guuid")
+    fetch = client.get_dataset_by_uuid if args.table == 'datasets' else client.get_genome_by_uuid
+    cache = open_cache(client, args) if args.cache else None
+    try:
+        records = {}
+        if cache is not None:
+            for uuid in uuids:
+                record = cache.get(f'{args.table}:{uuid}')
+                if record is not None:
+                    records[uuid] = record
+            logging.debug('%s of %s records served from cache', len(records), len(uuids))
+        misses = [uuid for uuid in uuids if uuid not in records]
+        for outcome in run_bounded(fetch, misses, concurrency=args.concurrency):
+            if outcome.error:
+                raise outcome.error
+            records[outcome.item] = outcome.result
+        if cache is not None and misses:
+            cache.set_many((f'{args.table}:{uuid}', records[uuid]) for uuid in misses)
+    finally:
+        if cache is not None:
+            cache.close()
+    for uuid in uuids:
+        print(records[uuid])
+
+
+def export(client, args):
+    """Stream a whole table page by page, keeping only the requested fields of each record."""
+    from scripts.utils.http import shared_session
+
+    endpoint = table_endpoint(client, args.table)
+    params = {'page_size': args.page_size} if args.page_size else None
+    fields = split_list(args.fields)
+    pages = iter_pages(shared_session(), endpoint.format(client.uri), params)
+    if fields:
+        pages = ([project(record, fields) for record in page] for page in pages)
+    if args.format == 'ndjson':
+        out = open(args.output, 'w') if args.output and args.output != '-' else sys.stdout
+        try:
+            for page in pages:
+                write_ndjson(page, out)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return
+    writer = None
+    try:
+        for page in pages:
+            if writer is None:
+                header = fields or list(dict.fromkeys(key for record in page for key in record))
+                writer = TableWriter(args.output or '-', header, args.format)
+            writer.write_rows([[record.get(column) for column in writer.header] for record in page])
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def bulk_submit(client, args):
+    """Create the datasets of a JSONL, TSV or YAML file, skipping those a previous run already created.
+
+    Creations are not retried once sent, which could create a dataset twice: the
+    transport only retries them on connection errors, before the request left.
+    """
+    payloads = [dataset_payload(row, vars(args)) for row in read_manifest(args.input_file)]
+    invalid = [(number, missing_fields(payload)) for number, payload in enumerate(payloads, start=1)
+               if missing_fields(payload)]
+    for number, missing in invalid:
+        logging.error('Row %s: missing %s', number, ', '.join(missing))
+    if invalid:
+        raise ValueError(f"{len(invalid)} invalid row(s) in {args.input_file}")
+    with Journal(args.results_file, done_field='created') as journal:
+        pending = []
+        for number, payload in enumerate(payloads, start=1):
+            key = dataset_key(payload)
+            if journal.is_done(key):
+                logging.info('Row %s: dataset %s already created, skipping', number, payload['name'])
+            else:
+                pending.append((number, key, payload))
+
+        def create(item):
+            return client.create_dataset(item[2])
+
+        failures = 0
+        for outcome in run_bounded(create, pending, concurrency=args.concurrency, rate=args.rate_limit):
+            number, key, payload = outcome.item
+            journal.write({'row': number, 'key': key, 'genome_uuid': payload['genome_uuid'],
+                           'name': payload['name'], 'dataset_type': payload['dataset_type'],
+                           'created': outcome.error is None, 'response': outcome.result,
+                           'error': str(outcome.error) if outcome.error else None})
+            if outcome.error:
+                failures += 1
+                logging.error('Row %s: failed to create dataset %s: %s', number, payload['name'], outcome.error)
+            else:
+                logging.info('Row %s: created dataset %s for genome %s', number, payload['name'],
+                             payload['genome_uuid'])
+    if failures:
+        raise RuntimeError(f"{failures} of {len(pending)} datasets could not be created")
+
+
+def update_dataset(client, payload):
+    """Update the dataset of ``payload['dataset_uuid']``, which ``GenomeMetadataRestClient`` has no call for."""
+    import requests
+    from scripts.utils.http import shared_session
+
+    url = client.dataset_uuid_endpoint.format(client.uri, payload['dataset_uuid'])
+    try:
+        r = shared_session().put(url, json=payload)
+        r.raise_for_status()
+    except requests.RequestException as err:
+        raise RuntimeError(str(err)) from err
+    return r.json()
+
+
+def bulk_update(client, args):
+    """Apply attribute updates from a TSV, JSONL or YAML file, updating each dataset once with all its attributes.
+
+    Updates are idempotent ``PUT`` requests, retried by the transport (``--http_retries``).
+    """
+    if args.user is None:
+        raise ValueError("Argument missing. --user is required for bulk-update")
+    updates, invalid = group_attribute_updates(read_manifest(args.input_file))
+    if invalid:
+        raise ValueError(f"Rows {', '.join(map(str, invalid))} of {args.input_file} need dataset_uuid, name "
+                         f"and value")
+    with Journal(args.results_file, done_field='updated') as journal:
+        pending = []
+        for dataset_uuid, attributes in updates.items():
+            key = row_key({'dataset_uuid': dataset_uuid, 'attributes': attributes})
+            if journal.is_done(key):
+                logging.debug('Dataset %s already updated, skipping', dataset_uuid)
+            else:
+                pending.append((key, dataset_uuid, attributes))
+        logging.info('Updating %s of %s datasets', len(pending), len(updates))
+
+        def update(item):
+            return update_dataset(client, update_payload(args.user, item[1], item[2]))
+
+        failures = 0
+        for outcome in run_bounded(update, pending, concurrency=args.concurrency, rate=args.rate_limit):
+            key, dataset_uuid, attributes = outcome.item
+            journal.write({'key': key, 'dataset_uuid': dataset_uuid, 'attributes': len(attributes),
+                           'updated': outcome.error is None, 'error': str(outcome.error) if outcome.error else None})
+            if outcome.error:
+                failures += 1
+                logging.error('Failed to update dataset %s: %s', dataset_uuid, outcome.error)
+            else:
+                logging.info('Updated %s attribute(s) of dataset %s', len(attributes), dataset_uuid)
+    if failures:
+        raise RuntimeError(f"{failures} of {len(pending)} datasets could not be updated")
+
+
+def main(argv=None):
+    if argv is None:
+        run_in_daemon('scripts.genomemetadata_client', sys.argv[1:])
+
     parser = argparse.ArgumentParser(description='Interact with ensembl genome REST client')
     parser.add_argument('-u', '--uri', required=True, help='Base URI, api. ex:https://services.test.ensembl-production.ebi.ac.uk/')
-    parser.add_argument('-a', '--action', choices=['submit', 'retrieve', 'list', 'update'], required=True, help='Action to take. Options: submit (only for dataset), retrieve, list')
+    parser.add_argument('-a', '--action', choices=['submit', 'bulk-submit', 'retrieve', 'list', 'update', 'bulk-update', 'warm'], required=True, help='Action to take. Options: submit (only for dataset), bulk-submit (only for dataset), retrieve, list, update, bulk-update, warm (fill the --cache)')
+    parser.add_argument('-v', '--verbose', help='Verbose output', action='store_true')
     parser.add_argument('-t', '--table', choices=['datasets', 'genomes'], required=True, help='Table. Options: datasets, genomes')
-    parser.add_argument('-g', '--guuid', help='UUID of genome to retrieve or submit. Required for dataset submission')
-    parser.add_argument('-i', '--duuid', help='UUID of dataset to retrieve or update')
+    parser.add_argument('-g', '--guuid', help='UUID of genome to retrieve or submit. Required for dataset submission. For retrieve, multiple UUIDs comma-separated')
+    parser.add_argument('-i', '--duuid', help='UUID of dataset to retrieve or update. For retrieve, multiple UUIDs comma-separated')
+    parser.add_argument('--uuid_file', help='File listing UUIDs to retrieve, one per line')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE,
+                        help='Serve retrieve from a local cache of records by UUID, filled by warm and by retrieve '
+                             'misses. Optionally the path of the cache, by default one per service URI in the user '
+                             'cache')
+    parser.add_argument('--cache_ttl', type=int, default=86400, help='Seconds cached records stay valid')
     parser.add_argument('--user', help='User registered with this service. Required for dataset submission')
     parser.add_argument('-n', '--name', help='Dataset name. Required for dataset submission')
     parser.add_argument('-d', '--description', help='Description of dataset. Required for dataset submission')
@@ -45,14 +258,43 @@ def main():
     parser.add_argument('-r', '--dataset_attribute', nargs=2, action='append', help='List of dataset attributes in the form "-da name value" ')
     parser.add_argument('-p', '--payload', help='Alternate method with direct submission of a json. Only for create')
     parser.add_argument('--pass', '--password', help='Password')
+    parser.add_argument('-f', '--fields',
+                        help='List only these comma-separated fields. Nested fields are selected with a dot, '
+                             'e.g. organism.scientific_name')
+    parser.add_argument('--format', choices=['ndjson', 'csv', 'parquet'], default='ndjson',
+                        help='List output format: one JSON record per line, or a CSV or Parquet table. Without '
+                             '--fields, table columns are the fields of the first page. Parquet requires pyarrow')
+    parser.add_argument('-o', '--output', help='List output file. Defaults to standard output')
+    parser.add_argument('--page_size', type=int, help='Number of records to request per page when listing or warming the cache')
+    parser.add_argument('--input_file', default='-',
+                        help='JSONL, TSV or YAML file of datasets to create with bulk-submit, either as API payloads '
+                             'or with the submit argument names as columns and one attribute.<name> column per '
+                             'dataset attribute. Missing fields default to the command line arguments. '
+                             'For bulk-update, rows of dataset_uuid, name and value of the attributes to set')
+    parser.add_argument('--results_file',
+                        help='JSONL file recording bulk-submit or bulk-update outcomes. Datasets already created, '
+                             'identified by genome UUID, name and type, or already updated with the same '
+                             'attributes, are skipped on re-run')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent bulk requests')
+    parser.add_argument('--rate_limit', type=float, help='Maximum bulk requests per second')
 
-    args = parser.parse_args()
+    add_transport_arguments(parser)
 
-    client = GenomeMetadataRestClient(args.uri)
+    args = parser.parse_args(argv)
+
+    if args.verbose == True:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    else:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    from ensembl.production.core.clients.genomemetadata import GenomeMetadataRestClient
+    from scripts.utils.http import transport_from_args, use_transport
+
+    client = use_transport(GenomeMetadataRestClient(args.uri), transport_from_args(args))
     try:
         if args.action == 'submit':
             if args.payload is not None:
-                client.create_dataset(args.payload)
+                client.create_dataset(json.loads(args.payload))
             else:
                 required_args = ['guuid', 'user', 'name', 'description', 'label', 'type', 'source_name', 'source_type']
                 if [arg for arg in required_args if getattr(args, arg) is None]:
@@ -75,28 +317,27 @@ def main():
                     "genome_uuid": args.guuid,
                     "dataset_attribute": dataset_attribute,
                 }
-                json_payload = json.dumps(payload)
-                client.create_dataset(json_payload)
+                client.create_dataset(payload)
+
+        elif args.action == 'bulk-submit':
+            bulk_submit(client, args)
 
         elif args.action == 'list':
-            if args.table == 'datasets':
-                print (client.get_all_datasets())
-            elif  args.table == 'genomes':
-                print (client.get_all_genomes())
+            export(client, args)
 
         elif args.action == 'retrieve':
-            if args.table == 'datasets':
-                if args.duuid is None:
-                    raise ValueError("Argument missing. Required arguments for dataset get is duuid")
-                print (client.get_dataset_by_uuid(args.duuid))
+            retrieve(client, args)
+
+        elif args.action == 'warm':
+            if not args.cache:
+                args.cache = DEFAULT_CACHE
+            warm(client, args)
 
-            elif args.table == 'genomes':
-                if args.guuid is None:
-                    raise ValueError("Argument missing. Required arguments for genome  is guuid")
-                print (client.get_genome_by_uuid(args.guuid))
+        elif args.action == 'bulk-update':
+            bulk_update(client, args)
 
         elif args.action == 'update':
-            required_args = ['dataset_uuid', 'user']
+            required_args = ['duuid', 'user']
             if [arg for arg in required_args if getattr(args, arg) is None]:
                 raise ValueError("Argument missing. Required arguments for PUT are " + ", ".join(required_args))
 
@@ -107,13 +348,12 @@ def main():
 
             payload = {
                 "user": args.user,
-                "dataset_uuid": args.dataset_uuid,
+                "dataset_uuid": args.duuid,
                 "dataset_attribute": dataset_attribute
             }
-            json_payload = json.dumps(payload)
-            client.update_dataset(json_payload)
+            update_dataset(client, payload)
 
-    except RuntimeError as err:
+    except (RuntimeError, ValueError) as err:
         handle_runtime_error(err)
 
 
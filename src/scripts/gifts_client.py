@@ -13,11 +13,16 @@
 
 import argparse
 import logging
+import sys
 
-from ensembl.production.core.clients.gifts import GIFTsClient
+from scripts.utils.cli import add_transport_arguments
+from scripts.utils.daemon import run_in_daemon
 
 
-def main():
+def main(argv=None):
+    if argv is None:
+        run_in_daemon('scripts.gifts_client', sys.argv[1:])
+
     parser = argparse.ArgumentParser(description='Ensembl Production: Interact with the GIFTs services')
 
     parser.add_argument('-u', '--uri', help='GIFTs Production service REST URI', required=True)
@@ -30,7 +35,9 @@ def main():
     parser.add_argument('-e', '--email', help='Email address for pipeline reports', required=True)
     parser.add_argument('-t', '--tag', help='Tag for annotating/retrieving a submission')
 
-    args = parser.parse_args()
+    add_transport_arguments(parser)
+
+    args = parser.parse_args(argv)
 
     if args.verbose == True:
         logging.basicConfig(level=logging.DEBUG, format='%(message)s')
@@ -40,7 +47,10 @@ def main():
     if args.uri.endswith('/') == False:
         args.uri = args.uri + '/'
 
-    client = GIFTsClient(args.uri)
+    from ensembl.production.core.clients.gifts import GIFTsClient
+    from scripts.utils.http import transport_from_args, use_transport
+
+    client = use_transport(GIFTsClient(args.uri), transport_from_args(args))
 
     if args.action == 'submit':
         job_id = client.submit_job(args.ensembl_release, args.environment, args.email, args.tag)
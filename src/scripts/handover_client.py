@@ -13,24 +13,217 @@
 
 import argparse
 import logging
-from urllib.parse import urlparse
+import smtplib
+import sys
+from email.message import EmailMessage
 
-from ensembl.production.core.clients.handover import HandoverClient
-from ensembl.production.core.db_utils import validate_mysql_url
+from scripts.utils.cli import add_event_arguments, add_outbox_arguments, add_transport_arguments
+from scripts.utils.concurrency import run_bounded
+from scripts.utils.daemon import run_in_daemon
+from scripts.utils.events import follow
+from scripts.utils.handovers import (HandoverSummaryStore, changed_since, database_name, default_summary_path,
+                                     format_summary, handover_status, in_flight_index, is_failed_status,
+                                     is_terminal_status, latest_report)
+from scripts.utils.manifest import read_lines, split_list
+from scripts.utils.streaming import iter_json_records
 
 
-def main():
+def handover_spec(src_uri, args):
+    return {
+        "src_uri": src_uri,
+        "database": database_name(src_uri),
+        "contact": args.email,
+        "comment": args.description
+    }
+
+
+def bulk_submit(client, args):
+    from ensembl.production.core.db_utils import validate_mysql_url
+
+    src_uris = list(dict.fromkeys(read_lines(args.src_uri_file)))
+    invalid = []
+    for src_uri in src_uris:
+        try:
+            validate_mysql_url(src_uri)
+        except ValueError:
+            invalid.append(src_uri)
+    for src_uri in invalid:
+        logging.error('Wrong database format: %s', src_uri)
+    if invalid:
+        sys.exit(1)
+    specs = {}
+    for src_uri in src_uris:
+        spec = handover_spec(src_uri, args)
+        if spec['database'] in specs:
+            logging.warning('Skipping %s: database %s already listed from %s', src_uri, spec['database'],
+                            specs[spec['database']]['src_uri'])
+        else:
+            specs[spec['database']] = spec
+    in_flight = in_flight_index(client.list_handovers())
+    for database in [database for database in specs if database in in_flight]:
+        logging.warning('Skipping %s: handover %s in progress', database, in_flight[database].get('handover_token'))
+        del specs[database]
+    logging.info('Submitting %s handovers', len(specs))
+    failures = 0
+    if args.outbox:
+        from scripts.outbox import queue_submissions
+        _, failures = queue_submissions(args, [('handover', args.uri, spec, None) for spec in specs.values()])
+    else:
+        for outcome in run_bounded(client.submit_handover, specs.values(), concurrency=args.concurrency,
+                                   rate=args.rate_limit):
+            if outcome.error:
+                failures += 1
+                logging.error('%s failed: %s', outcome.item['database'], outcome.error)
+            else:
+                logging.info('%s submitted with transaction ID %s', outcome.item['database'], outcome.result)
+    if failures:
+        logging.error('%s of %s handovers failed', failures, len(specs))
+        sys.exit(1)
+
+
+def handover_tokens(args):
+    tokens = split_list(args.handover_token)
+    if args.token_file:
+        tokens.extend(read_lines(args.token_file))
+    return list(dict.fromkeys(tokens))
+
+
+def fetch_reports(client, fetcher, token):
+    reports = fetcher.get_json(client.handover_token.format(client.uri, token))
+    return [reports] if isinstance(reports, dict) else reports
+
+
+def retrieve_handovers(client, args):
+    from scripts.utils.http import ConditionalFetcher, shared_session
+
+    fetcher = ConditionalFetcher(shared_session())
+    failures = 0
+    for outcome in run_bounded(lambda token: fetch_reports(client, fetcher, token), handover_tokens(args),
+                               concurrency=args.concurrency):
+        if outcome.error:
+            failures += 1
+            logging.error('Could not retrieve handover %s: %s', outcome.item, outcome.error)
+            continue
+        for report in outcome.result:
+            client.print_handover_detail(report)
+    if failures:
+        sys.exit(1)
+
+
+def watch_handovers(client, args):
+    from scripts.utils.http import ConditionalFetcher, shared_session
+
+    tokens = handover_tokens(args)
+    fetcher = ConditionalFetcher(shared_session())
+
+    def status(reports):
+        report = latest_report(reports)
+        return None if report is None else handover_status(report)
+
+    def on_change(token, old_status, new_status, reports):
+        logging.info('Handover %s: %s', token, new_status)
+        if args.verbose:
+            for report in reports:
+                client.print_handover_detail(report)
+
+    statuses = follow(tokens, lambda token: fetch_reports(client, fetcher, token), status, is_terminal_status,
+                      on_change, lambda report: report.get('handover_token'), broker_url=args.broker_url,
+                      exchange=args.exchange, routing_key=args.routing_key, resync=args.resync,
+                      concurrency=args.concurrency, initial=args.poll_interval, maximum=args.max_poll_interval,
+                      timeout=args.timeout)
+    failed = [token for token in tokens if is_failed_status(statuses.get(token))]
+    unfinished = [token for token in tokens if not is_terminal_status(statuses.get(token))]
+    logging.info('%s handover(s) complete, %s failed, %s unfinished',
+                 len(tokens) - len(failed) - len(unfinished), len(failed), len(unfinished))
+    if failed:
+        sys.exit(1)
+    if unfinished:
+        sys.exit(2)
+
+
+def summarise(store, handovers, contact):
+    """Apply ``handovers`` to ``store`` and render the summary of ``contact``, or of everyone."""
+    changed = store.update(handovers)
+    logging.debug('%s new or changed handovers', changed)
+    return format_summary(store.aggregates(contact), store.latest(contact))
+
+
+def send_summary(args, summary):
+    message = EmailMessage()
+    message['Subject'] = 'Handover summary'
+    message['From'] = args.email
+    message['To'] = args.email
+    message.set_content(summary)
+    try:
+        with smtplib.SMTP(args.smtp_server) as smtp:
+            smtp.send_message(message)
+    except (OSError, smtplib.SMTPException) as err:
+        logging.error('Could not send handover summary to %s through %s: %s', args.email, args.smtp_server, err)
+        sys.exit(1)
+
+
+def incremental_summary(client, args):
+    """Summarise handovers from locally kept running counts, updated with the handovers changed since last run.
+
+    The listing is read only down to the handovers reported before the last run,
+    see :func:`~scripts.utils.handovers.changed_since`.
+    """
+    from scripts.utils.http import shared_session
+
+    with HandoverSummaryStore(args.summary_state or default_summary_path(client.uri)) as store:
+        listing = iter_json_records(shared_session(), client.handovers.format(client.uri))
+        summary = summarise(store, changed_since(listing, store.watermark), args.email)
+    logging.info(summary)
+    if args.send_email:
+        send_summary(args, summary)
+
+
+def main(argv=None):
+    if argv is None:
+        run_in_daemon('scripts.handover_client', sys.argv[1:])
+
     parser = argparse.ArgumentParser(description='Handover a database via a REST service')
     parser.add_argument('-u', '--uri', help='HC REST service URI', required=True)
     parser.add_argument('-a', '--action', help='Action to take',
-                        choices=['submit', 'retrieve', 'list', 'delete', 'summary'], required=True)
+                        choices=['submit', 'bulk-submit', 'retrieve', 'watch', 'list', 'delete', 'summary'],
+                        required=True)
     parser.add_argument('-v', '--verbose', help='Verbose output', action='store_true')
     parser.add_argument('-s', '--src_uri', help='URI of database to hand over')
+    parser.add_argument('-f', '--src_uri_file', default='-',
+                        help='File listing URIs of databases to hand over with bulk-submit, one per line. '
+                             'Defaults to standard input')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Compute summary from running counts kept locally, reading the handover listing, '
+                             'most recent first, only down to the handovers reported before the previous summary')
+    parser.add_argument('--summary_state',
+                        help='SQLite file holding the incremental summary state. Defaults to one per service URI '
+                             'in the user cache')
+    parser.add_argument('--send_email', action='store_true',
+                        help='Email the summary of the handovers of --email to that address')
+    parser.add_argument('--smtp_server', default='localhost', help='SMTP server sending summary emails')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Number of concurrent bulk submissions, retrieves or watch polls')
+    parser.add_argument('--rate_limit', type=float, help='Maximum bulk submissions per second')
     parser.add_argument('-e', '--email', help='Email address')
     parser.add_argument('-c', '--description', help='Description')
-    parser.add_argument('-t', '--handover_token', help='Handover token')
+    parser.add_argument('-t', '--handover_token',
+                        help='Handover token. For retrieve and watch, multiple tokens comma-separated')
+    parser.add_argument('--token_file', help='File listing handover tokens to retrieve or watch, one per line')
+    parser.add_argument('--poll_interval', type=float, default=5,
+                        help='Initial seconds between two polls of a watched handover')
+    parser.add_argument('--max_poll_interval', type=float, default=300,
+                        help='Maximum seconds between two polls of a watched handover')
+    parser.add_argument('--timeout', type=float,
+                        help='Stop watching after this many seconds. Exit status is 1 if any handover failed, '
+                             '2 if any handover is unfinished')
+
+    add_transport_arguments(parser)
+    add_event_arguments(parser, 'handover')
+    add_outbox_arguments(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.send_email and not args.email:
+        parser.error('--send_email requires -e/--email')
 
     if args.verbose == True:
         logging.basicConfig(level=logging.DEBUG, format='%(message)s')
@@ -40,34 +233,46 @@ def main():
     if args.uri.endswith('/') == False:
         args.uri = args.uri + '/'
 
-    client = HandoverClient(args.uri)
+    from ensembl.production.core.clients.handover import HandoverClient
+    from ensembl.production.core.db_utils import validate_mysql_url
+    from scripts.utils.http import transport_from_args, use_transport
+
+    client = use_transport(HandoverClient(args.uri), transport_from_args(args))
 
     if args.action == 'submit':
         try:
             validate_mysql_url(args.src_uri)
         except ValueError:
             raise ValueError("Wrong database format")
-        parsed_uri = urlparse(args.src_uri)
-
-        spec = {
-            "src_uri": args.src_uri,
-            "database": parsed_uri.path[1:],
-            "contact": args.email,
-            "comment": args.description
-        }
+        spec = handover_spec(args.src_uri, args)
         logging.debug(spec)
-        handover_id = client.submit_handover(spec)
-        logging.info('Job submitted with transaction ID ' + str(handover_id))
+        if args.outbox:
+            from scripts.outbox import queue_submissions
+            _, failures = queue_submissions(args, [('handover', args.uri, spec, None)])
+            if failures:
+                sys.exit(1)
+        else:
+            handover_id = client.submit_handover(spec)
+            logging.info('Job submitted with transaction ID ' + str(handover_id))
+    elif args.action == 'bulk-submit':
+        bulk_submit(client, args)
     elif args.action == 'list':
         handovers = client.list_handovers()
         for handover in handovers:
             client.print_handover_detail(handover)
     elif args.action == 'retrieve':
-        handover = client.retrieve_handover(args.handover_token)
-        client.print_handover_detail(handover[0])
+        retrieve_handovers(client, args)
+    elif args.action == 'watch':
+        watch_handovers(client, args)
     elif args.action == 'summary':
-        handovers = client.list_handovers()
-        client.handover_summary_email(handovers, args.email)
+        if args.incremental:
+            incremental_summary(client, args)
+        else:
+            handovers = client.list_handovers()
+            client.handover_summary_email(handovers, args.email)
+            if args.send_email:
+                with HandoverSummaryStore(':memory:') as store:
+                    send_summary(args, summarise(store, handovers, args.email))
     else:
         logging.error("Action " + args.action + " not supported")
 
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import argparse
+import logging
+import sys
+import threading
+
+from scripts.utils.cli import add_outbox_arguments, add_transport_arguments
+from scripts.utils.daemon import run_in_daemon
+from scripts.utils.outbox import FAILED, PENDING, SENDING, SENT, Flusher, Outbox, default_outbox_path, flush
+
+CLIENTS = {
+    'dbcopy': ('ensembl.production.core.clients.dbcopy', 'DbCopyRestClient'),
+    'datacheck': ('ensembl.production.core.clients.datachecks', 'DatacheckClient'),
+    'handover': ('ensembl.production.core.clients.handover', 'HandoverClient'),
+}
+# Submissions queued at once, so that the flusher starts sending while a large burst is still being queued
+QUEUE_CHUNK = 500
+
+
+def submit_handover(client, spec):
+    result = client.submit_handover(spec)
+    return result.get('handover_token', result) if isinstance(result, dict) else result
+
+
+def submit_payload(service, client, payload):
+    if service == 'dbcopy':
+        from scripts.dbcopy_client import submit
+        return submit(client, payload)
+    if service == 'datacheck':
+        return client.submit_job(**payload)
+    return submit_handover(client, payload)
+
+
+def outbox_path(args):
+    return default_outbox_path() if args.outbox in (None, 'default') else args.outbox
+
+
+def sender(args):
+    """``send(entry)`` submitting an outbox entry with a client of its service, built once per service URI."""
+    import importlib
+    from scripts.utils.http import idempotency_key, transport_from_args, use_transport
+
+    session = transport_from_args(args)
+    clients = {}
+    lock = threading.Lock()
+
+    def send(entry):
+        with lock:
+            if (entry.service, entry.uri) not in clients:
+                module, name = CLIENTS[entry.service]
+                client_class = getattr(importlib.import_module(module), name)
+                clients[entry.service, entry.uri] = use_transport(client_class(entry.uri), session)
+            client = clients[entry.service, entry.uri]
+        with idempotency_key(entry.key):
+            return submit_payload(entry.service, client, entry.payload)
+
+    return send
+
+
+def flusher_options(args):
+    from scripts.utils.http import is_transient_error
+
+    return {'batch_size': args.outbox_batch, 'concurrency': args.concurrency, 'rate': args.rate_limit,
+            'max_attempts': args.outbox_attempts, 'is_transient': is_transient_error, 'timeout': args.outbox_timeout}
+
+
+def report(flusher, outbox):
+    counts = outbox.counts()
+    pending = counts.get(PENDING, 0)
+    logging.info('%s submission(s) sent, %s failed, %s still queued', flusher.sent, flusher.failed, pending)
+    if counts.get(SENDING):
+        logging.info('%s submission(s) being sent by another command', counts[SENDING])
+    if pending:
+        logging.info('Queued submissions are kept in %s and sent by "prodinf outbox flush"', outbox.path)
+
+
+def queue_submissions(args, submissions):
+    """Queue ``(service, uri, payload, key)`` submissions in the outbox of ``--outbox`` and send them from it.
+
+    A background flusher sends the submissions while they are being queued, and
+    keeps retrying those failing with a transient error until ``--outbox_timeout``.
+    Submissions already in the outbox under the same key are not queued again:
+    their job identifier, or their error, is reported instead. Returns the list
+    of job identifiers, ``None`` for submissions not sent, and the number of
+    submissions which failed.
+    """
+    with Outbox(outbox_path(args)) as outbox:
+        submissions = list(submissions)
+        keys = [outbox.key_of(*submission) for submission in submissions]
+        for key, (status, job_id, error) in outbox.results(keys).items():
+            if status == SENT:
+                logging.info('Submission %s was already sent with ID %s', key, job_id)
+            elif status == FAILED:
+                logging.error('Submission %s failed in an earlier run: %s. Queue it again with '
+                              '"prodinf outbox retry"', key, error)
+            elif status == SENDING:
+                logging.info('Submission %s is being sent by another command', key)
+            else:
+                logging.info('Submission %s is already queued', key)
+        flusher = Flusher(outbox, sender(args), **flusher_options(args))
+        flusher.start()
+        for start in range(0, len(submissions), QUEUE_CHUNK):
+            outbox.add_many(submissions[start:start + QUEUE_CHUNK])
+            flusher.wake()
+        logging.info('Queued %s submission(s) in %s', len(submissions), outbox.path)
+        flusher.close()
+        flusher.join()
+        report(flusher, outbox)
+        results = outbox.results(keys)
+    failures = sum(1 for status, _, _ in results.values() if status == FAILED)
+    return [results[key][1] if results[key][0] == SENT else None for key in keys], failures
+
+
+def main(argv=None):
+    if argv is None:
+        run_in_daemon('scripts.outbox', sys.argv[1:])
+
+    parser = argparse.ArgumentParser(description='Send the submissions queued in the local outbox')
+
+    parser.add_argument('-a', '--action', choices=['flush', 'status', 'retry'], required=True,
+                        help='Action to take: send the queued submissions, list the submissions, or queue the '
+                             'failed submissions again')
+    parser.add_argument('--status', choices=[PENDING, SENDING, SENT, FAILED],
+                        help='List only submissions in this status')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent submissions')
+    parser.add_argument('--rate_limit', type=float, help='Maximum submissions per second')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
+
+    add_outbox_arguments(parser)
+    add_transport_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    else:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    with Outbox(outbox_path(args)) as outbox:
+        if args.action == 'flush':
+            flusher = flush(outbox, sender(args), **flusher_options(args))
+            report(flusher, outbox)
+            if flusher.failed:
+                sys.exit(1)
+        elif args.action == 'status':
+            for key, service, status, attempts, job_id, error in outbox.entries(args.status):
+                logging.info('%s\t%s\t%s\t%s\t%s', key, service, status, attempts, job_id or error or '-')
+            logging.info(', '.join(f'{count} {status}' for status, count in sorted(outbox.counts().items()))
+                         or 'Outbox is empty')
+        elif args.action == 'retry':
+            logging.info('%s failed submission(s) queued again', outbox.retry_failed())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import argparse
+import logging
+import sys
+
+from scripts.utils.cli import add_transport_arguments
+from scripts.utils.daemon import run_in_daemon
+from scripts.utils.handovers import handover_result, handover_status, latest_report
+from scripts.utils.manifest import read_lines, split_list
+from scripts.utils.pipeline import DONE, FAILED, RUNNING, Checkpoint, Stage, run_pipeline
+
+STAGES = ('copy', 'datacheck', 'handover')
+
+
+def database_uri(server_url, dbname):
+    return server_url.rstrip('/') + '/' + dbname
+
+
+def copy_stage(args, fetcher):
+    from ensembl.production.core.clients.dbcopy import DbCopyRestClient
+    from scripts.dbcopy_client import job_state
+    from scripts.utils.http import transport_from_args, use_transport
+
+    client = use_transport(DbCopyRestClient(args.dbcopy_uri), transport_from_args(args))
+
+    def submit(dbname):
+        return client.submit_job(args.src_host, dbname, None, None, None, args.tgt_host, None, 0, 0, 0,
+                                 args.email, args.user)
+
+    return Stage('copy', submit, lambda dbname, job_id: job_state(client, fetcher, job_id), args.copy_concurrency)
+
+
+def datacheck_stage(args, fetcher):
+    from ensembl.production.core.clients.datachecks import DatacheckClient
+    from scripts.utils.http import transport_from_args, use_transport
+
+    client = use_transport(DatacheckClient(args.datacheck_uri), transport_from_args(args))
+
+    def submit(dbname):
+        return client.submit_job(args.server_url, dbname, None, None, None, args.datacheck_names,
+                                 args.datacheck_groups, None, args.email, args.tag, None)
+
+    def poll(dbname, job_id):
+        job = fetcher.get_json(client.jobs_id.format(client.uri, job_id))
+        status = job.get('status')
+        if status == 'complete':
+            # Datacheck failures leave the database unfit for handover
+            return FAILED if (job.get('output') or {}).get('failed_total') else DONE
+        return FAILED if status == 'failed' else RUNNING
+
+    return Stage('datacheck', submit, poll, args.datacheck_concurrency)
+
+
+def handover_stage(args, fetcher):
+    from ensembl.production.core.clients.handover import HandoverClient
+    from scripts.handover_client import fetch_reports
+    from scripts.utils.http import transport_from_args, use_transport
+
+    client = use_transport(HandoverClient(args.handover_uri), transport_from_args(args))
+
+    def submit(dbname):
+        result = client.submit_handover({'src_uri': database_uri(args.server_url, dbname), 'database': dbname,
+                                         'contact': args.email, 'comment': args.description})
+        return result['handover_token'] if isinstance(result, dict) else result
+
+    def poll(dbname, token):
+        report = latest_report(fetch_reports(client, fetcher, token))
+        result = handover_result(handover_status(report)) if report else 'in progress'
+        return DONE if result == 'success' else FAILED if result == 'failed' else RUNNING
+
+    return Stage('handover', submit, poll, args.handover_concurrency)
+
+
+def pipeline_stages(args):
+    from scripts.utils.http import ConditionalFetcher, shared_session
+
+    builders = {'copy': copy_stage, 'datacheck': datacheck_stage, 'handover': handover_stage}
+    fetcher = ConditionalFetcher(shared_session())
+    return [builders[name](args, fetcher) for name in args.stages]
+
+
+def run(args):
+    dbnames = split_list(args.dbname)
+    if args.dbname_file:
+        dbnames.extend(read_lines(args.dbname_file))
+    dbnames = list(dict.fromkeys(dbnames))
+    if not dbnames:
+        raise ValueError('No database to process: use --dbname or --dbname_file')
+    stages = pipeline_stages(args)
+    logging.info('Running %s database(s) through %s', len(dbnames), ' -> '.join(args.stages))
+    with Checkpoint(args.checkpoint) as checkpoint:
+        results = run_pipeline(dbnames, stages, checkpoint, concurrency=args.concurrency,
+                               initial=args.poll_interval, maximum=args.max_poll_interval,
+                               retry_failed=args.retry_failed, timeout=args.timeout)
+    failed = sorted(dbname for dbname, (_, status) in results.items() if status == FAILED)
+    unfinished = sorted(dbname for dbname, (_, status) in results.items() if status == RUNNING)
+    for dbname in failed:
+        logging.error('%s failed at %s', dbname, results[dbname][0])
+    for dbname in unfinished:
+        logging.warning('%s still running %s', dbname, results[dbname][0])
+    logging.info('%s database(s) done, %s failed, %s unfinished',
+                 len(results) - len(failed) - len(unfinished), len(failed), len(unfinished))
+    if failed:
+        sys.exit(1)
+    if unfinished:
+        sys.exit(2)
+
+
+def status(args):
+    with Checkpoint(args.checkpoint) as checkpoint:
+        for item, stage, stage_status, job_id, message in checkpoint.rows():
+            logging.info('%s\t%s\t%s\t%s%s', item, stage, stage_status, job_id or '-',
+                         f'\t{message}' if message else '')
+
+
+def main(argv=None):
+    if argv is None:
+        run_in_daemon('scripts.pipeline', sys.argv[1:])
+
+    parser = argparse.ArgumentParser(description='Copy, datacheck and hand over databases, each as soon as ready')
+
+    parser.add_argument('-a', '--action', choices=['run', 'status'], required=True, help='Action to take')
+    parser.add_argument('-d', '--dbname', help='Comma-separated list of databases to process')
+    parser.add_argument('-f', '--dbname_file', help='File of databases to process, one per line')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='Comma-separated stages to run each database through, in order, among '
+                             + ', '.join(STAGES))
+    parser.add_argument('--dbcopy_uri', help='Copy database REST service URI')
+    parser.add_argument('--datacheck_uri', help='Datacheck REST service URI')
+    parser.add_argument('--handover_uri', help='Handover REST service URI')
+    parser.add_argument('-s', '--src_host', help='Source host of the copies in the form host:port')
+    parser.add_argument('-t', '--tgt_host', help='Host to copy to in the form host:port')
+    parser.add_argument('--server_url',
+                        help='Target server URL, e.g. mysql://user@host:port/, datachecked and handed over from')
+    parser.add_argument('-e', '--email', help='Email address for the copies, datachecks and handovers')
+    parser.add_argument('-r', '--user', help='User name of the copies')
+    parser.add_argument('--datacheck_names', help='Comma-separated list of datacheck names')
+    parser.add_argument('--datacheck_groups', help='Comma-separated list of datacheck groups')
+    parser.add_argument('--tag', help='Tag of the datacheck jobs')
+    parser.add_argument('-c', '--description', help='Description of the handovers')
+    parser.add_argument('--copy_concurrency', type=int, default=4, help='Maximum copies in flight')
+    parser.add_argument('--datacheck_concurrency', type=int, default=8, help='Maximum datacheck jobs in flight')
+    parser.add_argument('--handover_concurrency', type=int, default=8, help='Maximum handovers in flight')
+    parser.add_argument('--checkpoint', default='pipeline.sqlite',
+                        help='SQLite file recording the progress of every database. Running again resumes from it')
+    parser.add_argument('--retry_failed', action='store_true',
+                        help='Run again the failed stage of databases which failed in a previous run')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent submissions and polls')
+    parser.add_argument('--poll_interval', type=float, default=30,
+                        help='Initial seconds between two polls of a job')
+    parser.add_argument('--max_poll_interval', type=float, default=300,
+                        help='Maximum seconds between two polls of a job')
+    parser.add_argument('--timeout', type=float,
+                        help='Stop after this many seconds. Exit status is 1 if any database failed, '
+                             '2 if any database is unfinished')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
+
+    add_transport_arguments(parser)
+
+    args = parser.parse_args(argv)
+    args.stages = split_list(args.stages)
+    unknown = [stage for stage in args.stages if stage not in STAGES]
+    if unknown or not args.stages:
+        parser.error(f"--stages must be a list of {', '.join(STAGES)}")
+    if args.action == 'run':
+        required = {'copy': ('dbcopy_uri', 'src_host', 'tgt_host', 'email', 'user'),
+                    'datacheck': ('datacheck_uri', 'server_url'),
+                    'handover': ('handover_uri', 'server_url', 'email', 'description')}
+        missing = sorted({option for stage in args.stages for option in required[stage]
+                          if not getattr(args, option)})
+        if missing:
+            parser.error('required for these stages: ' + ', '.join('--' + option for option in missing))
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    else:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        if args.action == 'run':
+            run(args)
+        elif args.action == 'status':
+            status(args)
+    except (RuntimeError, ValueError) as err:
+        logging.error("Error: %s", err)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
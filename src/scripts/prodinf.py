@@ -0,0 +1,73 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Single ``prodinf <service> <action> [options]`` command dispatching to the client scripts.
+
+Only the script of the requested service is imported, and the scripts import
+their service client once arguments are parsed, so ``--help`` and usage errors
+never pay for loading requests, SQLAlchemy or the core clients. When the local
+daemon (``prodinf daemon start``) is running, commands are run by it instead.
+"""
+
+import importlib
+import sys
+
+from scripts.utils.daemon import run_in_daemon
+
+SERVICES = {
+    'datacheck': ('scripts.datacheck_client', 'Submit and query datachecks'),
+    'dbcopy': ('scripts.dbcopy_client', 'Submit and follow database copies'),
+    'gifts': ('scripts.gifts_client', 'Submit and retrieve GIFTs jobs'),
+    'handover': ('scripts.handover_client', 'Hand over databases and follow handovers'),
+    'metadata': ('scripts.genomemetadata_client', 'Query and update the genome metadata'),
+    'outbox': ('scripts.outbox', 'Send the submissions queued in the local outbox'),
+    'pipeline': ('scripts.pipeline', 'Copy, datacheck and hand over databases, each as soon as ready'),
+    'daemon': ('scripts.daemon', 'Keep the clients loaded in a local process running the other commands'),
+}
+
+
+def usage():
+    width = max(map(len, SERVICES))
+    services = '\n'.join(f'  {name:<{width}}  {description}' for name, (_, description) in SERVICES.items())
+    return (f"usage: prodinf <service> <action> [options]\n\nservices:\n{services}\n\n"
+            f"Run 'prodinf <service> --help' for the actions and options of a service.")
+
+
+def parse_command(argv):
+    """Split ``<service> [<action>] [options]`` into the script module and its own arguments."""
+    service, arguments = argv[0], list(argv[1:])
+    if service not in SERVICES:
+        raise ValueError(f"Unknown service '{service}'")
+    if arguments and not arguments[0].startswith('-'):
+        arguments[:1] = ['--action', arguments[0]]
+    return SERVICES[service][0], arguments
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 2
+    try:
+        module, arguments = parse_command(argv)
+    except ValueError as e:
+        print(f"prodinf: {e}\n\n{usage()}", file=sys.stderr)
+        return 2
+    if argv[0] != 'daemon':
+        run_in_daemon(module, arguments)
+    sys.argv[0] = f'prodinf {argv[0]}'
+    return importlib.import_module(module).main(arguments)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
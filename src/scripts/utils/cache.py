@@ -0,0 +1,80 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Small on-disk key/value cache with per-entry expiry."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def default_cache_dir():
+    """Per-user cache directory, honouring ``XDG_CACHE_HOME``."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ensembl-prodinf-tools')
+
+
+class TTLCache:
+    """JSON values stored in a SQLite file, each valid for ``ttl`` seconds.
+
+    The cache is safe to share between threads. A ``path`` of ``None`` keeps the
+    cache in memory for the lifetime of the process.
+    """
+
+    def __init__(self, path=None, ttl=600, clock=time.time):
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+        self._db.commit()
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._db.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < self._clock():
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                             (key, json.dumps(value), expires))
+            self._db.commit()
+
+    def set_many(self, items, ttl=None):
+        """Store ``(key, value)`` pairs in a single transaction."""
+        expires = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                                 ((key, json.dumps(value), expires) for key, value in items))
+            self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._db.commit()
+
+    def purge(self):
+        """Drop expired entries."""
+        with self._lock:
+            self._db.execute('DELETE FROM cache WHERE expires < ?', (self._clock(),))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
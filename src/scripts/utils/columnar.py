@@ -0,0 +1,170 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Column oriented storage and aggregation of datacheck results.
+
+Results are kept as one array of integer codes per column, each code indexing
+the column's distinct values, rather than as one dictionary per result. Counts
+are computed with ``collections.Counter`` over whole code arrays, so
+aggregating hundreds of thousands of results runs in C loops and allocates no
+per-row Python object.
+"""
+
+import csv
+import json
+import sys
+from array import array
+from collections import Counter
+from itertools import compress
+
+RESULT_COLUMNS = ('dbname', 'species', 'db_type', 'division', 'datacheck', 'status')
+SUMMARY_COLUMNS = ('dimension', 'value', 'failed', 'total')
+
+
+class ResultColumns:
+    """Dictionary encoded datacheck result columns."""
+
+    def __init__(self, columns=RESULT_COLUMNS):
+        self.columns = tuple(columns)
+        self.codes = {column: array('I') for column in self.columns}
+        self.values = {column: [] for column in self.columns}
+        self._lookup = {column: {} for column in self.columns}
+
+    def __len__(self):
+        return len(self.codes[self.columns[0]])
+
+    def _encode(self, column, value):
+        lookup = self._lookup[column]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self.values[column])
+            self.values[column].append(value)
+        return code
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            self.codes[column].append(self._encode(column, value))
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def column(self, name):
+        """Decoded values of a column."""
+        return list(map(self.values[name].__getitem__, self.codes[name]))
+
+    def mask(self, name, value):
+        """Boolean selector of the rows where column ``name`` equals ``value``."""
+        code = self._lookup[name].get(value)
+        return [False] * len(self) if code is None else list(map(code.__eq__, self.codes[name]))
+
+    def aggregate(self, by, status='failed'):
+        """``(value, failed, total)`` for every distinct value of column ``by``, most failures first."""
+        totals = Counter(self.codes[by])
+        failures = Counter(compress(self.codes[by], self.mask('status', status)))
+        values = self.values[by]
+        rows = [(values[code], failures[code], total) for code, total in totals.items()]
+        rows.sort(key=lambda row: (-row[1], -row[2], str(row[0])))
+        return rows
+
+    def summary(self, dimensions):
+        """Long format summary rows of :attr:`SUMMARY_COLUMNS` for each of the ``dimensions``."""
+        for dimension in dimensions:
+            for value, failed, total in self.aggregate(dimension):
+                yield dimension, value, failed, total
+
+
+class TableWriter:
+    """Write rows to a CSV file, or to a Parquet file when ``fmt`` is ``parquet`` or ``path`` ends with ``.parquet``.
+
+    Rows are written batch by batch, each Parquet batch as a row group, so
+    memory is bounded by the batch size. Parquet output requires ``pyarrow``.
+    Values which are not scalars are written as JSON.
+
+    The Parquet schema is inferred from the first batch, with columns holding
+    only ``None`` there typed as strings, and every batch is converted to it.
+    Values of a string column are written as their text.
+    """
+
+    def __init__(self, path, header, fmt=None):
+        self.path = path
+        self.header = list(header)
+        self._parquet = fmt == 'parquet' or (fmt is None and path.endswith('.parquet'))
+        self._writer = None
+        self._schema = None
+        if self._parquet:
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise RuntimeError('Parquet output requires the pyarrow package')
+            if path == '-':
+                raise ValueError('Parquet output must be written to a file')
+            self._pyarrow = pyarrow
+            self._fh = None
+        else:
+            self._fh = sys.stdout if path == '-' else open(path, 'w', newline='')
+            self._writer = csv.writer(self._fh)
+            self._writer.writerow(self.header)
+
+    def write_rows(self, rows):
+        rows = [[_scalar(value) for value in row] for row in rows]
+        if not self._parquet:
+            self._writer.writerows(rows)
+            return
+        if not rows:
+            return
+        pa = self._pyarrow
+        columns = [list(values) for values in zip(*rows)]
+        if self._schema is None:
+            import pyarrow.parquet
+            inferred = pa.table(dict(zip(self.header, columns))).schema
+            self._schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                      for field in inferred])
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, self._schema)
+        arrays = []
+        for field, values in zip(self._schema, columns):
+            if pa.types.is_string(field.type):
+                values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+            try:
+                arrays.append(pa.array(values, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as err:
+                raise ValueError(f"Column {field.name} does not match its {field.type} type "
+                                 f"inferred from the first rows: {err}") from err
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        if self._parquet:
+            if self._writer is not None:
+                self._writer.close()
+        elif self._fh is not sys.stdout:
+            self._fh.close()
+        else:
+            self._fh.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _scalar(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return value
+
+
+def write_table(path, header, rows):
+    """Write all rows at once with a :class:`TableWriter`."""
+    with TableWriter(path, header) as writer:
+        writer.write_rows(rows)
@@ -0,0 +1,93 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Bounded, rate limited execution of service calls from a thread pool."""
+
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+Outcome = namedtuple('Outcome', 'item result error')
+
+
+class RateLimiter:
+    """Spread calls so that no more than ``rate`` of them start per second.
+
+    A ``rate`` of ``None`` or ``0`` disables the limit.
+    """
+
+    def __init__(self, rate=None, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = None
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = self._clock()
+            start = now if self._next is None else max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            self._sleep(start - now)
+
+
+def run_bounded(func, items, concurrency=4, rate=None):
+    """Call ``func(item)`` for every item using at most ``concurrency`` threads.
+
+    Items are pulled lazily from ``items`` so that only ``concurrency`` calls are
+    ever in flight, and an :class:`Outcome` is yielded for each item as soon as
+    its call completes (i.e. not in input order). Exceptions raised by ``func``
+    are captured in ``Outcome.error`` rather than interrupting the run.
+    """
+    if concurrency < 1:
+        raise ValueError('Concurrency must be at least 1')
+    limiter = RateLimiter(rate)
+
+    def call(item):
+        limiter.acquire()
+        return func(item)
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        for item in items:
+            pending[executor.submit(call, item)] = item
+            if len(pending) >= concurrency:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield Outcome(item, None if error else future.result(), error)
+                for item in items:
+                    pending[executor.submit(call, item)] = item
+                    break
+
+
+def retry_call(func, attempts=3, initial=1.0, factor=2.0, retry_on=lambda error: True, sleep=time.sleep):
+    """Call ``func()``, retrying up to ``attempts`` times in total on errors accepted by ``retry_on``.
+
+    Waits grow exponentially from ``initial`` seconds, with full jitter so that
+    concurrent callers retrying the same failure do not retry in lockstep.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except Exception as error:
+            if attempt == attempts or not retry_on(error):
+                raise
+            sleep(random.uniform(0, initial * factor ** (attempt - 1)))
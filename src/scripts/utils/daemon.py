@@ -0,0 +1,307 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Optional long-lived process running client commands with warm imports and pooled connections.
+
+The daemon listens on a Unix socket. A client script that finds the socket
+sends its module, arguments and working directory along with its own standard
+input, output and error file descriptors, then waits for the exit status. The
+daemon runs the command writing straight to those descriptors, so output
+streams as if the command ran locally while the service clients and the shared
+HTTP session stay loaded between commands.
+
+Commands carry credentials in their arguments, so the socket lives in a
+directory only its user can enter, and both ends check that the other one runs
+as the same user. Commands share the process state (HTTP session, timings,
+standard streams, working directory), so they run one at a time. Actions
+which can run for long, watching jobs or sending many submissions, would hold
+up every other command: they are never forwarded and run in the calling
+process.
+
+Commands run with the daemon's environment and logging level.
+"""
+
+import array
+import contextlib
+import importlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import traceback
+
+from scripts.utils import timing
+
+SOCKET_ENV = 'PRODINF_DAEMON_SOCKET'
+DISABLE_ENV = 'PRODINF_NO_DAEMON'
+STDIO_FDS = (0, 1, 2)
+# Actions of each client script which run in the calling process rather than in the daemon
+LOCAL_ACTIONS = {
+    'scripts.datacheck_client': ('bulk-submit', 'watch'),
+    'scripts.dbcopy_client': ('bulk-submit', 'submit-plan', 'watch'),
+    'scripts.genomemetadata_client': ('bulk-submit', 'bulk-update', 'warm'),
+    'scripts.handover_client': ('bulk-submit', 'watch'),
+    'scripts.outbox': ('flush',),
+    'scripts.pipeline': ('run',),
+}
+# Options which start a long-running part of any command, e.g. the outbox flusher
+LOCAL_OPTIONS = ('--outbox',)
+
+
+def private_directory():
+    """Directory for the socket only the current user can access: the user runtime directory if any."""
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.environ['XDG_RUNTIME_DIR']
+    path = os.path.join(tempfile.gettempdir(), f'prodinf-{os.getuid()}')
+    with contextlib.suppress(FileExistsError):
+        os.mkdir(path, 0o700)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f'{path} is not a directory private to the current user')
+    return path
+
+
+def default_socket_path():
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    return os.path.join(private_directory(), 'prodinf-daemon.sock')
+
+
+def is_own_socket(path):
+    """Whether ``path`` is a socket created by the current user."""
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+
+def peer_uid(sock):
+    """User ID of the process at the other end of a Unix socket, or ``None`` where the platform cannot tell."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+def is_own_peer(sock):
+    return peer_uid(sock) in (None, os.getuid())
+
+
+def command_action(argv):
+    """Value of the ``-a/--action`` argument in ``argv``, or ``None``."""
+    for position, argument in enumerate(argv):
+        if argument in ('-a', '--action'):
+            return argv[position + 1] if position + 1 < len(argv) else None
+        if argument.startswith('--action='):
+            return argument.split('=', 1)[1]
+        if argument.startswith('-a') and not argument.startswith('--'):
+            return argument[2:]
+    return None
+
+
+def runs_locally(module, argv):
+    """Whether the command may run for long, and so is not forwarded to the daemon."""
+    if any(argument.split('=', 1)[0] in LOCAL_OPTIONS for argument in argv):
+        return True
+    return command_action(argv) in LOCAL_ACTIONS.get(module, ())
+
+
+def _send(sock, message, fds=()):
+    data = json.dumps(message).encode('utf-8') + b'\n'
+    if fds:
+        sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+    else:
+        sock.sendall(data)
+
+
+def _receive(sock, max_fds=0):
+    """Read one JSON line from ``sock``, with the file descriptors sent alongside it."""
+    fds = array.array('i')
+    data, ancdata, _, _ = sock.recvmsg(65536, socket.CMSG_SPACE(max_fds * fds.itemsize) if max_fds else 0)
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+    while data and not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return (json.loads(data) if data else None), list(fds)
+
+
+def request(message, path=None, fds=()):
+    """Send ``message`` to the daemon and return its answer, or None when no daemon listens on ``path``.
+
+    Nothing is sent to a socket, or a daemon, of another user.
+    """
+    try:
+        path = path or default_socket_path()
+    except PermissionError as e:
+        logging.warning('Not using the daemon: %s', e)
+        return None
+    if not os.path.exists(path):
+        return None
+    if not is_own_socket(path):
+        logging.warning('Not using the daemon: %s is not a socket of the current user', path)
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return None
+        if not is_own_peer(sock):
+            logging.warning('Not using the daemon: %s is served by another user', path)
+            return None
+        _send(sock, message, fds)
+        answer, _ = _receive(sock)
+        return answer
+
+
+def forward(module, argv, path=None, fds=STDIO_FDS):
+    """Run ``module.main(argv)`` in the daemon and return the exit status, or None if no daemon is running.
+
+    Long-running commands, see :func:`runs_locally`, are not forwarded either.
+    """
+    if os.environ.get(DISABLE_ENV) or runs_locally(module, argv):
+        return None
+    answer = request({'module': module, 'argv': list(argv), 'cwd': os.getcwd()}, path, fds)
+    return None if answer is None else answer.get('status', 1)
+
+
+def run_in_daemon(module, argv):
+    """Exit with the status of the command when the daemon ran it; return to run it locally otherwise."""
+    status = forward(module, argv)
+    if status is not None:
+        sys.exit(status)
+
+
+def exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def run_command(module, argv):
+    """Run ``module.main(argv)`` as the command line would, returning its exit status."""
+    try:
+        importlib.import_module(module).main(argv)
+    except SystemExit as e:
+        return exit_status(e.code)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        timing.flush()
+    return 0
+
+
+class RedirectedStream:
+    """Stand-in for a standard stream sending the whole process, worker threads included, to another stream."""
+
+    def __init__(self, default):
+        self._default = default
+        self._stream = None
+
+    def redirect(self, stream):
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream or self._default, name)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        message, fds = _receive(self.request, max_fds=len(STDIO_FDS))
+        if message is None:
+            return
+        if not is_own_peer(self.request):
+            for fd in fds:
+                os.close(fd)
+            _send(self.request, {'status': 2, 'error': 'the daemon only runs commands of its own user'})
+            return
+        if message.get('command') == 'stop':
+            _send(self.request, {'status': 0})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        elif message.get('command') == 'status':
+            _send(self.request, {'status': 0, 'pid': os.getpid(), 'modules': sorted(self.server.modules)})
+        elif len(fds) == len(STDIO_FDS):
+            _send(self.request, {'status': self.server.execute(message, fds)})
+        else:
+            for fd in fds:
+                os.close(fd)
+            _send(self.request, {'status': 2, 'error': 'expected the standard stream file descriptors'})
+
+
+class ClientDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server running forwarded commands with ``run(module, argv)``, one at a time.
+
+    Each connection has its own thread, so that status and stop requests are
+    answered while a command runs.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path=None, run=run_command):
+        self.path = path or default_socket_path()
+        self.run = run
+        self.modules = set()
+        self._command_lock = threading.Lock()
+        if os.path.exists(self.path):
+            if request({'command': 'status'}, self.path) is not None:
+                raise RuntimeError(f"A daemon is already listening on {self.path}")
+            os.unlink(self.path)
+        umask = os.umask(0o077)
+        try:
+            super().__init__(self.path, _Handler)
+        finally:
+            os.umask(umask)
+        self._stdio = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin, sys.stdout, sys.stderr = (RedirectedStream(stream) for stream in self._stdio)
+
+    def execute(self, message, fds):
+        streams = (os.fdopen(fds[0], 'r', encoding='utf-8'), os.fdopen(fds[1], 'w', encoding='utf-8'),
+                   os.fdopen(fds[2], 'w', encoding='utf-8'))
+        try:
+            with self._command_lock:
+                for proxy, stream in zip((sys.stdin, sys.stdout, sys.stderr), streams):
+                    proxy.redirect(stream)
+                try:
+                    os.chdir(message.get('cwd') or os.getcwd())
+                    logging.debug('Running %s', message['module'])
+                    status = self.run(message['module'], message['argv'])
+                finally:
+                    for proxy in (sys.stdin, sys.stdout, sys.stderr):
+                        proxy.redirect(None)
+            self.modules.add(message['module'])
+            return status
+        finally:
+            for stream in streams:
+                with contextlib.suppress(OSError):
+                    stream.close()
+
+    def server_close(self):
+        super().server_close()
+        sys.stdin, sys.stdout, sys.stderr = self._stdio
+        with contextlib.suppress(OSError):
+            os.unlink(self.path)
@@ -0,0 +1,160 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Datacheck specific helpers: submission matrices and job results."""
+
+import re
+from itertools import product
+
+DB_TYPES = ('core', 'otherfeatures', 'rnaseq', 'cdna', 'variation', 'funcgen', 'compara', 'ancestral', 'ontology',
+            'production', 'metadata')
+_DBNAME = re.compile(r'^(?P<prefix>.+?)_(?P<db_type>{})(?:_|$)'.format('|'.join(DB_TYPES)))
+
+
+def database_type(dbname, db_types):
+    """The first of ``db_types`` found in an Ensembl database name, e.g. ``core`` in ``homo_sapiens_core_110_38``."""
+    for db_type in db_types:
+        if f'_{db_type}_' in f'{dbname}_':
+            return db_type
+    return None
+
+
+def parse_dbname(dbname):
+    """``(species, db_type)`` of an Ensembl database name, e.g. ``('homo_sapiens', 'core')``.
+
+    Both are ``None`` when the name does not follow the Ensembl naming scheme.
+    """
+    match = _DBNAME.match(dbname or '')
+    if match is None:
+        return None, None
+    return match.group('prefix'), match.group('db_type')
+
+
+def expand_matrix(dbnames=(), species=(), db_types=(), groups=()):
+    """Yield the unique submissions of a databases or species x db types x datacheck groups matrix.
+
+    Each submission is a dictionary with ``dbname``, ``species``, ``db_type`` and
+    ``datacheck_groups`` keys. Databases are not crossed with database types:
+    when types are given, each database is kept only if its name matches one of
+    them, and is submitted with that type. Species are crossed with every type.
+    """
+    seen = set()
+    submissions = []
+    groups = list(groups) or [None]
+    if dbnames:
+        for dbname, group in product(dbnames, groups):
+            db_type = database_type(dbname, db_types) if db_types else None
+            if db_types and db_type is None:
+                continue
+            submissions.append((dbname, None, db_type, group))
+    elif species:
+        submissions.extend((None, name, db_type, group)
+                           for name, db_type, group in product(species, list(db_types) or [None], groups))
+    else:
+        submissions.extend((None, None, db_type, group) for db_type, group in product(list(db_types) or [None], groups))
+    for submission in submissions:
+        if submission not in seen:
+            seen.add(submission)
+            yield dict(zip(('dbname', 'species', 'db_type', 'datacheck_groups'), submission))
+
+
+def submission_label(submission):
+    """Readable identifier of a matrix submission, e.g. ``homo_sapiens_core_110_38/core/ControlledTables``."""
+    return '/'.join(str(value) for value in (submission['dbname'] or submission['species'],
+                                             submission['db_type'], submission['datacheck_groups'])
+                    if value is not None) or 'all'
+
+
+def job_tag(job):
+    return (job.get('input') or {}).get('tag')
+
+
+def _status(detail):
+    if isinstance(detail, dict):
+        for key in ('status', 'passed', 'ok'):
+            if key in detail:
+                return _status(detail[key]) if key != 'status' else str(detail[key]).lower()
+        return None
+    if isinstance(detail, (bool, int)):
+        return 'passed' if detail else 'failed'
+    return str(detail).lower() if detail is not None else None
+
+
+def has_results(job):
+    output = job.get('output') or {}
+    return isinstance(output.get('databases', output.get('results')), dict)
+
+
+def iter_results(job):
+    """Yield ``(dbname, datacheck, status)`` for the datacheck results of a job document.
+
+    Per database results are read from ``job['output']['databases']``, mapping
+    database names either to datacheck results (``{name: {'passed': 0|1, ...}}``,
+    or with an ``ok`` flag or ``status`` string), or to a summary listing only
+    the failed datachecks under ``failed``. For each database, a ``(dbname, None,
+    status)`` row is yielded first, failed if any of its datachecks failed, to
+    record that the database was checked.
+    """
+    output = job.get('output') or {}
+    databases = output.get('databases', output.get('results'))
+    if not isinstance(databases, dict):
+        return
+    for dbname, datachecks in databases.items():
+        if not isinstance(datachecks, dict):
+            continue
+        if isinstance(datachecks.get('failed'), (dict, list)):
+            rows = [(datacheck, 'failed') for datacheck in datachecks['failed']]
+            failed = bool(rows) or bool(datachecks.get('failed_total'))
+        else:
+            rows = [(datacheck, _status(detail)) for datacheck, detail in datachecks.items()]
+            failed = any(status == 'failed' for _, status in rows)
+        yield dbname, None, 'failed' if failed else 'passed'
+        for datacheck, status in rows:
+            yield dbname, datacheck, status
+
+
+def compare_results(base, head):
+    """Classify datacheck failures which appear, disappear or remain between two result sets.
+
+    ``base`` and ``head`` are iterables of ``(dbname, datacheck, status)`` as
+    yielded by :func:`iter_results`, each read once into the set of failed
+    ``(dbname, datacheck)`` keys (the last result wins when a datacheck was run
+    several times) and the set of checked databases. A base failure is fixed
+    when its database was checked again in ``head`` without failing.
+
+    Returns a dictionary of sorted ``(dbname, datacheck)`` lists under
+    ``new_failures``, ``fixed`` and ``still_failing``, and under ``unmatched``
+    the number of base failures whose database is not in ``head``.
+    """
+    base_failed, _ = _failure_index(base)
+    head_failed, head_checked = _failure_index(head)
+    diff = {
+        'new_failures': sorted(head_failed - base_failed),
+        'fixed': sorted(key for key in base_failed - head_failed if key[0] in head_checked),
+        'still_failing': sorted(head_failed & base_failed),
+    }
+    diff['unmatched'] = sum(1 for key in base_failed if key[0] not in head_checked)
+    return diff
+
+
+def _failure_index(results):
+    failed = set()
+    checked = set()
+    for dbname, datacheck, status in results:
+        checked.add(dbname)
+        if datacheck is None:
+            continue
+        if status == 'failed':
+            failed.add((dbname, datacheck))
+        else:
+            failed.discard((dbname, datacheck))
+    return failed, checked
@@ -0,0 +1,167 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Follow jobs from the status events published on the message broker rather than by polling their REST API.
+
+Job documents published to the broker are handled as the same documents fetched
+from the REST services. Every watched job is fetched once on subscription, so
+that changes published before it are not missed, and jobs still running are
+fetched again every ``resync`` seconds in case an event was lost. Without a
+broker, or when it cannot be reached, jobs are polled as before.
+"""
+
+import logging
+import socket
+import time
+import uuid
+from contextlib import ExitStack
+
+from scripts.utils import fastjson
+from scripts.utils.concurrency import run_bounded
+from scripts.utils.polling import watch
+
+
+def decode_event(body):
+    """Job document of a message body, or ``None`` when it is not one."""
+    if isinstance(body, (bytes, str)):
+        try:
+            body = fastjson.loads(body)
+        except ValueError:
+            return None
+    return body if isinstance(body, dict) else None
+
+
+class EventSubscription:
+    """Messages routed from a topic ``exchange`` with ``routing_key``, to a queue of this subscription only."""
+
+    def __init__(self, broker_url, exchange, routing_key='#', clock=time.monotonic):
+        self.broker_url = broker_url
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self._clock = clock
+        self._connection = None
+        self._consumer = None
+        self._events = []
+
+    def __enter__(self):
+        from kombu import Connection, Exchange, Queue
+
+        exchange = Exchange(self.exchange, type='topic')
+        queue = Queue(f'prodinf-{uuid.uuid4()}', exchange, routing_key=self.routing_key, durable=False,
+                      auto_delete=True)
+        self._connection = Connection(self.broker_url)
+        try:
+            self._connection.ensure_connection(max_retries=1)
+            self._consumer = self._connection.Consumer(queue, callbacks=[self._receive], accept=['json'])
+            self._consumer.consume()
+        except BaseException:
+            self._connection.release()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self._consumer.cancel()
+        finally:
+            self._connection.release()
+
+    def _receive(self, body, message):
+        message.ack()
+        event = decode_event(body)
+        if event is None:
+            logging.debug('Ignoring message %r', body)
+        else:
+            self._events.append(event)
+
+    def drain(self, timeout):
+        """Job documents received within ``timeout`` seconds, returned as soon as any arrived."""
+        deadline = self._clock() + timeout
+        while not self._events:
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                break
+            try:
+                self._connection.drain_events(timeout=remaining)
+            except socket.timeout:
+                break
+        events, self._events = self._events, []
+        return events
+
+
+def watch_events(keys, fetch, state_of, is_terminal, on_change, key_of, subscription, concurrency=8,
+                 resync=600.0, timeout=None, clock=time.monotonic):
+    """Follow every key from the events of ``subscription`` until ``is_terminal(state)`` holds for all of them.
+
+    Same as :func:`scripts.utils.polling.watch`, with ``key_of(record)`` giving the
+    key of an event. Events of other keys, and of keys already finished, are
+    ignored.
+    """
+    deadline = clock() + timeout if timeout else None
+    keys = list(dict.fromkeys(keys))
+    states = {}
+
+    def update(key, record):
+        state = state_of(record)
+        if key not in states or states[key] != state:
+            on_change(key, states.get(key), state, record)
+        states[key] = state
+
+    def running():
+        return [key for key in keys if key not in states or not is_terminal(states[key])]
+
+    def refresh(pending):
+        for outcome in run_bounded(fetch, pending, concurrency=concurrency):
+            if outcome.error:
+                logging.warning('Could not retrieve %s: %s', outcome.item, outcome.error)
+            else:
+                update(outcome.item, outcome.result)
+
+    refresh(keys)
+    next_resync = clock() + resync
+    while running():
+        now = clock()
+        if deadline is not None and now >= deadline:
+            logging.warning('Timed out with %s job(s) still running', len(running()))
+            break
+        if now >= next_resync:
+            refresh(running())
+            next_resync = clock() + resync
+            continue
+        wake = next_resync if deadline is None else min(next_resync, deadline)
+        for event in subscription.drain(wake - now):
+            key = key_of(event)
+            if key in keys and not (key in states and is_terminal(states[key])):
+                update(key, event)
+    return states
+
+
+def follow(keys, fetch, state_of, is_terminal, on_change, key_of, broker_url=None, exchange=None, routing_key='#',
+           resync=600.0, concurrency=8, initial=5.0, maximum=300.0, timeout=None):
+    """Follow jobs from the events of ``broker_url`` when given and reachable, else by polling them."""
+    if broker_url:
+        try:
+            from kombu.exceptions import OperationalError
+        except ImportError:
+            logging.warning('kombu is not installed, polling jobs instead')
+        else:
+            with ExitStack() as stack:
+                try:
+                    subscription = stack.enter_context(EventSubscription(broker_url, exchange, routing_key))
+                except (OSError, OperationalError) as error:
+                    logging.warning('Could not subscribe to job events, polling jobs instead: %s', error)
+                else:
+                    logging.info('Following job events of exchange %s', exchange)
+                    return watch_events(keys, fetch, state_of, is_terminal, on_change, key_of, subscription,
+                                        concurrency=concurrency, resync=resync, timeout=timeout)
+    return watch(keys, fetch, state_of, is_terminal, on_change, concurrency=concurrency, initial=initial,
+                 maximum=maximum, timeout=timeout)
@@ -0,0 +1,42 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""JSON encoding and decoding with ``orjson`` when it is installed, and the standard library otherwise.
+
+Both produce the same documents; ``orjson`` output is compact and only supports
+an indent of 2.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """Decode a JSON document from ``bytes`` or ``str``."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value, indent=None):
+    """Encode ``value`` as a JSON string, rendering values JSON does not know with ``str``."""
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(value, default=str, option=option).decode('utf-8')
+    if indent is None:
+        return json.dumps(value, separators=(',', ':'), default=str)
+    return json.dumps(value, indent=indent, default=str)
@@ -0,0 +1,253 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Handover specific helpers."""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from urllib.parse import urlparse
+
+from scripts.utils.cache import default_cache_dir
+
+# Same patterns as HandoverClient.handover_summary_email
+FAILED_PATTERN = re.compile('.*(failed|problems).*')
+SUCCESSFUL_PATTERN = re.compile('.*successful.*')
+
+
+def database_name(src_uri):
+    return urlparse(src_uri).path[1:]
+
+
+def handover_status(handover):
+    """The message describing where a handover is at."""
+    return handover.get('current_message') or handover.get('message') or 'unknown'
+
+
+def handover_result(status):
+    """``failed``, ``success`` or ``in progress`` for a handover message."""
+    status = str(status or '')
+    if FAILED_PATTERN.match(status):
+        return 'failed'
+    if SUCCESSFUL_PATTERN.match(status):
+        return 'success'
+    return 'in progress'
+
+
+def is_terminal_status(status):
+    return handover_result(status) != 'in progress'
+
+
+def is_failed_status(status):
+    return handover_result(status) == 'failed'
+
+
+def is_in_flight(handover):
+    """Whether a handover, as listed by the service, is still being processed."""
+    return not is_terminal_status(handover_status(handover))
+
+
+def latest_report(reports):
+    """Most recent of the reports returned for a handover token, or ``None``."""
+    if isinstance(reports, dict):
+        return reports
+    return max(reports, key=lambda report: str(report.get('report_time') or ''), default=None)
+
+
+def in_flight_index(handovers):
+    """Map of database names to their in flight handover, from a single service listing."""
+    index = {}
+    for handover in handovers:
+        database = handover.get('database') or database_name(handover.get('src_uri') or '')
+        if database and is_in_flight(handover):
+            index[database] = handover
+    return index
+
+
+SUMMARY_DIMENSIONS = ('status', 'division', 'contact')
+
+SUMMARY_VERSION = 2
+
+SUMMARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS handovers (
+    token TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    contact TEXT,
+    database TEXT,
+    division TEXT,
+    status TEXT,
+    report_time TEXT
+);
+CREATE INDEX IF NOT EXISTS handovers_database ON handovers (contact, database, report_time);
+CREATE TABLE IF NOT EXISTS latest (
+    contact TEXT,
+    database TEXT,
+    token TEXT,
+    division TEXT,
+    status TEXT,
+    PRIMARY KEY (contact, database)
+);
+CREATE TABLE IF NOT EXISTS aggregates (
+    contact TEXT,
+    dimension TEXT,
+    value TEXT,
+    count INTEGER,
+    PRIMARY KEY (contact, dimension, value)
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def changed_since(handovers, watermark):
+    """Handovers of a listing, most recent first, up to the first one reported before ``watermark``.
+
+    The handover service lists handovers most recent first, which
+    ``HandoverClient.handover_summary_email`` relies on as well, so the rest of
+    the listing holds no handover changed since ``watermark``. Stopping
+    there closes the response without reading it further.
+    """
+    for handover in handovers:
+        report_time = handover.get('report_time')
+        if watermark is not None and report_time and str(report_time) < watermark:
+            return
+        yield handover
+
+
+def default_summary_path(uri):
+    digest = hashlib.sha1(uri.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(default_cache_dir(), f'handover-summary-{digest}.sqlite')
+
+
+class HandoverSummaryStore:
+    """Last seen state of every handover, with running counts per status, division and contact.
+
+    As in ``HandoverClient.handover_summary_email``, only the latest handover of
+    each database of a contact is summarised. Updating with a listing only
+    touches the handovers which changed since the previous update, and the
+    summary is read from the counts. Read with :func:`changed_since`, a listing
+    costs the handovers changed since the previous update rather than the whole
+    history.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != SUMMARY_VERSION:
+            # Older layouts cannot be migrated: start over with a full listing
+            with self._db:
+                for table in ('handovers', 'latest', 'aggregates', 'state'):
+                    self._db.execute(f'DROP TABLE IF EXISTS {table}')
+            self._db.execute(f'PRAGMA user_version = {SUMMARY_VERSION}')
+        self._db.executescript(SUMMARY_SCHEMA)
+
+    @property
+    def watermark(self):
+        """Latest ``report_time`` seen so far, or ``None``."""
+        row = self._db.execute("SELECT value FROM state WHERE key = 'watermark'").fetchone()
+        return row[0] if row else None
+
+    def _count(self, contact, values, delta):
+        self._db.executemany('INSERT INTO aggregates (contact, dimension, value, count) VALUES (?, ?, ?, ?) '
+                             'ON CONFLICT (contact, dimension, value) DO UPDATE SET count = count + excluded.count',
+                             [(contact, dimension, value, delta)
+                              for dimension, value in zip(SUMMARY_DIMENSIONS, values)])
+
+    def _refresh_latest(self, contact, database):
+        """Point ``(contact, database)`` at its most recent handover, moving the counts along."""
+        current = self._db.execute('SELECT token, status, division FROM handovers '
+                                   'WHERE contact = ? AND database = ? ORDER BY report_time DESC, token DESC LIMIT 1',
+                                   (contact, database)).fetchone()
+        previous = self._db.execute('SELECT token, status, division FROM latest WHERE contact = ? AND database = ?',
+                                    (contact, database)).fetchone()
+        if current == previous:
+            return
+        if previous:
+            self._count(contact, (previous[1], previous[2], contact), -1)
+            self._db.execute('DELETE FROM latest WHERE contact = ? AND database = ?', (contact, database))
+        if current:
+            self._count(contact, (current[1], current[2], contact), 1)
+            self._db.execute('INSERT INTO latest (contact, database, token, status, division) VALUES (?, ?, ?, ?, ?)',
+                             (contact, database) + current)
+
+    def update(self, handovers):
+        """Apply a listing of handovers, returning the number of new or changed ones."""
+        changed = 0
+        watermark = self.watermark
+        with self._db:
+            for handover in handovers:
+                token = handover.get('handover_token')
+                if not token:
+                    continue
+                digest = hashlib.sha1(json.dumps(handover, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+                previous = self._db.execute('SELECT fingerprint, contact, database FROM handovers '
+                                            'WHERE token = ?', (token,)).fetchone()
+                if previous and previous[0] == digest:
+                    continue
+                report_time = str(handover.get('report_time') or '')
+                key = (handover.get('contact') or 'unknown',
+                       handover.get('database') or database_name(handover.get('src_uri') or '') or 'unknown')
+                self._db.execute('INSERT OR REPLACE INTO handovers '
+                                 '(token, fingerprint, contact, database, division, status, report_time) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (token, digest) + key + (handover.get('division') or 'unknown',
+                                                          handover_result(handover_status(handover)), report_time))
+                if previous and tuple(previous[1:]) != key:
+                    self._refresh_latest(*previous[1:])
+                self._refresh_latest(*key)
+                if report_time and (watermark is None or report_time > watermark):
+                    watermark = report_time
+                changed += 1
+            self._db.execute('DELETE FROM aggregates WHERE count <= 0')
+            if watermark is not None:
+                self._db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('watermark', ?)", (watermark,))
+        return changed
+
+    def aggregates(self, contact=None):
+        """``{dimension: {value: count}}`` of the latest handovers, of ``contact`` only if given."""
+        summary = {dimension: {} for dimension in SUMMARY_DIMENSIONS}
+        where, params = ('WHERE contact = ? ', (contact,)) if contact else ('', ())
+        for dimension, value, count in self._db.execute('SELECT dimension, value, SUM(count) AS total FROM aggregates '
+                                                        f'{where}GROUP BY dimension, value '
+                                                        'ORDER BY dimension, total DESC, value', params):
+            summary[dimension][value] = count
+        return summary
+
+    def latest(self, contact=None):
+        """``(token, database, status)`` of the latest handover of each database, of ``contact`` only if given."""
+        where, params = ('WHERE contact = ? ', (contact,)) if contact else ('', ())
+        return self._db.execute(f'SELECT token, database, status FROM latest {where}ORDER BY database, contact',
+                                params).fetchall()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def format_summary(aggregates, latest=()):
+    """Plain text handover summary from :meth:`HandoverSummaryStore.aggregates` and :meth:`~.latest`."""
+    lines = [f'Handover {token} - {database} : {status}' for token, database, status in latest]
+    for dimension in SUMMARY_DIMENSIONS:
+        counts = aggregates.get(dimension) or {}
+        lines.append(f'Handovers per {dimension} ({sum(counts.values())}):')
+        lines.extend(f'  {value}: {count}' for value, count in counts.items())
+    return '\n'.join(lines)
@@ -0,0 +1,365 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Shared HTTP transport for talking to the production services.
+
+Every script configures a single :class:`TransportSession` from its command line
+and hands it to its core client with :func:`use_transport`, so submissions,
+listings and pollers all go through one pool of keep-alive connections with the
+same timeouts, retry policy and per-host concurrency limit.
+"""
+
+import contextlib
+import functools
+import random
+import threading
+import time
+import types
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+from scripts.utils import fastjson, timing
+
+
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_transient_error(error):
+    """Whether a failed call is worth retrying: connection problems, timeouts and overloaded services.
+
+    The errors the core clients raise while handling a ``requests`` error are
+    judged by the original error.
+    """
+    while error is not None:
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        response = getattr(error, 'response', None)
+        if response is not None:
+            return response.status_code in TRANSIENT_STATUSES
+        error = error.__cause__ or error.__context__
+    return False
+
+
+_idempotency = threading.local()
+
+
+@contextlib.contextmanager
+def idempotency_key(key):
+    """Send ``key`` as the ``Idempotency-Key`` header of the POST requests made by this thread within the block."""
+    previous = getattr(_idempotency, 'key', None)
+    _idempotency.key = key
+    try:
+        yield
+    finally:
+        _idempotency.key = previous
+
+
+class JitteredRetry(Retry):
+    """urllib3 retry policy sleeping a random time up to the exponential backoff ("full jitter").
+
+    Spreading the retries stops many concurrent callers hammering a recovering
+    service in lockstep.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+class TransportSession(requests.Session):
+    """Pooled session with default timeouts, retries of idempotent calls and a per-host concurrency limit.
+
+    Only idempotent methods are retried, on connection errors and on the transient
+    statuses; a ``POST`` is sent once. Leaving a ``with`` block does not close the
+    session, so clients opening a "new" session for each call keep reusing the
+    pooled connections; call :meth:`close` to release them.
+
+    With a :class:`~scripts.utils.timing.Timings`, every call is recorded in it.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=10.0, read_timeout=60.0, retries=3, backoff=1.0,
+                 max_per_host=None, timings=None):
+        super().__init__()
+        self.timings = timings
+        if timings is not None:
+            _instrument_connections()
+        retry = JitteredRetry(total=retries, backoff_factor=backoff, status_forcelist=TRANSIENT_STATUSES,
+                              raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.headers.update({'Accept': 'application/json', 'Accept-Encoding': DEFAULT_ACCEPT_ENCODING})
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_per_host = max_per_host
+        self._slots = {}
+        self._slots_lock = threading.Lock()
+
+    def _slot(self, url):
+        if not self.max_per_host:
+            return contextlib.nullcontext()
+        host = urlsplit(url).netloc
+        with self._slots_lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[host]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        key = getattr(_idempotency, 'key', None)
+        if key is not None and method.upper() == 'POST':
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Idempotency-Key': key})
+        with self._slot(url):
+            return super().request(method, url, **kwargs)
+
+    def send(self, request, **kwargs):
+        if self.timings is None:
+            response = super().send(request, **kwargs)
+            _use_fast_json(response)
+            return response
+        stream = kwargs.pop('stream', False)
+        call = self.timings.new_call(request.method, request.url)
+        timing.set_active_call(call)
+        start = time.perf_counter()
+        try:
+            response = super().send(request, stream=True, **kwargs)
+        except Exception as e:
+            call['error'] = str(e)
+            call['total'] = time.perf_counter() - start
+            raise
+        finally:
+            timing.set_active_call(None)
+        # Connection set up is recorded cumulatively: name resolution, then socket connect, then TLS
+        setup = max(call['tls'], call['connect'])
+        call['tls'] = max(0.0, call['tls'] - call['connect'])
+        call['connect'] = max(0.0, call['connect'] - call['dns'])
+        call['ttfb'] = max(0.0, response.elapsed.total_seconds() - setup)
+        call['status'] = response.status_code
+        if not stream:
+            transfer_start = time.perf_counter()
+            call['bytes'] = len(response.content)
+            call['transfer'] = time.perf_counter() - transfer_start
+            with contextlib.suppress(AttributeError, TypeError):
+                call['wire_bytes'] = response.raw.tell()
+        call['total'] = time.perf_counter() - start
+        _use_fast_json(response)
+        decode = response.json
+
+        def timed_json(**kwargs):
+            decode_start = time.perf_counter()
+            try:
+                return decode(**kwargs)
+            finally:
+                call['decode'] += time.perf_counter() - decode_start
+
+        response.json = timed_json
+        return response
+
+    def __exit__(self, *args):
+        pass
+
+
+def _use_fast_json(response):
+    """Decode ``response.json()`` with orjson when installed, falling back to requests for what it rejects."""
+    if fastjson.orjson is None:
+        return
+    decode = response.json
+
+    def fast_json(**kwargs):
+        if not kwargs:
+            try:
+                return fastjson.loads(response.content)
+            except ValueError:
+                pass
+        return decode(**kwargs)
+
+    response.json = fast_json
+
+
+class _TimedSocketModule:
+    """Stand-in for the ``socket`` module of urllib3 timing name resolution."""
+
+    def __init__(self, module):
+        self._module = module
+        self.getaddrinfo = timing.timed(module.getaddrinfo, 'dns')
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+_instrumented = False
+
+
+def _instrument_connections():
+    """Time name resolution, socket connect and connection set up (with TLS) of urllib3 connections."""
+    global _instrumented
+    if _instrumented:
+        return
+    import urllib3.connection
+    import urllib3.util.connection
+
+    urllib3.util.connection.socket = _TimedSocketModule(urllib3.util.connection.socket)
+    urllib3.util.connection.create_connection = timing.timed(urllib3.util.connection.create_connection,
+                                                             'connect')
+    for connection_class in (urllib3.connection.HTTPConnection, urllib3.connection.HTTPSConnection):
+        connection_class.connect = timing.timed(connection_class.connect, 'tls')
+    _instrumented = True
+
+
+_transport = None
+_transport_settings = None
+_transport_lock = threading.Lock()
+
+
+def configure_transport(**settings):
+    """Replace the shared session with one built from ``settings`` (see :class:`TransportSession`).
+
+    The current session, and its open connections, is kept when the settings do
+    not change, as happens for every command run by a long-lived process.
+    """
+    global _transport, _transport_settings
+    with _transport_lock:
+        if _transport is not None and settings == _transport_settings:
+            return _transport
+        if _transport is not None:
+            _transport.close()
+        _transport, _transport_settings = TransportSession(**settings), settings
+        return _transport
+
+
+def shared_session():
+    """The session shared by the whole process, created with default settings on first use."""
+    global _transport, _transport_settings
+    with _transport_lock:
+        if _transport is None:
+            _transport, _transport_settings = TransportSession(), {}
+        return _transport
+
+
+class _SessionRequests:
+    """Stand-in for the ``requests`` module sending the module-level helpers through a session."""
+
+    def __init__(self, session):
+        self._session = session
+
+    def request(self, method, url, **kwargs):
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self._session.get(url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self._session.post(url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self._session.put(url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self._session.patch(url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self._session.delete(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self._session.head(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+def _with_requests(function, stand_in):
+    """Copy of ``function`` resolving the global ``requests`` to ``stand_in``."""
+    namespace = dict(function.__globals__, requests=stand_in)
+    bound = types.FunctionType(function.__code__, namespace, function.__name__,
+                               function.__defaults__, function.__closure__)
+    bound.__kwdefaults__ = function.__kwdefaults__
+    return functools.update_wrapper(bound, function)
+
+
+def use_transport(client, session=None):
+    """Route every call of a core client through ``session`` (the shared session by default).
+
+    ``RestClient`` subclasses build their session in ``_session()``, which is
+    replaced on the instance. Clients calling ``requests.get``/``requests.post``
+    directly, such as ``HandoverClient``, are given a subclass of their own whose
+    methods see a stand-in bound to the session as ``requests``; the client module
+    and every other instance keep using the real ``requests``.
+    """
+    session = session or shared_session()
+    if callable(getattr(client, '_session', None)):
+        client._session = lambda use_ssl=False: session
+    elif isinstance(getattr(type(client), '_requests', None), _SessionRequests):
+        type(client)._requests._session = session
+    else:
+        stand_in = _SessionRequests(session)
+        methods, seen = {'_requests': stand_in}, set()
+        for klass in type(client).__mro__:
+            for name, attribute in vars(klass).items():
+                if name in seen:
+                    continue
+                seen.add(name)
+                if isinstance(attribute, types.FunctionType) and attribute.__globals__.get('requests') is requests:
+                    methods[name] = _with_requests(attribute, stand_in)
+        if len(methods) > 1:
+            methods['__module__'] = type(client).__module__
+            client.__class__ = type(type(client).__name__, (type(client),), methods)
+    return client
+
+
+def transport_from_args(args):
+    """Configure the shared session from the options added by ``scripts.utils.cli.add_transport_arguments``."""
+    timings = None
+    if args.timings or args.timings_json:
+        timings = timing.Timings()
+        timing.report_at_exit(timings, text=args.timings, json_path=args.timings_json)
+    return configure_transport(pool_size=max(10, getattr(args, 'concurrency', None) or 0),
+                               connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+                               retries=args.http_retries, max_per_host=args.max_per_host, timings=timings)
+
+
+class ConditionalFetcher:
+    """GET JSON documents, revalidating previously seen ones with ``ETag``/``Last-Modified``.
+
+    When the service answers ``304 Not Modified`` the previously decoded document
+    is returned without transferring or decoding it again. Services that do not
+    send validators are simply fetched in full every time.
+    """
+
+    def __init__(self, session=None):
+        self.session = session or shared_session()
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def get_json(self, url, **kwargs):
+        headers = dict(kwargs.pop('headers', None) or {})
+        with self._lock:
+            cached = self._documents.get(url)
+        if cached:
+            etag, modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if modified:
+                headers['If-Modified-Since'] = modified
+        response = self.session.get(url, headers=headers, **kwargs)
+        if response.status_code == 304 and cached:
+            return cached[2]
+        response.raise_for_status()
+        document = response.json()
+        etag = response.headers.get('ETag')
+        modified = response.headers.get('Last-Modified')
+        if etag or modified:
+            with self._lock:
+                self._documents[url] = (etag, modified, document)
+        return document
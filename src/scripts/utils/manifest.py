@@ -0,0 +1,139 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Manifest readers and resumable results journals for bulk actions."""
+
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+
+
+def _open(path):
+    if path == '-':
+        return sys.stdin
+    return open(path)
+
+
+def split_list(value):
+    """Split a comma-separated argument into a list of unique, non empty values, keeping their order."""
+    if not value:
+        return []
+    return list(dict.fromkeys(item.strip() for item in value.split(',') if item.strip()))
+
+
+def read_lines(path):
+    """Non empty, non comment lines of a plain list file, or of standard input for ``-``."""
+    fh = _open(path)
+    try:
+        return [line.strip() for line in fh if line.strip() and not line.startswith('#')]
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def manifest_format(path):
+    """Guess manifest format from the file extension, defaulting to TSV."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.yaml', '.yml'):
+        return 'yaml'
+    if ext in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    return 'tsv'
+
+
+def read_manifest(path, fmt=None):
+    """Yield manifest rows as dictionaries.
+
+    Supported formats are ``yaml`` (a list of mappings), ``jsonl`` (one JSON
+    object per line) and ``tsv`` (a header line naming the columns). Empty
+    values are dropped so that callers can fall back to their own defaults.
+    ``path`` may be ``-`` to read from standard input.
+    """
+    fmt = fmt or manifest_format(path)
+    fh = _open(path)
+    try:
+        if fmt == 'yaml':
+            import yaml
+            rows = yaml.safe_load(fh) or []
+            if not isinstance(rows, list):
+                raise ValueError(f"YAML manifest {path} must contain a list of rows")
+        elif fmt == 'jsonl':
+            rows = (json.loads(line) for line in fh if line.strip())
+        elif fmt == 'tsv':
+            rows = csv.DictReader((line for line in fh if not line.startswith('#')), delimiter='\t')
+        else:
+            raise ValueError(f"Unsupported manifest format: {fmt}")
+        for number, row in enumerate(rows, start=1):
+            if not isinstance(row, dict):
+                raise ValueError(f"Manifest row {number} is not a mapping: {row}")
+            yield {key.strip(): value for key, value in row.items()
+                   if key and value is not None and value != ''}
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def row_key(row, fields=None):
+    """Stable identifier for a manifest row, used to detect already processed rows."""
+    if fields:
+        row = {field: row.get(field) for field in fields}
+    canonical = json.dumps(row, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class Journal:
+    """Append-only JSONL record of processed rows.
+
+    Every record carries the row ``key``; records with a truthy ``done_field``
+    value mark their key as completed, so that a later run over the same
+    manifest can skip them. Records are flushed as they are written so that
+    an interrupted run loses nothing.
+    """
+
+    def __init__(self, path, done_field='job_id'):
+        self.path = path
+        self.done_field = done_field
+        self.completed = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as fh:
+                for line in fh:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record.get(done_field):
+                        self.completed[record['key']] = record
+        self._fh = open(path, 'a') if path else None
+
+    def is_done(self, key):
+        return key in self.completed
+
+    def write(self, record):
+        with self._lock:
+            if record.get(self.done_field):
+                self.completed[record['key']] = record
+            if self._fh:
+                self._fh.write(json.dumps(record, default=str) + '\n')
+                self._fh.flush()
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,100 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Genome metadata specific helpers."""
+
+from scripts.utils.manifest import row_key
+
+DATASET_REQUIRED_FIELDS = ('user', 'name', 'description', 'label', 'dataset_type', 'dataset_source.name',
+                           'dataset_source.type', 'genome_uuid')
+ATTRIBUTE_PREFIX = 'attribute.'
+
+
+def dataset_payload(row, defaults=None):
+    """Dataset creation payload from a bulk input row.
+
+    Rows are either shaped like the API payload, or flat with the command line
+    names (``type``, ``source_name``, ``source_type``, ``guuid``) and one
+    ``attribute.<name>`` column per dataset attribute. Fields missing from the
+    row are taken from ``defaults``, keyed by the flat names.
+    """
+    defaults = defaults or {}
+    source = row.get('dataset_source') or {}
+    attributes = row.get('dataset_attribute')
+    if attributes is None:
+        attributes = [{'name': key[len(ATTRIBUTE_PREFIX):], 'value': value}
+                      for key, value in row.items() if key.startswith(ATTRIBUTE_PREFIX)]
+
+    def value(*keys):
+        for key in keys:
+            if row.get(key) is not None:
+                return row[key]
+        return defaults.get(keys[-1])
+
+    return {
+        'user': value('user'),
+        'name': value('name'),
+        'description': value('description'),
+        'label': value('label'),
+        'dataset_type': value('dataset_type', 'type'),
+        'dataset_source': {
+            'name': source.get('name') or value('source_name'),
+            'type': source.get('type') or value('source_type'),
+        },
+        'genome_uuid': value('genome_uuid', 'guuid'),
+        'dataset_attribute': attributes,
+    }
+
+
+def missing_fields(payload):
+    """Required fields, in dotted form, missing from a dataset payload."""
+    missing = []
+    for field in DATASET_REQUIRED_FIELDS:
+        value = payload
+        for key in field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        if value in (None, ''):
+            missing.append(field)
+    return missing
+
+
+def dataset_key(payload):
+    """Identity of a dataset for idempotent bulk creation: genome, name and type."""
+    return row_key(payload, ('genome_uuid', 'name', 'dataset_type'))
+
+
+def group_attribute_updates(rows):
+    """Group ``(dataset_uuid, name, value)`` rows into one attribute mapping per dataset.
+
+    Rows are mappings with ``dataset_uuid``, ``name`` and ``value`` keys
+    (``duuid`` and ``attribute`` are accepted too). When a dataset attribute
+    is set more than once, the last value wins. Returns the grouped updates and
+    the numbers of invalid rows.
+    """
+    updates = {}
+    invalid = []
+    for number, row in enumerate(rows, start=1):
+        dataset_uuid = row.get('dataset_uuid') or row.get('duuid')
+        name = row.get('name') or row.get('attribute')
+        if not dataset_uuid or not name or 'value' not in row:
+            invalid.append(number)
+            continue
+        updates.setdefault(dataset_uuid, {})[name] = row['value']
+    return updates, invalid
+
+
+def update_payload(user, dataset_uuid, attributes):
+    return {
+        'user': user,
+        'dataset_uuid': dataset_uuid,
+        'dataset_attribute': [{'name': name, 'value': value} for name, value in attributes.items()],
+    }
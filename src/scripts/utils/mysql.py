@@ -0,0 +1,60 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Helpers querying MySQL servers directly, for planning bulk submissions."""
+
+import fnmatch
+
+from scripts.utils.manifest import split_list
+
+SYSTEM_SCHEMAS = ('information_schema', 'mysql', 'performance_schema', 'sys')
+# Data and index bytes per database, as reported by the server without scanning any table
+SIZE_QUERY = ('SELECT table_schema, SUM(COALESCE(data_length, 0) + COALESCE(index_length, 0)) '
+              'FROM information_schema.tables GROUP BY table_schema')
+
+
+def match_databases(names, patterns):
+    """Names matching any of the shell-style ``patterns``, in order."""
+    patterns = split_list(patterns) if isinstance(patterns, str) else list(patterns)
+    return [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+
+
+def list_databases(server_url, patterns):
+    """Databases of the server at ``server_url`` matching comma-separated shell-style ``patterns``."""
+    from sqlalchemy import create_engine, text
+    engine = create_engine(server_url.rstrip('/') + '/')
+    try:
+        with engine.connect() as connection:
+            names = [row[0] for row in connection.execute(text('SHOW DATABASES'))]
+    finally:
+        engine.dispose()
+    return match_databases(sorted(names), patterns)
+
+
+def sizes_from_rows(rows, patterns=None):
+    """``{database: bytes}`` of the :data:`SIZE_QUERY` rows, for the databases matching ``patterns`` if given."""
+    sizes = {name: int(size or 0) for name, size in rows if name.lower() not in SYSTEM_SCHEMAS}
+    if patterns:
+        return {name: sizes[name] for name in match_databases(sorted(sizes), patterns)}
+    return sizes
+
+
+def database_sizes(server_url, patterns=None):
+    """Size in bytes of the databases of the server at ``server_url``, read from its information_schema."""
+    from sqlalchemy import create_engine, text
+    engine = create_engine(server_url.rstrip('/') + '/')
+    try:
+        with engine.connect() as connection:
+            rows = connection.execute(text(SIZE_QUERY)).fetchall()
+    finally:
+        engine.dispose()
+    return sizes_from_rows(rows, patterns)
@@ -0,0 +1,283 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Durable queue of submissions, sent to the services by a flusher retrying them until they get through.
+
+Submissions are written to a SQLite outbox first, so that none is lost when a
+service is down or overloaded: the flusher sends them in batches, retries the
+failed ones with a jittered exponential backoff, and shrinks its batches while
+the service is struggling. Each submission has an idempotency key, which goes
+with every attempt so that a service can recognise a retried one. Keys derived
+from the content are unique to an :class:`Outbox` instance, i.e. to a command:
+the same submission queued twice by a command is sent once, while running the
+command again submits it again. Keys given by the caller, e.g. from manifest
+rows, hold across commands.
+
+Several commands may flush the same outbox at once. Each claims the
+submissions it is about to send, marking them as being sent under its own
+claim until a lease expires, so that none is sent twice.
+"""
+
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from scripts.utils import fastjson
+from scripts.utils.cache import default_cache_dir
+from scripts.utils.concurrency import run_bounded
+from scripts.utils.manifest import row_key
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+Entry = namedtuple('Entry', 'key service uri payload attempts')
+
+
+def default_outbox_path():
+    return os.path.join(default_cache_dir(), 'outbox.sqlite')
+
+
+class Outbox:
+    """Submissions to ``service`` at ``uri``, with their status, attempts and job identifier once sent.
+
+    Submissions claimed by :meth:`due` are left to their claimant for ``lease``
+    seconds, after which they are considered abandoned and claimed again.
+    """
+
+    def __init__(self, path, clock=time.time, lease=600.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.clock = clock
+        self.lease = lease
+        self.run_id = uuid.uuid4().hex
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute('CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, key TEXT UNIQUE, '
+                         'service TEXT, uri TEXT, payload TEXT, status TEXT, attempts INTEGER, '
+                         'next_attempt REAL, job_id TEXT, error TEXT, created REAL, updated REAL, '
+                         'claim TEXT, lease_until REAL)')
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(outbox)')}
+        for column, kind in (('claim', 'TEXT'), ('lease_until', 'REAL')):
+            if column not in columns:
+                self._db.execute(f'ALTER TABLE outbox ADD COLUMN {column} {kind}')
+        self._db.execute('CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)')
+        self._db.commit()
+
+    def key_of(self, service, uri, payload, key=None):
+        """Idempotency key of a submission: ``key`` if given, else derived from the content and this instance."""
+        return key or row_key({'service': service, 'uri': uri, 'payload': payload, 'run': self.run_id})
+
+    def add_many(self, submissions):
+        """Queue ``(service, uri, payload, key)`` submissions, see :meth:`key_of` for the keys.
+
+        Returns the keys of the submissions, including those already queued which
+        are left as they are.
+        """
+        now = self.clock()
+        rows = []
+        for service, uri, payload, key in submissions:
+            key = self.key_of(service, uri, payload, key)
+            rows.append((key, service, uri, fastjson.dumps(payload), PENDING, 0, now, now, now))
+        with self._lock:
+            with self._db:
+                self._db.executemany('INSERT OR IGNORE INTO outbox (key, service, uri, payload, status, attempts, '
+                                     'next_attempt, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return [row[0] for row in rows]
+
+    def add(self, service, uri, payload, key=None):
+        return self.add_many([(service, uri, payload, key)])[0]
+
+    def due(self, limit):
+        """Claim the oldest pending submissions due for an attempt, at most ``limit``, and return them.
+
+        Claimed submissions are not returned to any other caller until
+        :meth:`record` releases them or their lease expires.
+        """
+        now = self.clock()
+        claim = uuid.uuid4().hex
+        with self._lock:
+            with self._db:
+                self._db.execute('UPDATE outbox SET status = ?, claim = ?, lease_until = ? WHERE id IN '
+                                 '(SELECT id FROM outbox WHERE (status = ? AND next_attempt <= ?) '
+                                 'OR (status = ? AND lease_until <= ?) ORDER BY id LIMIT ?)',
+                                 (SENDING, claim, now + self.lease, PENDING, now, SENDING, now, limit))
+                rows = self._db.execute('SELECT key, service, uri, payload, attempts FROM outbox '
+                                        'WHERE status = ? AND claim = ? ORDER BY id', (SENDING, claim)).fetchall()
+        return [Entry(key, service, uri, fastjson.loads(payload), attempts)
+                for key, service, uri, payload, attempts in rows]
+
+    def next_due(self):
+        """Time of the next pending attempt, or ``None`` when nothing is pending."""
+        with self._lock:
+            return self._db.execute('SELECT MIN(next_attempt) FROM outbox WHERE status = ?', (PENDING,)).fetchone()[0]
+
+    def record(self, results):
+        """Record ``(key, status, job_id, error, next_attempt)`` attempt results, in one transaction.
+
+        Releases the claims on these submissions.
+        """
+        now = self.clock()
+        with self._lock:
+            with self._db:
+                self._db.executemany('UPDATE outbox SET status = ?, job_id = ?, error = ?, next_attempt = ?, '
+                                     'attempts = attempts + 1, updated = ?, claim = NULL, lease_until = NULL '
+                                     'WHERE key = ?',
+                                     [(status, job_id, error, next_attempt, now, key)
+                                      for key, status, job_id, error, next_attempt in results])
+
+    def retry_failed(self):
+        """Queue the failed submissions again, returning how many."""
+        with self._lock:
+            with self._db:
+                return self._db.execute('UPDATE outbox SET status = ?, attempts = 0, next_attempt = ? '
+                                        'WHERE status = ?', (PENDING, self.clock(), FAILED)).rowcount
+
+    def results(self, keys):
+        """``{key: (status, job_id, error)}`` of the queued submissions among ``keys``."""
+        keys = list(dict.fromkeys(keys))
+        results = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._db.execute(f"SELECT key, status, job_id, error FROM outbox "
+                                        f"WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                results.update((key, (status, job_id, error)) for key, status, job_id, error in rows)
+        return results
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+    def entries(self, status=None):
+        """``(key, service, status, attempts, job_id, error)`` of the submissions, oldest first."""
+        query = 'SELECT key, service, status, attempts, job_id, error FROM outbox'
+        params = ()
+        if status:
+            query += ' WHERE status = ?'
+            params = (status,)
+        with self._lock:
+            return self._db.execute(query + ' ORDER BY id', params).fetchall()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Flusher(threading.Thread):
+    """Send the submissions of an outbox with ``send(entry)``, which returns the job identifier.
+
+    Runs until the outbox is drained after :meth:`close` was called, or until
+    ``timeout`` seconds elapsed; submissions still pending are then sent by the
+    next flush. Call :meth:`wake` after queueing submissions to send them at once.
+    Errors for which ``is_transient(error)`` holds are retried up to
+    ``max_attempts`` times, waiting a random time up to ``initial`` seconds
+    doubling at every attempt, up to ``maximum``; the others fail straight away.
+    Batches of up to ``batch_size`` submissions are sent ``concurrency`` at a
+    time, and are halved after a transient error and doubled back after a batch
+    went through.
+    """
+
+    def __init__(self, outbox, send, batch_size=50, concurrency=4, rate=None, max_attempts=8, initial=1.0,
+                 maximum=300.0, is_transient=lambda error: True, timeout=None):
+        super().__init__(name='outbox-flusher', daemon=True)
+        self.outbox = outbox
+        self.send = send
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.initial = initial
+        self.maximum = maximum
+        self.is_transient = is_transient
+        self.timeout = timeout
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._wake = threading.Event()
+        self._closed = False
+
+    def wake(self):
+        self._wake.set()
+
+    def close(self):
+        """No more submissions are coming: stop once the outbox is drained."""
+        self._closed = True
+        self._wake.set()
+
+    def delay(self, attempts):
+        return random.uniform(0, min(self.maximum, self.initial * 2 ** attempts))
+
+    def flush_batch(self, batch):
+        results = []
+        throttled = False
+        for outcome in run_bounded(self.send, batch, concurrency=self.concurrency, rate=self.rate):
+            entry = outcome.item
+            if outcome.error is None:
+                self.sent += 1
+                logging.info('%s submission %s sent with ID %s', entry.service, entry.key, outcome.result)
+                results.append((entry.key, SENT, str(outcome.result), None, None))
+            elif self.is_transient(outcome.error) and entry.attempts + 1 < self.max_attempts:
+                self.retried += 1
+                throttled = True
+                delay = self.delay(entry.attempts)
+                logging.warning('%s submission %s failed, retrying in %.0fs: %s', entry.service, entry.key, delay,
+                                outcome.error)
+                results.append((entry.key, PENDING, None, str(outcome.error), self.outbox.clock() + delay))
+            else:
+                self.failed += 1
+                logging.error('%s submission %s failed: %s', entry.service, entry.key, outcome.error)
+                results.append((entry.key, FAILED, None, str(outcome.error), None))
+        self.outbox.record(results)
+        return throttled
+
+    def run(self):
+        deadline = None if self.timeout is None else self.outbox.clock() + self.timeout
+        size = self.batch_size
+        while True:
+            self._wake.clear()
+            batch = self.outbox.due(size)
+            if batch:
+                throttled = self.flush_batch(batch)
+                size = max(1, size // 2) if throttled else min(self.batch_size, size * 2)
+                continue
+            now = self.outbox.clock()
+            next_due = self.outbox.next_due()
+            if next_due is None and self._closed:
+                break
+            if deadline is not None and now >= deadline:
+                logging.warning('Outbox flush timed out with submissions pending')
+                break
+            waits = [time - now for time in (next_due, deadline) if time is not None]
+            self._wake.wait(max(0.0, min(waits)) if waits else None)
+
+
+def flush(outbox, send, **kwargs):
+    """Send the submissions of ``outbox`` until none is pending (see :class:`Flusher`), returning the flusher."""
+    flusher = Flusher(outbox, send, **kwargs)
+    flusher.close()
+    flusher.run()
+    return flusher
@@ -0,0 +1,201 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Move items, e.g. databases, through a sequence of job stages, each item on its own.
+
+A stage submits a job for an item and polls it until it is done or failed. An
+item enters the next stage as soon as its job in the previous one is done, so
+that the stages of different items overlap, and each stage has its own limit
+of jobs in flight. Progress is checkpointed to SQLite after every transition:
+running the same pipeline again polls the jobs already submitted rather than
+submitting them again, and skips the stages already done.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, namedtuple
+
+from scripts.utils.concurrency import run_bounded
+from scripts.utils.polling import Backoff
+
+# ``submit(item)`` returns a job identifier, ``poll(item, job_id)`` one of RUNNING, DONE or FAILED. With
+# ``group(item)``, e.g. the target host of a copy, ``concurrency`` caps the jobs in flight per group
+Stage = namedtuple('Stage', 'name submit poll concurrency group', defaults=(None,))
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SUBMITTED = 'submitted'
+
+
+class Checkpoint:
+    """Status and job of every item in every stage, kept in a SQLite file."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute('CREATE TABLE IF NOT EXISTS stages (item TEXT, stage TEXT, status TEXT, job_id TEXT, '
+                         'message TEXT, updated REAL, PRIMARY KEY (item, stage))')
+        self._db.commit()
+
+    def state(self, item):
+        """``{stage: (status, job_id)}`` recorded for ``item``."""
+        with self._lock:
+            rows = self._db.execute('SELECT stage, status, job_id FROM stages WHERE item = ?', (item,)).fetchall()
+        return {stage: (status, job_id) for stage, status, job_id in rows}
+
+    def record(self, item, stage, status, job_id=None, message=None):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO stages (item, stage, status, job_id, message, updated) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', (item, stage, status, job_id, message, time.time()))
+            self._db.commit()
+
+    def rows(self):
+        """``(item, stage, status, job_id, message)`` of every recorded stage, by item."""
+        with self._lock:
+            return self._db.execute('SELECT item, stage, status, job_id, message FROM stages '
+                                    'ORDER BY item, updated').fetchall()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _Progress:
+
+    def __init__(self, item, stage, job_id=None):
+        self.item = item
+        self.stage = stage
+        self.job_id = job_id
+        self.next_poll = 0.0
+        self.backoff = None
+
+
+def run_pipeline(items, stages, checkpoint, concurrency=8, initial=30.0, maximum=300.0, factor=1.5,
+                 retry_failed=False, timeout=None, clock=time.monotonic, sleep=time.sleep):
+    """Run every item through ``stages`` and return ``{item: (stage name, status)}``.
+
+    The status is DONE for items through every stage, FAILED with the stage that
+    failed, or RUNNING when ``timeout`` seconds passed first; the jobs still
+    running are then picked up by the next run. Items failed in a previous run
+    are tried again from their failed stage with ``retry_failed``. Submissions
+    and polls are made ``concurrency`` at a time, and each job is polled with a
+    backoff from ``initial`` to ``maximum`` seconds.
+    """
+    names = [stage.name for stage in stages]
+    results = {}
+    active = []
+    for item in dict.fromkeys(items):
+        state = checkpoint.state(item)
+        for index, name in enumerate(names):
+            status, job_id = state.get(name, (None, None))
+            if status == DONE:
+                continue
+            if status == FAILED and not retry_failed:
+                results[item] = (name, FAILED)
+            else:
+                active.append(_Progress(item, index, job_id if status == SUBMITTED else None))
+                if status == SUBMITTED:
+                    logging.info('%s: resuming %s job %s', item, name, job_id)
+            break
+        else:
+            results[item] = (names[-1], DONE) if names else (None, DONE)
+
+    def fail(progress, message):
+        name = names[progress.stage]
+        checkpoint.record(progress.item, name, FAILED, progress.job_id, message)
+        logging.error('%s: %s failed: %s', progress.item, name, message)
+        results[progress.item] = (name, FAILED)
+        active.remove(progress)
+
+    def advance(progress):
+        name = names[progress.stage]
+        checkpoint.record(progress.item, name, DONE, progress.job_id)
+        logging.info('%s: %s done', progress.item, name)
+        progress.stage += 1
+        progress.job_id = None
+        if progress.stage == len(stages):
+            results[progress.item] = (name, DONE)
+            active.remove(progress)
+
+    def submit(progress):
+        return stages[progress.stage].submit(progress.item)
+
+    def poll(progress):
+        return stages[progress.stage].poll(progress.item, progress.job_id)
+
+    def slot(progress):
+        group = stages[progress.stage].group
+        return progress.stage, None if group is None else group(progress.item)
+
+    deadline = None if timeout is None else clock() + timeout
+    while active:
+        in_flight = Counter(slot(p) for p in active if p.job_id is not None)
+        ready = []
+        for progress in list(active):
+            if progress.job_id is None and in_flight[slot(progress)] < stages[progress.stage].concurrency:
+                in_flight[slot(progress)] += 1
+                ready.append(progress)
+        for outcome in run_bounded(submit, ready, concurrency=concurrency):
+            progress = outcome.item
+            if outcome.error:
+                fail(progress, f'submission failed: {outcome.error}')
+                continue
+            progress.job_id = str(outcome.result)
+            progress.backoff = Backoff(initial, maximum, factor)
+            progress.next_poll = clock() + progress.backoff.next()
+            checkpoint.record(progress.item, names[progress.stage], SUBMITTED, progress.job_id)
+            logging.info('%s: %s submitted as job %s', progress.item, names[progress.stage], progress.job_id)
+
+        now = clock()
+        due = [p for p in active if p.job_id is not None and p.next_poll <= now]
+        advanced = False
+        for outcome in run_bounded(poll, due, concurrency=concurrency):
+            progress = outcome.item
+            if outcome.error is None and outcome.result == DONE:
+                advance(progress)
+                advanced = True
+            elif outcome.error is None and outcome.result == FAILED:
+                fail(progress, 'job failed')
+            else:
+                if outcome.error is not None:
+                    logging.warning('%s: could not poll %s job %s: %s', progress.item, names[progress.stage],
+                                    progress.job_id, outcome.error)
+                progress.backoff = progress.backoff or Backoff(initial, maximum, factor)
+                progress.next_poll = clock() + progress.backoff.next()
+
+        if not active:
+            break
+        if deadline is not None and clock() >= deadline:
+            for progress in active:
+                results[progress.item] = (names[progress.stage], RUNNING)
+            logging.warning('Timed out with %s item(s) still in progress', len(active))
+            break
+        if advanced:
+            continue
+        waits = [p.next_poll for p in active if p.job_id is not None]
+        if waits:
+            wake = min(waits) if deadline is None else min(min(waits), deadline)
+            sleep(max(0.0, wake - clock()))
+    return results
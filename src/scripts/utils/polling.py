@@ -0,0 +1,93 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Polling of many service jobs from a single process with adaptive, per-job backoff."""
+
+import heapq
+import itertools
+import logging
+import time
+
+from scripts.utils.concurrency import run_bounded
+
+
+class Backoff:
+    """Polling interval growing geometrically from ``initial`` up to ``maximum`` seconds.
+
+    Jobs which keep changing state are polled quickly, while long running jobs
+    whose state does not change are polled less and less often.
+    """
+
+    def __init__(self, initial=5.0, maximum=300.0, factor=1.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.interval = initial
+
+    def reset(self):
+        self.interval = self.initial
+
+    def next(self):
+        interval = self.interval
+        self.interval = min(self.maximum, self.interval * self.factor)
+        return interval
+
+
+def watch(keys, fetch, state_of, is_terminal, on_change, concurrency=8, initial=5.0, maximum=300.0, factor=1.5,
+          timeout=None, clock=time.monotonic, sleep=time.sleep):
+    """Poll ``fetch(key)`` for every key until ``is_terminal(state)`` holds for all of them.
+
+    ``state_of(record)`` extracts the state from a fetched record, and
+    ``on_change(key, old_state, new_state, record)`` is called on every state
+    transition, including the first observed state (with ``old_state`` ``None``).
+    Jobs due at the same time are fetched concurrently, at most ``concurrency``
+    at once. Fetch errors are logged and retried with the job's backoff.
+
+    Returns a dictionary of the last known state per key; keys still missing
+    from it, or in a non terminal state, had not finished when ``timeout``
+    seconds elapsed.
+    """
+    deadline = clock() + timeout if timeout else None
+    counter = itertools.count()
+    backoffs = {}
+    queue = []
+    for key in dict.fromkeys(keys):
+        backoffs[key] = Backoff(initial, maximum, factor)
+        heapq.heappush(queue, (clock(), next(counter), key))
+    states = {}
+    while queue:
+        now = clock()
+        if deadline is not None and now >= deadline:
+            logging.warning('Timed out with %s job(s) still running', len(queue))
+            break
+        due = []
+        while queue and queue[0][0] <= now:
+            due.append(heapq.heappop(queue)[2])
+        if not due:
+            wake = queue[0][0] if deadline is None else min(queue[0][0], deadline)
+            sleep(wake - now)
+            continue
+        for outcome in run_bounded(fetch, due, concurrency=concurrency):
+            key = outcome.item
+            backoff = backoffs[key]
+            if outcome.error:
+                logging.warning('Could not retrieve %s: %s', key, outcome.error)
+            else:
+                state = state_of(outcome.result)
+                if key not in states or states[key] != state:
+                    on_change(key, states.get(key), state, outcome.result)
+                    backoff.reset()
+                states[key] = state
+                if is_terminal(state):
+                    continue
+            heapq.heappush(queue, (clock() + backoff.next(), next(counter), key))
+    return states
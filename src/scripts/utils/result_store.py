@@ -0,0 +1,149 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Local SQLite store of datacheck jobs and their results, updating only the jobs which changed."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from scripts.utils.cache import default_cache_dir
+from scripts.utils.concurrency import run_bounded
+from scripts.utils.datachecks import iter_results, job_tag
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    tag TEXT,
+    status TEXT,
+    fingerprint TEXT,
+    document TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    job_id TEXT,
+    tag TEXT,
+    dbname TEXT,
+    datacheck TEXT,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    scope TEXT PRIMARY KEY,
+    job_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_tag ON jobs (tag);
+CREATE INDEX IF NOT EXISTS results_job ON results (job_id);
+CREATE INDEX IF NOT EXISTS results_tag ON results (tag, status);
+CREATE INDEX IF NOT EXISTS results_dbname ON results (dbname, datacheck);
+CREATE INDEX IF NOT EXISTS results_datacheck ON results (datacheck, status);
+"""
+
+
+def default_store_path(uri):
+    digest = hashlib.sha1(uri.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(default_cache_dir(), f'datacheck-results-{digest}.sqlite')
+
+
+def fingerprint(job):
+    return hashlib.sha1(json.dumps(job, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class DatacheckResultStore:
+    """Datacheck jobs as listed by the service, with their results indexed by tag, database,
+    datacheck name and status."""
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def watermark(self, scope=''):
+        """Job id below which the jobs of ``scope``, a tag or ``''`` for all jobs, are stored and finished."""
+        row = self._db.execute('SELECT job_id FROM watermarks WHERE scope = ?', (scope,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, scope, job_id):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO watermarks (scope, job_id) VALUES (?, ?)', (scope, job_id))
+
+    def fingerprints(self):
+        return dict(self._db.execute('SELECT id, fingerprint FROM jobs'))
+
+    def sync(self, jobs, fetch_detail=None, needs_detail=None, concurrency=4):
+        """Store the jobs from a service listing which are new or changed since the last sync.
+
+        ``fetch_detail(job)`` is called, for changed jobs only and when
+        ``needs_detail(job)`` is true, to retrieve the complete job document to
+        store instead of the listed one. Details are fetched concurrently.
+        Returns the ids of stored jobs.
+        """
+        known = self.fingerprints()
+        changed = []
+        for job in jobs:
+            job_id = str(job['id'])
+            digest = fingerprint(job)
+            if known.get(job_id) != digest:
+                changed.append((job_id, digest, job))
+        if fetch_detail is not None:
+            wanted = [item for item in changed if needs_detail is None or needs_detail(item[2])]
+            details = {}
+            for outcome in run_bounded(lambda item: fetch_detail(item[2]), wanted, concurrency=concurrency):
+                if outcome.error:
+                    raise outcome.error
+                details[outcome.item[0]] = outcome.result
+            changed = [(job_id, digest, details.get(job_id, job)) for job_id, digest, job in changed]
+        with self._lock, self._db:
+            for job_id, digest, job in changed:
+                self._db.execute('DELETE FROM results WHERE job_id = ?', (job_id,))
+                self._db.execute('INSERT OR REPLACE INTO jobs (id, tag, status, fingerprint, document) '
+                                 'VALUES (?, ?, ?, ?, ?)',
+                                 (job_id, job_tag(job), job.get('status'), digest, json.dumps(job, default=str)))
+                self._db.executemany('INSERT INTO results (job_id, tag, dbname, datacheck, status) '
+                                     'VALUES (?, ?, ?, ?, ?)',
+                                     ((job_id, job_tag(job)) + result for result in iter_results(job)))
+        return [job_id for job_id, _, _ in changed]
+
+    def jobs(self, tag=None, failure_only=False):
+        """Stored job documents, optionally restricted to a tag and to jobs with failures."""
+        query = 'SELECT document FROM jobs WHERE 1 = 1'
+        params = []
+        if tag is not None:
+            query += ' AND tag = ?'
+            params.append(tag)
+        if failure_only:
+            query += (" AND (status = 'failed' OR id IN "
+                      "(SELECT job_id FROM results WHERE status = 'failed'))")
+        query += ' ORDER BY CAST(id AS INTEGER), id'
+        for (document,) in self._db.execute(query, params):
+            yield json.loads(document)
+
+    def results(self, tag=None, dbname=None, datacheck=None, status=None):
+        """Stored results as ``(job_id, tag, dbname, datacheck, status)`` tuples."""
+        query = 'SELECT job_id, tag, dbname, datacheck, status FROM results WHERE 1 = 1'
+        params = []
+        for column, value in (('tag', tag), ('dbname', dbname), ('datacheck', datacheck), ('status', status)):
+            if value is not None:
+                query += f' AND {column} = ?'
+                params.append(value)
+        return self._db.execute(query, params)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,62 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Spread database copies over target hosts so that they all finish as early as possible."""
+
+from collections import namedtuple
+
+# ``start`` and ``end`` estimate when the copy runs, in bytes copied by one slot of its target
+Assignment = namedtuple('Assignment', 'dbname size target start end')
+
+
+def plan_copies(sizes, targets, slots=1):
+    """Assign the databases of ``{dbname: bytes}`` to ``targets``, each running ``slots`` copies at a time.
+
+    Databases are taken largest first and each goes to the target slot free the
+    earliest, or to the least loaded of the targets with a slot free as early,
+    assuming a copy takes time proportional to its size, so that large databases
+    do not pile up on a target while others sit idle. Assignments are returned in
+    that order, which is also the order to submit them in.
+    """
+    targets = list(dict.fromkeys(targets))
+    if not targets:
+        raise ValueError('At least one target host is required')
+    if slots < 1:
+        raise ValueError('At least one copy per target is required')
+    free = [[0] * slots for _ in targets]
+    loads = [0] * len(targets)
+    plan = []
+    for dbname, size in sorted(sizes.items(), key=lambda item: (-item[1], item[0])):
+        start, _, index, slot = min((free[index][slot], loads[index], index, slot)
+                                    for index in range(len(targets)) for slot in range(slots))
+        plan.append(Assignment(dbname, size, targets[index], start, start + size))
+        free[index][slot] = start + size
+        loads[index] += size
+    return plan
+
+
+def target_loads(plan):
+    """``{target: (databases, bytes, estimated end)}`` of a plan, in target order of first assignment."""
+    loads = {}
+    for assignment in plan:
+        count, total, end = loads.get(assignment.target, (0, 0, 0))
+        loads[assignment.target] = (count + 1, total + assignment.size, max(end, assignment.end))
+    return loads
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
@@ -0,0 +1,202 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Incremental decoding and writing of large JSON job lists."""
+
+import codecs
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from scripts.utils import fastjson
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(chunks):
+    """Yield the elements of a top level JSON array read from an iterable of chunks.
+
+    Chunks may be ``bytes`` (decoded as UTF-8) or ``str``. Only one element is
+    held in memory at a time, whatever the size of the whole document.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    started = False
+    exhausted = False
+
+    def more():
+        nonlocal buffer, pos, exhausted
+        for chunk in chunks:
+            chunk = text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if chunk:
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                return True
+        exhausted = True
+        return False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE + (',' if started else ''):
+            pos += 1
+        if pos >= len(buffer):
+            if more():
+                continue
+            raise ValueError('Truncated JSON array')
+        if not started:
+            if buffer[pos] != '[':
+                raise ValueError(f"Expected a JSON array, got {buffer[pos:pos + 20]!r}")
+            started = True
+            pos += 1
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if exhausted or not more():
+                raise
+            continue
+        if end == len(buffer) and not isinstance(element, (dict, list)) and not exhausted and more():
+            # A scalar at the end of the buffer may continue in the next chunk
+            continue
+        pos = end
+        yield element
+
+
+def iter_json_records(session, url, params=None, results_key='results'):
+    """Stream the records of a JSON list served at ``url``.
+
+    Plain top level arrays are decoded incrementally as they arrive. Paginated
+    responses, i.e. objects holding the page under ``results_key`` and the next
+    page URL under ``next``, are followed page by page.
+    """
+    response = session.get(url, params=params, stream=True)
+    while True:
+        try:
+            response.raise_for_status()
+            chunks = response.iter_content(CHUNK_SIZE)
+            first = next((chunk for chunk in chunks if chunk.strip()), b'')
+            if first.lstrip()[:1] != b'{':
+                yield from iter_json_array(_prepend(first, chunks))
+                return
+            page = fastjson.loads(b''.join(_prepend(first, chunks)))
+        finally:
+            response.close()
+        yield from page.get(results_key) or []
+        if not page.get('next'):
+            return
+        response = session.get(page['next'], stream=True)
+
+
+def copy_response(session, url, fh, params=None):
+    """Write the body served at ``url`` to the binary file ``fh`` as it arrives, without decoding it."""
+    size = 0
+    with session.get(url, params=params, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            fh.write(chunk)
+            size += len(chunk)
+    fh.flush()
+    return size
+
+
+def iter_pages(session, url, params=None, results_key='results'):
+    """Yield the record lists of a paginated JSON list, one page at a time.
+
+    The next page is requested in the background as soon as a page is decoded,
+    so that it downloads while the caller processes the current one. Only two
+    pages are held in memory at once. A plain JSON array is yielded as a single
+    page.
+    """
+
+    def fetch(page_url, page_params):
+        response = session.get(page_url, params=page_params)
+        response.raise_for_status()
+        return response.json()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(fetch, url, params)
+        while pending is not None:
+            page = pending.result()
+            if isinstance(page, list):
+                yield page
+                return
+            pending = executor.submit(fetch, page['next'], None) if page.get('next') else None
+            yield page.get(results_key) or []
+
+
+def project(record, fields):
+    """Keep only ``fields`` of a record, where ``a.b`` selects key ``b`` of the mapping under ``a``."""
+    projected = {}
+    for field in fields:
+        value = record
+        for key in field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        projected[field] = value
+    return projected
+
+
+def _prepend(first, chunks):
+    if first:
+        yield first
+    yield from chunks
+
+
+def iter_json_file(path):
+    """Stream the records of a file holding either a JSON array or one JSON document per line."""
+    with open(path, 'rb') as fh:
+        first = b''
+        while not first.strip():
+            first = fh.read(1)
+            if not first:
+                return
+        if first == b'[':
+            yield from iter_json_array(_prepend(first, iter(lambda: fh.read(CHUNK_SIZE), b'')))
+            return
+        for line in _prepend(first + fh.readline(), fh):
+            if line.strip():
+                yield fastjson.loads(line)
+
+
+def parse_datetime(value):
+    """Parse an ISO 8601 date or date/time, as a timezone aware UTC datetime."""
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        value = str(value).strip()
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def write_ndjson(records, fh, flush_every=1000):
+    """Write one compact JSON document per line.
+
+    Output is flushed every ``flush_every`` records and at the end, so that it
+    streams without paying for a flush per record.
+    """
+    count = 0
+    for record in records:
+        fh.write(fastjson.dumps(record))
+        fh.write('\n')
+        count += 1
+        if count % flush_every == 0:
+            fh.flush()
+    fh.flush()
+    return count
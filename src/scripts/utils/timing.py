@@ -0,0 +1,181 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Record where the time of a command goes, one HTTP call at a time.
+
+Each call records its DNS, connect, TLS, time to first byte and transfer times,
+the bytes received (decoded and on the wire) and the time spent decoding the
+JSON answer. :class:`Timings` keeps the calls of a command and summarises them
+per endpoint with latency percentiles and histograms, next to the total time of
+the command and the part of it spent outside HTTP calls and decoding.
+"""
+
+import atexit
+import functools
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer', 'decode')
+# Upper bounds of the latency histogram buckets, in milliseconds
+HISTOGRAM_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+IDENTIFIER = re.compile(r'^(\d+|[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}|[0-9a-f]{16,})$', re.IGNORECASE)
+
+
+def endpoint_name(method, url):
+    """``METHOD /path`` with job identifiers and UUIDs replaced by ``{id}``."""
+    path = '/'.join('{id}' if IDENTIFIER.match(part) else part for part in urlsplit(url).path.split('/'))
+    return f'{method} {path}'
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))]
+
+
+def histogram(seconds):
+    """Count of ``seconds`` per bucket, labelled by the bucket upper bound (``le_<ms>`` or ``inf``)."""
+    counts = OrderedDict((f'le_{bound}ms', 0) for bound in HISTOGRAM_BOUNDS_MS)
+    counts['inf'] = 0
+    for value in seconds:
+        milliseconds = value * 1000
+        label = next((f'le_{bound}ms' for bound in HISTOGRAM_BOUNDS_MS if milliseconds <= bound), 'inf')
+        counts[label] += 1
+    return counts
+
+
+class Timings:
+    """Calls made by one command, with the totals and per endpoint summary of :meth:`summary`."""
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.started = clock()
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def new_call(self, method, url):
+        call = {'method': method, 'url': url, 'endpoint': endpoint_name(method, url), 'status': None,
+                'total': 0.0, 'bytes': None, 'wire_bytes': None, 'error': None}
+        call.update((phase, 0.0) for phase in PHASES)
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    def summary(self):
+        wall = self._clock() - self.started
+        with self._lock:
+            calls = list(self.calls)
+        totals = {'wall': wall, 'calls': len(calls), 'errors': sum(1 for call in calls if call['error']),
+                  'bytes': sum(call['bytes'] or 0 for call in calls),
+                  'wire_bytes': sum(call['wire_bytes'] or 0 for call in calls),
+                  'http': sum(call['total'] for call in calls)}
+        totals.update((phase, sum(call[phase] for call in calls)) for phase in PHASES)
+        # Calls made concurrently overlap, so the remainder is only meaningful for sequential commands
+        totals['post_processing'] = max(0.0, wall - totals['http'] - totals['decode'])
+        endpoints = OrderedDict()
+        for call in calls:
+            endpoints.setdefault(call['endpoint'], []).append(call)
+        return {
+            'totals': totals,
+            'endpoints': OrderedDict((name, {
+                'calls': len(group),
+                'bytes': sum(call['bytes'] or 0 for call in group),
+                'p50': percentile([call['total'] for call in group], 0.5),
+                'p90': percentile([call['total'] for call in group], 0.9),
+                'p99': percentile([call['total'] for call in group], 0.99),
+                'histogram': histogram(call['total'] for call in group),
+            }) for name, group in endpoints.items()),
+            'calls': calls,
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def format_text(self):
+        summary = self.summary()
+        totals = summary['totals']
+        lines = [f"{totals['calls']} HTTP call(s), {totals['errors']} failed, {totals['bytes']} bytes "
+                 f"({totals['wire_bytes']} on the wire) in {totals['wall']:.3f}s",
+                 '  ' + ', '.join(f'{phase} {totals[phase]:.3f}s' for phase in PHASES + ('post_processing',))]
+        for name, endpoint in summary['endpoints'].items():
+            lines.append(f"  {name}: {endpoint['calls']} call(s), p50 {endpoint['p50'] * 1000:.1f}ms, "
+                         f"p90 {endpoint['p90'] * 1000:.1f}ms, p99 {endpoint['p99'] * 1000:.1f}ms")
+        return '\n'.join(lines)
+
+
+_active = threading.local()
+
+
+def active_call():
+    """The call being sent by the current thread, if timings are recorded."""
+    return getattr(_active, 'call', None)
+
+
+def set_active_call(call):
+    _active.call = call
+
+
+def timed(function, phase):
+    """Wrap ``function`` to add its duration to ``phase`` of the active call, outermost invocation only."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        call = active_call()
+        running = getattr(_active, 'phases', None)
+        if running is None:
+            running = _active.phases = set()
+        if call is None or phase in running:
+            return function(*args, **kwargs)
+        running.add(phase)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            call[phase] += time.perf_counter() - start
+            running.discard(phase)
+
+    return wrapper
+
+
+_pending = []
+_pending_lock = threading.Lock()
+_registered = False
+
+
+def report_at_exit(timings, text=False, json_path=None):
+    """Log and/or write the timings when the command finishes, or at the latest when the process exits."""
+    global _registered
+    with _pending_lock:
+        _pending.append((timings, text, json_path))
+        if not _registered:
+            atexit.register(flush)
+            _registered = True
+
+
+def flush():
+    """Report the timings of the commands run so far."""
+    while True:
+        with _pending_lock:
+            if not _pending:
+                return
+            timings, text, json_path = _pending.pop(0)
+        if text:
+            logging.info(timings.format_text())
+        if json_path:
+            timings.write_json(json_path)
@@ -0,0 +1,209 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Benchmark the client commands against local stub services.
+
+Each case starts a :class:`~tests.stub_services.StubService` and runs one
+``prodinf`` command against it ``--repeat`` times, each in a fresh process as
+it runs in production. It records the latency percentiles, the throughput in
+records per second and the peak resident memory of the command. Cases with a
+failed run are reported as failed, without measurements, and cases whose core
+client is not installed are skipped. Write the report with ``--output`` and
+compare two commits with ``--compare``::
+
+    cd src
+    python -m tests.benchmark_clients --records 50000 --output before.json
+    python -m tests.benchmark_clients --records 50000 --compare before.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from tests.stub_services import StubService
+
+SRC = str(Path(__file__).resolve().parents[1])
+
+# Core client module and class run by the commands of each service
+CLIENTS = {
+    'dbcopy': ('ensembl.production.core.clients.dbcopy', 'DbCopyRestClient'),
+    'datacheck': ('ensembl.production.core.clients.datachecks', 'DatacheckClient'),
+    'handover': ('ensembl.production.core.clients.handover', 'HandoverClient'),
+    'gifts': ('ensembl.production.core.clients.gifts', 'GIFTsClient'),
+    'metadata': ('ensembl.production.core.clients.genomemetadata', 'GenomeMetadataRestClient'),
+}
+
+# Case name: (service, prodinf arguments, whether the command reads every record of the service)
+CASES = {
+    'dbcopy-list': ('dbcopy', ['list', '-u', '{uri}', '-e', 'me@ebi.ac.uk', '-r', 'user1', '--format', 'ndjson'],
+                    True),
+    'dbcopy-retrieve': ('dbcopy', ['retrieve', '-u', '{uri}', '-e', 'me@ebi.ac.uk', '-r', 'user1', '-j', '1'], False),
+    'datacheck-list': ('datacheck', ['list', '-u', '{uri}', '-s', 'mysql://user@host:3306/', '-o', '{tmp}/list.json'],
+                       True),
+    'datacheck-list-tag': ('datacheck', ['list', '-u', '{uri}', '-s', 'mysql://user@host:3306/', '-t', 'release_1',
+                                         '-o', '{tmp}/list.json'], True),
+    'datacheck-retrieve': ('datacheck', ['retrieve', '-u', '{uri}', '-s', 'mysql://user@host:3306/', '-i', '1'],
+                           False),
+    'handover-list': ('handover', ['list', '-u', '{uri}'], True),
+    'handover-summary': ('handover', ['summary', '-u', '{uri}', '--incremental', '--summary_state',
+                                      '{tmp}/summary.sqlite'], True),
+    'handover-retrieve': ('handover', ['retrieve', '-u', '{uri}', '-t', '00000001-2222-4000-8000-000000000000'], False),
+    'gifts-list': ('gifts', ['list', '-u', '{uri}', '-r', '110', '-n', 'dev', '-e', 'me@ebi.ac.uk',
+                             '-o', '{tmp}/list.json'], True),
+    'gifts-retrieve': ('gifts', ['retrieve', '-u', '{uri}', '-r', '110', '-n', 'dev', '-e', 'me@ebi.ac.uk',
+                                 '-i', '1'], False),
+    'metadata-list': ('metadata', ['list', '-u', '{uri}', '-t', 'datasets', '-o', '{tmp}/list.ndjson'], True),
+    'metadata-retrieve': ('metadata', ['retrieve', '-u', '{uri}', '-t', 'genomes',
+                                       '-g', '00000001-0000-4000-8000-000000000000'], False),
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))]
+
+
+def missing_client(service):
+    """Why the core client of ``service`` cannot be used, or ``None`` when it is installed."""
+    module, name = CLIENTS[service]
+    try:
+        if importlib.util.find_spec(module) is None:
+            return f'{module} is not installed'
+    except ModuleNotFoundError:
+        return f'{module} is not installed'
+    try:
+        getattr(importlib.import_module(module), name)
+    except (ImportError, AttributeError) as e:
+        return f'{module}.{name} cannot be loaded: {e}'
+    return None
+
+
+def run_command(arguments, env):
+    """Run ``prodinf`` with ``arguments``, returning the exit status, seconds taken and peak memory in KiB."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'scripts.prodinf', *arguments], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return process.returncode, elapsed, peak
+
+
+def run_case(name, args, env):
+    service, arguments, reads_all = CASES[name]
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubService(service, records=args.records, payload_size=args.payload_size, latency=args.latency,
+                        error_rate=args.error_rate, seed=args.seed) as stub:
+        command = [service] + [argument.format(uri=stub.uri, tmp=tmp) for argument in arguments]
+        runs = [run_command(command, env) for _ in range(args.repeat)]
+        requests = stub.requests
+    failures = sum(1 for status, _, _ in runs if status != 0)
+    if failures:
+        # Time to a crash is no measurement of the command
+        return {'runs': len(runs), 'failures': failures, 'requests': requests}
+    times = [elapsed for _, elapsed, _ in runs]
+    median = percentile(times, 0.5)
+    return {
+        'runs': len(runs),
+        'failures': 0,
+        'requests': requests,
+        'mean': sum(times) / len(times),
+        'p50': median,
+        'p90': percentile(times, 0.9),
+        'p99': percentile(times, 0.99),
+        'records_per_second': (args.records if reads_all else 1) / median if median else None,
+        'peak_memory_kb': max(peak for _, _, peak in runs),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_report(report, baseline=None):
+    lines = [f"{'case':<20} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} {'rec/s':>10} {'peak MiB':>9} {'fail':>5}"
+             + ('  p50 vs baseline' if baseline else '')]
+    for name, result in report['results'].items():
+        if result['failures']:
+            lines.append(f"{name:<20} {'failed':>8} {'-':>8} {'-':>8} {'-':>10} {'-':>9} {result['failures']:>5}")
+            continue
+        rate = result['records_per_second']
+        line = (f"{name:<20} {result['p50']:>8.3f} {result['p90']:>8.3f} {result['p99']:>8.3f} "
+                f"{rate if rate is not None else 0:>10.0f} {result['peak_memory_kb'] / 1024:>9.1f} "
+                f"{result['failures']:>5}")
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous and previous.get('p50'):
+            line += f"  {(result['p50'] / previous['p50'] - 1) * 100:+.1f}%"
+        lines.append(line)
+    lines.extend(f'{name:<20} skipped: {reason}' for name, reason in report.get('skipped', {}).items())
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the client commands against local stub services')
+    parser.add_argument('-c', '--cases', help=f"Comma-separated cases to run. Defaults to all: {', '.join(CASES)}")
+    parser.add_argument('--records', type=int, default=10000, help='Jobs or records held by each stub service')
+    parser.add_argument('--payload_size', type=int, default=0, help='Bytes of padding added to every record')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every stub answer waits')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of requests answered 503')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated errors and statuses')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each case')
+    parser.add_argument('--daemon', action='store_true', help='Let a running prodinf daemon run the commands')
+    parser.add_argument('-o', '--output', help='File to write the JSON report to')
+    parser.add_argument('--compare', help='JSON report of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.cases.split(',')] if args.cases else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"Unknown case(s): {', '.join(unknown)}")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SRC, os.environ.get('PYTHONPATH')])))
+    if not args.daemon:
+        env['PRODINF_NO_DAEMON'] = '1'
+
+    skipped = {name: missing_client(CASES[name][0]) for name in names}
+    skipped = {name: reason for name, reason in skipped.items() if reason}
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'settings': {key: getattr(args, key) for key in ('records', 'payload_size', 'latency', 'error_rate',
+                                                          'seed', 'repeat', 'daemon')},
+        'results': {name: run_case(name, args, env) for name in names if name not in skipped},
+        'skipped': skipped,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
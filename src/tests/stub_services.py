@@ -0,0 +1,299 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""Local HTTP stand-ins for the production services, for tests and benchmarks.
+
+:class:`StubService` serves the endpoints the core clients and the scripts call
+for one service (``dbcopy``, ``datacheck``, ``handover``, ``gifts`` or
+``metadata``) from generated records. The number of records, the padding added
+to each one, the latency of every answer and the rate of ``503`` errors are
+configurable. Submitted jobs move through the service's statuses a step at each
+retrieval until they finish, so watchers and pipelines can be exercised.
+"""
+
+import gzip
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Base path of the client URI, and statuses from submission to success and to failure
+SERVICES = {
+    'dbcopy': ('/api/dbcopy/requestjob', ['Submitted', 'Running', 'Complete'], 'Failed'),
+    'datacheck': ('/', ['submitted', 'running', 'incomplete', 'complete'], 'failed'),
+    'handover': ('/', ['Handover submitted', 'Copying database', 'Handover of the database successful'],
+                 'Handover failed: datachecks found problems'),
+    'gifts': ('/', ['submitted', 'running', 'complete'], 'failed'),
+    'metadata': ('/', None, None),
+}
+DIVISIONS = ('vertebrates', 'plants', 'fungi', 'metazoa', 'protists', 'bacteria')
+EPOCH = datetime(2024, 1, 1)
+
+
+def _report_time(number):
+    return (EPOCH + timedelta(minutes=number)).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+class StubService:
+    """Serve one production service on ``127.0.0.1`` from ``records`` generated jobs or metadata records.
+
+    ``error_rate`` of the requests, drawn with ``seed``, are answered ``503``;
+    every answer waits ``latency`` seconds. Responses are gzip encoded when the
+    client accepts it. Use as a context manager, or call :meth:`start` and
+    :meth:`stop`; :attr:`uri` is the URI to give to the client.
+    """
+
+    def __init__(self, kind, records=100, payload_size=0, latency=0.0, error_rate=0.0, failure_rate=0.1,
+                 steps=2, seed=0):
+        if kind not in SERVICES:
+            raise ValueError(f"Unknown service '{kind}'")
+        self.kind = kind
+        self.base, self.statuses, self.failed_status = SERVICES[kind]
+        self.payload_size = payload_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.steps = steps
+        self.requests = 0
+        self.submissions = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._progress = {}
+        self.jobs = {}
+        self.genomes = {}
+        for _ in range(records):
+            self._add(self._record(next(self._ids)))
+        self._server = None
+
+    @property
+    def uri(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}{self.base}'
+
+    # Records
+
+    def _padding(self):
+        return {'padding': 'x' * self.payload_size} if self.payload_size else {}
+
+    def _finished_status(self):
+        if self.statuses is None:
+            return None
+        return self.failed_status if self._random.random() < self.failure_rate else self.statuses[-1]
+
+    def _record(self, number, status=None, spec=None):
+        spec = spec or {}
+        dbname = spec.get('dbname') or f'species_{number}_core_110_1'
+        status = status or self._finished_status()
+        if self.kind == 'dbcopy':
+            record = {'job_id': str(number), 'url': f'{self.base}/{number}',
+                      'src_host': spec.get('src_host', 'src-1:3306'), 'tgt_host': spec.get('tgt_host', 'tgt-1:3306'),
+                      'src_incl_db': spec.get('src_incl_db', dbname), 'user': spec.get('user', f'user{number % 5}'),
+                      'overall_status': status, 'detailed_status': {'progress': 100 if status == 'Complete' else 50},
+                      'request_date': _report_time(number)}
+        elif self.kind in ('datacheck', 'gifts'):
+            failed = 1 if status == self.failed_status else 0
+            server_url = spec.get('server_url') or 'mysql://user@host:3306/'
+            registry = f'/registries/{urlsplit(server_url).hostname}.pm'
+            # Input as the service stores it: the submission, with its lists split and the registry it used
+            record = {'id': number, 'status': status,
+                      'input': {'server_url': server_url, 'registry_file': registry,
+                                'dbname': [dbname], 'db_type': spec.get('db_type') or 'core',
+                                'datacheck_names': spec.get('datacheck_names') or ['CheckA'],
+                                'datacheck_groups': spec.get('datacheck_groups') or [],
+                                'datacheck_types': spec.get('datacheck_types') or [],
+                                'email': spec.get('email') or f'user{number % 5}@ebi.ac.uk',
+                                'tag': spec.get('tag', f'release_{number % 10}')},
+                      'output': {'passed_total': 10 - failed, 'failed_total': failed,
+                                 'output_dir': f'/datachecks/{number}',
+                                 'databases': {dbname: {'failed': {'CheckA': ['problem']} if failed else {},
+                                                        'failed_total': failed}}}}
+        elif self.kind == 'handover':
+            record = {'handover_token': spec.get('handover_token', f'{number:08d}-2222-4000-8000-000000000000'),
+                      'src_uri': spec.get('src_uri', f'mysql://user@host:3306/{dbname}'),
+                      'contact': spec.get('contact', f'user{number % 5}@ebi.ac.uk'),
+                      'division': DIVISIONS[number % len(DIVISIONS)], 'current_message': status,
+                      'report_time': _report_time(number)}
+        else:
+            genome_uuid = f'{number:08d}-0000-4000-8000-000000000000'
+            record = {'dataset_uuid': f'{number:08d}-1111-4000-8000-000000000000', 'name': spec.get('name', 'assembly'),
+                      'dataset_type': spec.get('dataset_type', 'assembly'),
+                      'genome_uuid': spec.get('genome_uuid', genome_uuid), 'attributes': spec.get('attributes', [])}
+        record.update(self._padding())
+        return record
+
+    def _add(self, record):
+        if self.kind == 'metadata':
+            self.jobs[record['dataset_uuid']] = record
+            self.genomes.setdefault(record['genome_uuid'], {'genome_uuid': record['genome_uuid'],
+                                                            'production_name': f"species_{len(self.genomes) + 1}",
+                                                            **self._padding()})
+        else:
+            self.jobs[str(self._key(record))] = record
+
+    def _key(self, record):
+        return record.get('job_id') or record.get('id') or record.get('handover_token')
+
+    def _status_field(self):
+        return {'dbcopy': 'overall_status', 'handover': 'current_message'}.get(self.kind, 'status')
+
+    def _advance(self, key):
+        """Move a submitted job one status further at each retrieval."""
+        if key not in self._progress:
+            return
+        step = self._progress[key] + 1
+        self._progress[key] = step
+        statuses = self.statuses
+        if step >= self.steps:
+            status = self._finished_status()
+            del self._progress[key]
+        else:
+            status = statuses[min(step, len(statuses) - 2)]
+        self.jobs[key][self._status_field()] = status
+        if self.kind in ('datacheck', 'gifts') and status == self.failed_status:
+            output = self.jobs[key]['output']
+            output['failed_total'] = 1
+            for summary in output['databases'].values():
+                summary.update({'failed': {'CheckA': ['problem']}, 'failed_total': 1})
+
+    def submit(self, spec):
+        with self._lock:
+            self.submissions.append(spec)
+            number = next(self._ids)
+            if self.kind == 'metadata':
+                record = self._record(number, spec=spec)
+            else:
+                record = self._record(number, self.statuses[0], spec)
+                self._progress[str(self._key(record))] = 0
+            self._add(record)
+            if self.kind == 'dbcopy':
+                return 201, {'job_id': record['job_id']}
+            if self.kind == 'handover':
+                return 201, {'handover_token': record['handover_token']}
+            if self.kind == 'metadata':
+                return 201, record
+            return 201, {'job_id': record['id']}
+
+    # Routing
+
+    def route(self, method, path, query, body):
+        """Return ``(status, document)`` for a request to ``path``, relative to the base path."""
+        parts = [part for part in path.split('/') if part]
+        if self.kind == 'dbcopy' and parts in (['srchost'], ['tgthost']):
+            return 200, {'results': [{'name': f'{parts[0][:3]}-{n}', 'port': 3306} for n in range(1, 4)]}
+        if self.kind == 'metadata':
+            return self._route_metadata(method, parts, query, body)
+        if self.kind != 'dbcopy':
+            if not parts or parts[0] != 'jobs':
+                return 404, {'error': 'Not found'}
+            parts = parts[1:]
+        if not parts:
+            if method == 'POST':
+                return self.submit(body)
+            if method == 'GET':
+                if self.kind == 'handover':
+                    # Most recent first, as the handover service lists them
+                    return 200, sorted(self.jobs.values(), key=lambda job: job['report_time'], reverse=True)
+                return 200, list(self.jobs.values())
+        elif len(parts) == 1:
+            with self._lock:
+                job = self.jobs.get(parts[0])
+                if job is None:
+                    return 404, {'error': f'Job {parts[0]} not found'}
+                if method == 'DELETE':
+                    del self.jobs[parts[0]]
+                    return 204, None
+                if method == 'GET':
+                    self._advance(parts[0])
+                    return 200, [dict(job)] if self.kind == 'handover' else dict(job)
+        return 405, {'error': 'Method not allowed'}
+
+    def _route_metadata(self, method, parts, query, body):
+        if parts[:2] != ['api', 'genome_metadata'] or len(parts) < 3 or parts[2] not in ('datasets', 'genomes'):
+            return 404, {'error': 'Not found'}
+        table = self.jobs if parts[2] == 'datasets' else self.genomes
+        if len(parts) == 4:
+            record = table.get(parts[3])
+            if method == 'PUT' and record is not None:
+                record.update(body or {})
+            return (200, record) if record is not None else (404, {'error': 'Not found'})
+        if method == 'POST':
+            return self.submit(body)
+        page_size = int(query.get('page_size', ['100'])[0])
+        page = int(query.get('page', ['1'])[0])
+        records = list(table.values())
+        start = (page - 1) * page_size
+        following = None
+        if start + page_size < len(records):
+            following = f'{self.uri}{"/".join(parts)}/?page={page + 1}&page_size={page_size}'
+        return 200, {'count': len(records), 'next': following, 'previous': None,
+                     'results': records[start:start + page_size]}
+
+    # Server
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _answer(self):
+                with service._lock:
+                    service.requests += 1
+                    error = service._random.random() < service.error_rate
+                if service.latency:
+                    time.sleep(service.latency)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                if error:
+                    status, document = 503, {'error': 'Service unavailable'}
+                else:
+                    url = urlsplit(self.path)
+                    path = url.path[len(service.base.rstrip('/')):] if url.path.startswith(service.base) else url.path
+                    if service.kind == 'dbcopy' and not url.path.startswith(service.base):
+                        path = url.path.rsplit('/', 1)[-1]
+                    status, document = service.route(self.command, path, parse_qs(url.query), body)
+                data = b'' if document is None else json.dumps(document).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                if len(data) > 1024 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    data = gzip.compress(data, 5)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _answer
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,61 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import os
+import tempfile
+import unittest
+
+from scripts.utils.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'sub', 'cache.sqlite')
+
+    def cache(self, ttl=60):
+        cache = TTLCache(self.path, ttl=ttl, clock=lambda: self.now)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_expiry(self):
+        cache = self.cache()
+        cache.set('host', {'valid': True})
+        self.assertEqual(cache.get('host'), {'valid': True})
+        self.now += 61
+        self.assertIsNone(cache.get('host'))
+        self.assertEqual(cache.get('host', 'missing'), 'missing')
+
+    def test_persistence(self):
+        self.cache().set('key', [1, 2])
+        self.assertEqual(self.cache().get('key'), [1, 2])
+
+    def test_delete_and_purge(self):
+        cache = self.cache()
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=600)
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+        self.now += 120
+        cache.purge()
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_set_many(self):
+        cache = self.cache()
+        cache.set_many((f'genomes:{i}', {'genome_uuid': i}) for i in range(3))
+        self.assertEqual(cache.get('genomes:2'), {'genome_uuid': 2})
+        self.now += 61
+        self.assertIsNone(cache.get('genomes:0'))
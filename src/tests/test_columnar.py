@@ -0,0 +1,80 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import csv
+import importlib.util
+import os
+import tempfile
+import unittest
+
+from scripts.utils.columnar import SUMMARY_COLUMNS, ResultColumns, TableWriter, write_table
+from scripts.utils.datachecks import parse_dbname
+
+
+class TestResultColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = ResultColumns(('datacheck', 'db_type', 'status'))
+        self.columns.extend([('A', 'core', 'failed'), ('A', 'core', 'passed'), ('B', 'core', 'failed'),
+                             ('B', 'variation', 'failed'), ('C', 'variation', 'passed')])
+
+    def test_encoding(self):
+        self.assertEqual(len(self.columns), 5)
+        self.assertEqual(self.columns.values['db_type'], ['core', 'variation'])
+        self.assertEqual(self.columns.column('datacheck'), ['A', 'A', 'B', 'B', 'C'])
+        self.assertEqual(self.columns.mask('status', 'failed'), [True, False, True, True, False])
+        self.assertEqual(self.columns.mask('status', 'skipped'), [False] * 5)
+
+    def test_aggregate(self):
+        self.assertEqual(self.columns.aggregate('datacheck'), [('B', 2, 2), ('A', 1, 2), ('C', 0, 1)])
+        self.assertEqual(list(self.columns.summary(['db_type'])), [('db_type', 'core', 2, 3),
+                                                                   ('db_type', 'variation', 1, 2)])
+
+    def test_write_csv(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'report.csv')
+            write_table(path, SUMMARY_COLUMNS, self.columns.summary(['db_type']))
+            with open(path) as fh:
+                rows = list(csv.reader(fh))
+        self.assertEqual(rows, [list(SUMMARY_COLUMNS), ['db_type', 'core', '2', '3'],
+                                ['db_type', 'variation', '1', '2']])
+
+    def test_table_writer_batches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'genomes.csv')
+            with TableWriter(path, ['uuid', 'organism']) as writer:
+                writer.write_rows([['a', {'name': 'human'}]])
+                writer.write_rows([['b', None]])
+            with open(path) as fh:
+                rows = list(csv.reader(fh))
+        self.assertEqual(rows, [['uuid', 'organism'], ['a', '{"name":"human"}'], ['b', '']])
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_parquet_schema_widened(self):
+        import pyarrow.parquet
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'genomes.parquet')
+            with TableWriter(path, ['uuid', 'assembly', 'length']) as writer:
+                writer.write_rows([['a', None, 1]])
+                writer.write_rows([['b', {'name': 'GRCh38'}, 2], ['c', 'GRCm39', None]])
+            table = pyarrow.parquet.read_table(path)
+        self.assertEqual(str(table.schema.field('assembly').type), 'string')
+        self.assertEqual(table.column('assembly').to_pylist(), [None, '{"name":"GRCh38"}', 'GRCm39'])
+        self.assertEqual(table.column('length').to_pylist(), [1, 2, None])
+
+    def test_parse_dbname(self):
+        self.assertEqual(parse_dbname('homo_sapiens_core_110_38'), ('homo_sapiens', 'core'))
+        self.assertEqual(parse_dbname('mus_musculus_otherfeatures_110_39'), ('mus_musculus', 'otherfeatures'))
+        self.assertEqual(parse_dbname('ensembl_compara_110'), ('ensembl', 'compara'))
+        self.assertEqual(parse_dbname('scratch'), (None, None))
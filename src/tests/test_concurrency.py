@@ -0,0 +1,116 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import threading
+import time
+import unittest
+
+from scripts.utils.concurrency import RateLimiter, retry_call, run_bounded
+
+
+class TestRunBounded(unittest.TestCase):
+
+    def test_results_and_errors(self):
+        def square(value):
+            if value == 3:
+                raise RuntimeError('boom')
+            return value * value
+
+        outcomes = {outcome.item: outcome for outcome in run_bounded(square, range(6), concurrency=2)}
+        self.assertEqual(sorted(outcomes), list(range(6)))
+        self.assertEqual(outcomes[4].result, 16)
+        self.assertIsNone(outcomes[4].error)
+        self.assertIsInstance(outcomes[3].error, RuntimeError)
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def work(_):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+
+        list(run_bounded(work, range(20), concurrency=3))
+        self.assertLessEqual(max(peak), 3)
+
+    def test_items_are_pulled_lazily(self):
+        pulled = []
+
+        def items():
+            for value in range(100):
+                pulled.append(value)
+                yield value
+
+        results = run_bounded(lambda value: value, items(), concurrency=2)
+        next(results)
+        self.assertLess(len(pulled), 10)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_spacing(self):
+        now = [0.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+
+        limiter = RateLimiter(rate=4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(slept, [0.25, 0.5])
+
+    def test_unlimited(self):
+        limiter = RateLimiter(None, sleep=lambda seconds: self.fail('should not sleep'))
+        limiter.acquire()
+        limiter.acquire()
+
+
+class TestRetryCall(unittest.TestCase):
+
+    def test_retries_until_success(self):
+        calls = []
+        slept = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ConnectionError('reset')
+            return 'ok'
+
+        self.assertEqual(retry_call(flaky, attempts=3, initial=1, sleep=slept.append), 'ok')
+        self.assertEqual(len(slept), 2)
+        self.assertTrue(0 <= slept[0] <= 1 and 0 <= slept[1] <= 2)
+
+    def test_gives_up(self):
+        def failing():
+            raise ConnectionError('reset')
+
+        with self.assertRaises(ConnectionError):
+            retry_call(failing, attempts=2, sleep=lambda seconds: None)
+
+    def test_permanent_errors_are_not_retried(self):
+        calls = []
+
+        def invalid():
+            calls.append(1)
+            raise ValueError('bad request')
+
+        with self.assertRaises(ValueError):
+            retry_call(invalid, retry_on=lambda error: isinstance(error, ConnectionError), sleep=lambda seconds: None)
+        self.assertEqual(len(calls), 1)
@@ -0,0 +1,118 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from scripts.utils.daemon import ClientDaemon, default_socket_path, forward, private_directory, request
+
+
+def fake_command(module, argv):
+    print(module, *argv)
+    # Output of worker threads goes to the command's streams too
+    worker = threading.Thread(target=print, args=(os.getcwd(),), kwargs={'file': sys.stderr})
+    worker.start()
+    worker.join()
+    return len(argv)
+
+
+class TestClientDaemon(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.path = os.path.join(self.tmp, 'daemon.sock')
+
+    def start(self):
+        server = ClientDaemon(self.path, run=fake_command)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def stdio(self):
+        files = [open(os.path.join(self.tmp, name), mode) for name, mode in
+                 (('in', 'w+'), ('out', 'w+'), ('err', 'w+'))]
+        for f in files:
+            self.addCleanup(f.close)
+        return files
+
+    def test_no_daemon(self):
+        self.assertIsNone(forward('scripts.dbcopy_client', ['-a', 'list'], self.path))
+
+    def test_forward(self):
+        self.start()
+        stdin, stdout, stderr = self.stdio()
+        status = forward('scripts.dbcopy_client', ['-a', 'list'], self.path,
+                         fds=(stdin.fileno(), stdout.fileno(), stderr.fileno()))
+        self.assertEqual(status, 2)
+        stdout.seek(0)
+        stderr.seek(0)
+        self.assertEqual(stdout.read(), 'scripts.dbcopy_client -a list\n')
+        self.assertEqual(stderr.read().strip(), os.getcwd())
+        self.assertEqual(request({'command': 'status'}, self.path)['modules'], ['scripts.dbcopy_client'])
+
+    def test_long_running_commands_run_locally(self):
+        self.start()
+        stdin, stdout, stderr = self.stdio()
+        fds = (stdin.fileno(), stdout.fileno(), stderr.fileno())
+        self.assertIsNone(forward('scripts.dbcopy_client', ['--action=watch', '-j', '1'], self.path, fds=fds))
+        self.assertIsNone(forward('scripts.pipeline', ['-a', 'run'], self.path, fds=fds))
+        self.assertIsNone(forward('scripts.handover_client', ['-asubmit', '--outbox'], self.path, fds=fds))
+        self.assertEqual(forward('scripts.outbox', ['-a', 'status'], self.path, fds=fds), 2)
+
+    def test_single_instance(self):
+        self.start()
+        with self.assertRaises(RuntimeError):
+            ClientDaemon(self.path)
+
+
+class TestSocketPath(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        for name in ('XDG_RUNTIME_DIR', 'PRODINF_DAEMON_SOCKET'):
+            if name in os.environ:
+                self.addCleanup(os.environ.__setitem__, name, os.environ.pop(name))
+        self.addCleanup(setattr, tempfile, 'tempdir', tempfile.tempdir)
+        tempfile.tempdir = self.tmp
+
+    def test_private_directory(self):
+        path = default_socket_path()
+        directory = os.path.dirname(path)
+        self.assertEqual(os.path.dirname(directory), self.tmp)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        os.environ['XDG_RUNTIME_DIR'] = self.tmp
+        self.addCleanup(os.environ.pop, 'XDG_RUNTIME_DIR')
+        self.assertEqual(os.path.dirname(default_socket_path()), self.tmp)
+
+    def test_shared_directory_refused(self):
+        directory = os.path.join(self.tmp, f'prodinf-{os.getuid()}')
+        os.mkdir(directory)
+        os.chmod(directory, 0o777)
+        with self.assertRaises(PermissionError):
+            private_directory()
+        self.assertIsNone(forward('scripts.dbcopy_client', ['-a', 'list']))
+
+    def test_not_a_socket(self):
+        path = os.path.join(self.tmp, 'daemon.sock')
+        with open(path, 'w'):
+            pass
+        self.assertIsNone(request({'command': 'status'}, path))
@@ -0,0 +1,68 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import unittest
+
+from scripts.utils.datachecks import compare_results, database_type, expand_matrix, submission_label
+from scripts.utils.mysql import match_databases
+
+
+class TestMatrix(unittest.TestCase):
+
+    def test_database_type(self):
+        self.assertEqual(database_type('homo_sapiens_core_110_38', ['variation', 'core']), 'core')
+        self.assertEqual(database_type('ensembl_compara_110', ['compara']), 'compara')
+        self.assertIsNone(database_type('homo_sapiens_funcgen_110_38', ['core']))
+
+    def test_databases(self):
+        submissions = list(expand_matrix(['a_core_1_1', 'a_variation_1_1', 'a_core_1_1'],
+                                         db_types=['core'], groups=['G1', 'G2', 'G1']))
+        self.assertEqual(submissions, [
+            {'dbname': 'a_core_1_1', 'species': None, 'db_type': 'core', 'datacheck_groups': 'G1'},
+            {'dbname': 'a_core_1_1', 'species': None, 'db_type': 'core', 'datacheck_groups': 'G2'},
+        ])
+
+    def test_species(self):
+        submissions = list(expand_matrix(species=['a', 'b'], db_types=['core', 'variation']))
+        self.assertEqual(len(submissions), 4)
+        self.assertEqual(submission_label(submissions[1]), 'a/variation')
+
+    def test_empty(self):
+        self.assertEqual(list(expand_matrix()),
+                         [{'dbname': None, 'species': None, 'db_type': None, 'datacheck_groups': None}])
+        self.assertEqual(submission_label(list(expand_matrix())[0]), 'all')
+
+    def test_match_databases(self):
+        names = ['a_core_110_1', 'a_variation_110_1', 'b_core_109_1']
+        self.assertEqual(match_databases(names, '*_core_110_*,*_variation_*'), ['a_core_110_1', 'a_variation_110_1'])
+
+
+class TestCompare(unittest.TestCase):
+
+    def test_compare_results(self):
+        base = [('db1', 'A', 'failed'), ('db1', 'B', 'passed'), ('db1', 'C', 'failed'), ('db2', 'A', 'failed'),
+                ('db3', 'A', 'failed')]
+        head = iter([('db1', 'A', 'passed'), ('db1', 'B', 'failed'), ('db1', 'C', 'failed'), ('db2', 'A', 'passed'),
+                     ('db2', 'A', 'failed'), ('db4', 'A', 'failed'), ('db4', 'B', 'passed')])
+        self.assertEqual(compare_results(base, head), {
+            'new_failures': [('db1', 'B'), ('db4', 'A')],
+            'fixed': [('db1', 'A')],
+            'still_failing': [('db1', 'C'), ('db2', 'A')],
+            'unmatched': 1,
+        })
+
+    def test_compare_failure_summaries(self):
+        base = [('db1', None, 'failed'), ('db1', 'A', 'failed'), ('db2', None, 'failed'), ('db2', 'A', 'failed')]
+        head = [('db1', None, 'passed')]
+        self.assertEqual(compare_results(base, head),
+                         {'new_failures': [], 'fixed': [('db1', 'A')], 'still_failing': [], 'unmatched': 1})
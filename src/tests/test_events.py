@@ -0,0 +1,122 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+
+import importlib.util
+import unittest
+
+from scripts.utils.events import EventSubscription, decode_event, follow, watch_events
+from tests.fakes import FakeClock
+
+TERMINAL = ('Complete', 'Failed')
+
+
+class FakeSubscription:
+    """Batches of events, one batch per drain, on a fake clock."""
+
+    def __init__(self, clock, batches):
+        self.clock = clock
+        self.batches = list(batches)
+        self.waits = []
+
+    def drain(self, timeout):
+        self.waits.append(timeout)
+        if self.batches:
+            return self.batches.pop(0)
+        self.clock.now += timeout
+        return []
+
+
+class TestWatchEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.jobs = {'1': {'job_id': '1', 'status': 'Running'}, '2': {'job_id': '2', 'status': 'Complete'}}
+        self.fetched = []
+        self.changes = []
+
+    def fetch(self, key):
+        self.fetched.append(key)
+        return dict(self.jobs[key])
+
+    def watch(self, subscription, **kwargs):
+        return watch_events(self.jobs, self.fetch, lambda job: job['status'], lambda status: status in TERMINAL,
+                            lambda key, old, new, job: self.changes.append((key, old, new)),
+                            lambda job: job.get('job_id'), subscription, clock=self.clock, **kwargs)
+
+    def test_events(self):
+        subscription = FakeSubscription(self.clock, [
+            [{'job_id': '1', 'status': 'Running'}, {'job_id': '3', 'status': 'Failed'}],
+            [{'job_id': '2', 'status': 'Failed'}, {'job_id': '1', 'status': 'Complete'}],
+        ])
+        states = self.watch(subscription)
+        self.assertEqual(states, {'1': 'Complete', '2': 'Complete'})
+        self.assertEqual(self.changes, [('1', None, 'Running'), ('2', None, 'Complete'), ('1', 'Running', 'Complete')])
+        # Jobs are fetched once only, on subscription
+        self.assertEqual(sorted(self.fetched), ['1', '2'])
+
+    def test_resync(self):
+        subscription = FakeSubscription(self.clock, [])
+        fetch = self.fetch
+
+        def fetch_completed(key):
+            # The event of job 1 completing was lost
+            if len(self.fetched) == 2:
+                self.jobs['1']['status'] = 'Complete'
+            return fetch(key)
+
+        self.fetch = fetch_completed
+        states = self.watch(subscription, resync=60)
+        self.assertEqual(states, {'1': 'Complete', '2': 'Complete'})
+        self.assertEqual(sorted(self.fetched), ['1', '1', '2'])
+        self.assertEqual(subscription.waits, [60])
+
+    def test_timeout(self):
+        subscription = FakeSubscription(self.clock, [])
+        states = self.watch(subscription, resync=60, timeout=90)
+        self.assertEqual(states, {'1': 'Running', '2': 'Complete'})
+        self.assertEqual(subscription.waits, [60, 30])
+
+    def test_decode_event(self):
+        self.assertEqual(decode_event(b'{"job_id": 1}'), {'job_id': 1})
+        self.assertEqual(decode_event({'job_id': 1}), {'job_id': 1})
+        self.assertIsNone(decode_event('not json'))
+        self.assertIsNone(decode_event('[1]'))
+
+    def test_follow_without_broker_polls(self):
+        self.jobs['1']['status'] = 'Complete'
+        states = follow(self.jobs, self.fetch, lambda job: job['status'], lambda status: status in TERMINAL,
+                        lambda *args: None, lambda job: job.get('job_id'))
+        self.assertEqual(states, {'1': 'Complete', '2': 'Complete'})
+
+
+@unittest.skipUnless(importlib.util.find_spec('kombu'), 'kombu is not installed')
+class TestEventSubscription(unittest.TestCase):
+
+    def test_memory_transport(self):
+        from kombu import Connection, Exchange
+
+        exchange = Exchange('dbcopy', type='topic')
+        with EventSubscription('memory://', 'dbcopy', 'job.#') as subscription:
+            with Connection('memory://') as connection:
+                producer = connection.Producer(serializer='json')
+                producer.publish({'job_id': '1', 'status': 'Running'}, exchange=exchange, routing_key='job.1')
+                producer.publish({'job_id': '2', 'status': 'Complete'}, exchange=exchange, routing_key='other')
+                producer.publish({'job_id': '1', 'status': 'Complete'}, exchange=exchange, routing_key='job.1')
+            events = []
+            while len(events) < 2:
+                batch = subscription.drain(5)
+                self.assertTrue(batch)
+                events.extend(batch)
+            self.assertEqual(events, [{'job_id': '1', 'status': 'Running'}, {'job_id': '1', 'status': 'Complete'}])
+            self.assertEqual(subscription.drain(0.1), [])
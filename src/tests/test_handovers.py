@@ -0,0 +1,154 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import argparse
+import importlib.util
+import os
+import tempfile
+import unittest
+
+from scripts.handover_client import send_summary
+from scripts.utils.handovers import (HandoverSummaryStore, changed_since, database_name, format_summary,
+                                     in_flight_index, is_failed_status, is_in_flight, is_terminal_status,
+                                     latest_report)
+
+
+class TestHandovers(unittest.TestCase):
+
+    def test_database_name(self):
+        self.assertEqual(database_name('mysql://user@host:3306/homo_sapiens_core_110_38'), 'homo_sapiens_core_110_38')
+
+    def test_is_in_flight(self):
+        self.assertTrue(is_in_flight({'current_message': 'Copying database'}))
+        self.assertFalse(is_in_flight({'current_message': 'Handover failed, datachecks found problems'}))
+        self.assertFalse(is_in_flight({'message': 'Handover successful'}))
+
+    def test_statuses(self):
+        self.assertTrue(is_terminal_status('Handover successful'))
+        self.assertFalse(is_terminal_status(None))
+        self.assertTrue(is_failed_status('Datachecks found problems'))
+        self.assertFalse(is_failed_status('Handover successful'))
+
+    def test_latest_report(self):
+        reports = [{'report_time': '2024-01-02', 'id': 2}, {'report_time': '2024-01-03', 'id': 3},
+                   {'report_time': '2024-01-01', 'id': 1}]
+        self.assertEqual(latest_report(reports)['id'], 3)
+        self.assertIsNone(latest_report([]))
+
+    def test_in_flight_index(self):
+        handovers = [{'src_uri': 'mysql://host:3306/a', 'current_message': 'Datachecks running'},
+                     {'database': 'b', 'current_message': 'Handover successful'},
+                     {'current_message': 'Pending'}]
+        self.assertEqual(list(in_flight_index(handovers)), ['a'])
+
+
+    def test_changed_since(self):
+        listing = iter([{'handover_token': 't3', 'report_time': '2024-01-03'},
+                        {'handover_token': 't2', 'report_time': '2024-01-02'},
+                        {'handover_token': 't1', 'report_time': '2024-01-01'},
+                        {'handover_token': 't0', 'report_time': '2023-12-31'}])
+        self.assertEqual([h['handover_token'] for h in changed_since(listing, '2024-01-02')], ['t3', 't2'])
+        # The rest of the listing is not read
+        self.assertEqual(next(listing)['handover_token'], 't0')
+        self.assertEqual(len(list(changed_since([{'report_time': '2024-01-01'}], None))), 1)
+
+
+class TestHandoverSummaryStore(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'summary.sqlite')
+
+    def test_incremental_counts(self):
+        listing = [{'handover_token': 't1', 'current_message': 'Copying', 'contact': 'a@ebi',
+                    'report_time': '2024-01-01'},
+                   {'handover_token': 't2', 'current_message': 'Handover successful', 'contact': 'b@ebi',
+                    'report_time': '2024-01-02'}]
+        with HandoverSummaryStore(self.path) as store:
+            self.assertEqual(store.update(listing), 2)
+            self.assertEqual(store.update(listing), 0)
+            self.assertEqual(store.watermark, '2024-01-02')
+        listing[0] = dict(listing[0], current_message='Handover successful', report_time='2024-01-03')
+        with HandoverSummaryStore(self.path) as store:
+            self.assertEqual(store.update(listing[:1]), 1)
+            aggregates = store.aggregates()
+            self.assertEqual(store.watermark, '2024-01-03')
+        self.assertEqual(aggregates, {'status': {'success': 2}, 'division': {'unknown': 2},
+                                      'contact': {'a@ebi': 1, 'b@ebi': 1}})
+        self.assertIn('  success: 2', format_summary(aggregates))
+
+    def test_latest_handover_per_database(self):
+        listing = [{'handover_token': 't1', 'current_message': 'Handover failed', 'contact': 'a@ebi',
+                    'src_uri': 'mysql://host:3306/db1', 'report_time': '2024-01-01'},
+                   {'handover_token': 't2', 'current_message': 'Handover successful', 'contact': 'a@ebi',
+                    'src_uri': 'mysql://host:3306/db1', 'report_time': '2024-01-02'},
+                   {'handover_token': 't3', 'current_message': 'Copying', 'contact': 'b@ebi',
+                    'src_uri': 'mysql://host:3306/db2', 'report_time': '2024-01-01'}]
+        with HandoverSummaryStore(self.path) as store:
+            store.update(listing)
+            self.assertEqual(store.latest('a@ebi'), [('t2', 'db1', 'success')])
+            self.assertEqual(store.aggregates('a@ebi')['status'], {'success': 1})
+            self.assertEqual(store.aggregates()['status'], {'in progress': 1, 'success': 1})
+            store.update([dict(listing[0], report_time='2024-01-03')])
+            self.assertEqual(store.latest('a@ebi'), [('t1', 'db1', 'failed')])
+            self.assertEqual(store.aggregates('a@ebi')['status'], {'failed': 1})
+            summary = format_summary(store.aggregates('a@ebi'), store.latest('a@ebi'))
+        self.assertIn('Handover t1 - db1 : failed', summary)
+
+
+class TestSendSummary(unittest.TestCase):
+
+    def test_smtp_failure_is_reported(self):
+        args = argparse.Namespace(email='a@ebi', smtp_server='127.0.0.1:1')
+        with self.assertLogs(level='ERROR') as logs, self.assertRaises(SystemExit) as raised:
+            send_summary(args, 'Handovers per status (0):')
+        self.assertEqual(raised.exception.code, 1)
+        self.assertIn('Could not send handover summary to a@ebi', logs.output[0])
+
+
+class RecordingSession:
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, params=None, **kwargs):
+        self.urls.append(url)
+        return self
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return []
+
+
+@unittest.skipUnless(importlib.util.find_spec('ensembl') and importlib.util.find_spec('requests'),
+                     'ensembl-prod-core and requests are not installed')
+class TestHandoverTransport(unittest.TestCase):
+
+    def test_only_the_wrapped_client_uses_the_session(self):
+        import requests
+        from ensembl.production.core.clients import handover
+        from scripts.utils.http import use_transport
+        session, other = RecordingSession(), RecordingSession()
+        client = use_transport(handover.HandoverClient('http://localhost:1/'), session)
+        self.assertIsInstance(client, handover.HandoverClient)
+        self.assertIs(handover.requests, requests)
+        self.assertEqual(client.list_handovers(), [])
+        self.assertEqual(session.urls, ['http://localhost:1/jobs'])
+        use_transport(client, other)
+        client.list_handovers()
+        self.assertEqual(other.urls, ['http://localhost:1/jobs'])
+        with self.assertRaises(requests.ConnectionError):
+            handover.HandoverClient('http://localhost:1/').list_handovers()
@@ -0,0 +1,71 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import json
+import os
+import tempfile
+import unittest
+
+from scripts.utils.manifest import Journal, read_lines, read_manifest, row_key, split_list
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def test_tsv(self):
+        path = self.write('copy.tsv', 'src_host\tsrc_incl_db\ttgt_host\n'
+                                      '# comment\n'
+                                      'a:3306\tdb_1\tb:3306\n'
+                                      'a:3306\t\tc:3306\n')
+        rows = list(read_manifest(path))
+        self.assertEqual(rows, [{'src_host': 'a:3306', 'src_incl_db': 'db_1', 'tgt_host': 'b:3306'},
+                                {'src_host': 'a:3306', 'tgt_host': 'c:3306'}])
+
+    def test_jsonl(self):
+        path = self.write('copy.jsonl', '{"src_host": "a:3306", "tgt_host": "b:3306"}\n\n')
+        self.assertEqual(list(read_manifest(path)), [{'src_host': 'a:3306', 'tgt_host': 'b:3306'}])
+
+    def test_yaml(self):
+        path = self.write('copy.yaml', '- src_host: a:3306\n  tgt_host: [b:3306, c:3306]\n')
+        self.assertEqual(list(read_manifest(path)), [{'src_host': 'a:3306', 'tgt_host': ['b:3306', 'c:3306']}])
+
+    def test_row_key(self):
+        self.assertEqual(row_key({'a': 1, 'b': 2}), row_key({'b': 2, 'a': 1}))
+        self.assertEqual(row_key({'a': 1, 'b': 2}, ['a']), row_key({'a': 1, 'b': 3}, ['a']))
+        self.assertNotEqual(row_key({'a': 1}), row_key({'a': 2}))
+
+    def test_journal_resume(self):
+        path = os.path.join(self.tmp.name, 'results.jsonl')
+        with Journal(path) as journal:
+            journal.write({'key': 'k1', 'job_id': 'job-1'})
+            journal.write({'key': 'k2', 'job_id': None, 'error': 'failed'})
+        with Journal(path) as journal:
+            self.assertTrue(journal.is_done('k1'))
+            self.assertFalse(journal.is_done('k2'))
+        with open(path) as fh:
+            self.assertEqual(len([json.loads(line) for line in fh]), 2)
+
+    def test_lists(self):
+        self.assertEqual(split_list(' a, b,,a ,c'), ['a', 'b', 'c'])
+        self.assertEqual(split_list(None), [])
+        path = self.write('dbs.txt', 'db_1\n\n# skipped\n db_2 \n')
+        self.assertEqual(read_lines(path), ['db_1', 'db_2'])
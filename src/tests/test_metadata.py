@@ -0,0 +1,99 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import importlib.util
+import os
+import tempfile
+import unittest
+
+from scripts.utils.metadata import (dataset_key, dataset_payload, group_attribute_updates, missing_fields,
+                                    update_payload)
+
+
+class TestDatasetPayload(unittest.TestCase):
+
+    def test_flat_row_with_defaults(self):
+        row = {'guuid': 'g1', 'name': 'assembly', 'type': 'assembly', 'attribute.length': '42'}
+        defaults = {'user': 'me', 'description': 'd', 'label': 'l', 'source_name': 's', 'source_type': 'core',
+                    'name': 'ignored'}
+        self.assertEqual(dataset_payload(row, defaults), {
+            'user': 'me', 'name': 'assembly', 'description': 'd', 'label': 'l', 'dataset_type': 'assembly',
+            'dataset_source': {'name': 's', 'type': 'core'}, 'genome_uuid': 'g1',
+            'dataset_attribute': [{'name': 'length', 'value': '42'}],
+        })
+
+    def test_api_row(self):
+        row = {'user': 'me', 'name': 'n', 'description': 'd', 'label': 'l', 'dataset_type': 't',
+               'dataset_source': {'name': 's', 'type': 'core'}, 'genome_uuid': 'g1',
+               'dataset_attribute': [{'name': 'a', 'value': 1}]}
+        payload = dataset_payload(row)
+        self.assertEqual(payload, row)
+        self.assertEqual(missing_fields(payload), [])
+
+    def test_missing_fields(self):
+        self.assertEqual(missing_fields(dataset_payload({'name': 'n', 'source_name': 's'})),
+                         ['user', 'description', 'label', 'dataset_type', 'dataset_source.type', 'genome_uuid'])
+
+    def test_dataset_key(self):
+        first = dataset_payload({'genome_uuid': 'g', 'name': 'n', 'type': 't', 'label': 'a'})
+        second = dataset_payload({'genome_uuid': 'g', 'name': 'n', 'type': 't', 'label': 'b'})
+        self.assertEqual(dataset_key(first), dataset_key(second))
+
+
+class TestAttributeUpdates(unittest.TestCase):
+
+    def test_grouping(self):
+        rows = [{'dataset_uuid': 'd1', 'name': 'a', 'value': '1'},
+                {'dataset_uuid': 'd2', 'name': 'a', 'value': '2'},
+                {'duuid': 'd1', 'attribute': 'b', 'value': '3'},
+                {'dataset_uuid': 'd1', 'name': 'a', 'value': '4'},
+                {'dataset_uuid': 'd3', 'name': 'a'},
+                {'name': 'a', 'value': '5'}]
+        updates, invalid = group_attribute_updates(rows)
+        self.assertEqual(updates, {'d1': {'a': '4', 'b': '3'}, 'd2': {'a': '2'}})
+        self.assertEqual(invalid, [5, 6])
+
+    def test_update_payload(self):
+        self.assertEqual(update_payload('me', 'd1', {'a': '4', 'b': '3'}), {
+            'user': 'me', 'dataset_uuid': 'd1',
+            'dataset_attribute': [{'name': 'a', 'value': '4'}, {'name': 'b', 'value': '3'}],
+        })
+
+
+@unittest.skipUnless(importlib.util.find_spec('ensembl') and importlib.util.find_spec('requests'),
+                     'ensembl-prodinf-core is not installed')
+class TestMetadataClientStub(unittest.TestCase):
+
+    def test_bulk_update(self):
+        from scripts.genomemetadata_client import main
+        from tests.stub_services import StubService
+
+        with tempfile.TemporaryDirectory() as tmp, StubService('metadata', records=2) as service:
+            uuids = sorted(service.jobs)
+            updates = os.path.join(tmp, 'updates.tsv')
+            with open(updates, 'w') as f:
+                f.write('dataset_uuid\tname\tvalue\n')
+                f.write(f'{uuids[0]}\tlength\t42\n{uuids[0]}\tlevel\tchromosome\n{uuids[1]}\tlength\t7\n')
+            main(['-u', service.uri, '-a', 'bulk-update', '-t', 'datasets', '--user', 'me', '--input_file', updates,
+                  '--results_file', os.path.join(tmp, 'results.jsonl')])
+            self.assertEqual(service.jobs[uuids[0]]['dataset_attribute'],
+                             [{'name': 'length', 'value': '42'}, {'name': 'level', 'value': 'chromosome'}])
+            self.assertEqual(service.jobs[uuids[1]]['dataset_attribute'], [{'name': 'length', 'value': '7'}])
+
+    def test_missing_arguments_exit_with_error(self):
+        from scripts.genomemetadata_client import main
+
+        with self.assertLogs(level='ERROR') as logs, self.assertRaises(SystemExit) as raised:
+            main(['-u', 'http://localhost:1/', '-a', 'update', '-t', 'datasets', '-i', 'uuid'])
+        self.assertEqual(raised.exception.code, 1)
+        self.assertIn('Argument missing', logs.output[0])
@@ -0,0 +1,194 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+
+import os
+import tempfile
+import threading
+import unittest
+
+from scripts.utils.outbox import FAILED, PENDING, SENDING, SENT, Flusher, Outbox, flush
+
+
+class ServiceDown(Exception):
+    pass
+
+
+class FakeService:
+    """Submission endpoint failing ``down`` times before accepting submissions."""
+
+    def __init__(self, down=0, invalid=()):
+        self.down = down
+        self.invalid = set(invalid)
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def send(self, entry):
+        with self.lock:
+            if entry.payload.get('dbname') in self.invalid:
+                raise ValueError('invalid database')
+            if self.down:
+                self.down -= 1
+                raise ServiceDown('service unavailable')
+            self.jobs.append(entry.payload)
+            return len(self.jobs)
+
+
+def is_transient(error):
+    return isinstance(error, ServiceDown)
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'sub', 'outbox.sqlite')
+
+    def outbox(self, clock=None):
+        outbox = Outbox(self.path, clock=clock or (lambda: self.now))
+        self.addCleanup(outbox.close)
+        return outbox
+
+    def test_idempotent_add(self):
+        outbox = self.outbox()
+        first = outbox.add('dbcopy', 'http://dbcopy/', {'dbname': 'a'})
+        self.assertEqual(outbox.add('dbcopy', 'http://dbcopy/', {'dbname': 'a'}), first)
+        self.assertNotEqual(outbox.add('dbcopy', 'http://other/', {'dbname': 'a'}), first)
+        self.assertEqual(outbox.add_many([('handover', 'http://handover/', {'src_uri': 'b'}, 'key-b'),
+                                          ('handover', 'http://handover/', {'src_uri': 'c'}, 'key-b')]),
+                         ['key-b', 'key-b'])
+        self.assertEqual(outbox.counts(), {PENDING: 3})
+        self.assertEqual([entry.payload for entry in outbox.due(10)],
+                         [{'dbname': 'a'}, {'dbname': 'a'}, {'src_uri': 'b'}])
+        # Content keys only hold for one command, given keys across commands
+        again = self.outbox()
+        self.assertNotEqual(again.add('dbcopy', 'http://dbcopy/', {'dbname': 'a'}), first)
+        self.assertEqual(again.add('handover', 'http://handover/', {'src_uri': 'b'}, 'key-b'), 'key-b')
+        self.assertEqual(again.counts(), {SENDING: 3, PENDING: 1})
+
+    def test_record(self):
+        outbox = self.outbox()
+        keys = [outbox.add('datacheck', 'http://dc/', {'dbname': name}) for name in 'abc']
+        outbox.record([(keys[0], SENT, '1', None, None), (keys[1], PENDING, None, 'down', self.now + 10),
+                       (keys[2], FAILED, None, 'invalid', None)])
+        self.assertEqual(outbox.due(10), [])
+        self.assertEqual(outbox.next_due(), self.now + 10)
+        self.assertEqual(outbox.results(keys + ['unknown']), {keys[0]: (SENT, '1', None),
+                                                              keys[1]: (PENDING, None, 'down'),
+                                                              keys[2]: (FAILED, None, 'invalid')})
+        self.now += 10
+        self.assertEqual([(entry.key, entry.attempts) for entry in outbox.due(10)], [(keys[1], 1)])
+        self.assertEqual(outbox.retry_failed(), 1)
+        self.assertEqual(outbox.counts(), {SENT: 1, SENDING: 1, PENDING: 1})
+        self.assertEqual([row[2] for row in outbox.entries()], [SENT, SENDING, PENDING])
+
+    def test_claims(self):
+        outbox = self.outbox()
+        other = self.outbox()
+        keys = outbox.add_many([('dbcopy', 'http://dbcopy/', {'dbname': name}, None) for name in 'abc'])
+        self.assertEqual([entry.key for entry in outbox.due(2)], keys[:2])
+        self.assertEqual([entry.key for entry in other.due(10)], keys[2:])
+        self.assertEqual(other.due(10), [])
+        outbox.record([(keys[0], PENDING, None, 'down', self.now)])
+        self.assertEqual([entry.key for entry in other.due(10)], keys[:1])
+        # Claims of a command which went away are taken over once their lease expired
+        self.now += outbox.lease
+        self.assertEqual([entry.key for entry in outbox.due(10)], keys)
+
+    def test_durable(self):
+        self.outbox().add('dbcopy', 'http://dbcopy/', {'dbname': 'a'})
+        self.assertEqual([entry.payload for entry in self.outbox().due(10)], [{'dbname': 'a'}])
+
+
+class TestFlusher(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.outbox = Outbox(os.path.join(tmp.name, 'outbox.sqlite'))
+        self.addCleanup(self.outbox.close)
+
+    def queue(self, names):
+        return self.outbox.add_many([('dbcopy', 'http://dbcopy/', {'dbname': name}, None) for name in names])
+
+    def test_retry_transient_errors(self):
+        keys = self.queue('abcd')
+        service = FakeService(down=3, invalid=['c'])
+        flusher = flush(self.outbox, service.send, batch_size=4, initial=0.01, is_transient=is_transient)
+        self.assertEqual((flusher.sent, flusher.retried, flusher.failed), (3, 3, 1))
+        self.assertEqual(sorted(job['dbname'] for job in service.jobs), ['a', 'b', 'd'])
+        self.assertEqual(self.outbox.counts(), {SENT: 3, FAILED: 1})
+        self.assertEqual(sorted(status for status, _, _ in self.outbox.results(keys).values()),
+                         [FAILED, SENT, SENT, SENT])
+
+    def test_max_attempts(self):
+        self.queue('a')
+        flusher = flush(self.outbox, FakeService(down=10).send, max_attempts=3, initial=0.001,
+                        is_transient=is_transient)
+        self.assertEqual((flusher.sent, flusher.retried, flusher.failed), (0, 2, 1))
+        (row,) = self.outbox.entries()
+        self.assertEqual(row[2:4], (FAILED, 3))
+        self.assertIn('service unavailable', row[5])
+
+    def test_timeout_keeps_pending(self):
+        self.queue('ab')
+        flusher = flush(self.outbox, FakeService(down=100).send, initial=60, is_transient=is_transient, timeout=0.05)
+        self.assertEqual(flusher.sent, 0)
+        self.assertEqual(self.outbox.counts(), {PENDING: 2})
+
+    def test_background(self):
+        service = FakeService()
+        flusher = Flusher(self.outbox, service.send, batch_size=5)
+        flusher.start()
+        for start in range(0, 20, 5):
+            self.queue([str(n) for n in range(start, start + 5)])
+            flusher.wake()
+        flusher.close()
+        flusher.join(5)
+        self.assertFalse(flusher.is_alive())
+        self.assertEqual(flusher.sent, 20)
+        self.assertEqual(self.outbox.counts(), {SENT: 20})
+        # Queueing the same submissions again in the same command does not send them again
+        self.queue(['0', '1'])
+        self.assertEqual(flush(self.outbox, service.send).sent, 0)
+        self.assertEqual(len(service.jobs), 20)
+
+    def test_concurrent_flushers_send_once(self):
+        self.queue([str(n) for n in range(200)])
+        service = FakeService()
+        outboxes = [Outbox(self.outbox.path) for _ in range(2)]
+        for outbox in outboxes:
+            self.addCleanup(outbox.close)
+        flushers = [Flusher(outbox, service.send, batch_size=5, concurrency=2) for outbox in outboxes]
+        for flusher in flushers:
+            flusher.close()
+            flusher.start()
+        for flusher in flushers:
+            flusher.join(30)
+        self.assertEqual(sum(flusher.sent for flusher in flushers), 200)
+        self.assertEqual(sorted(int(job['dbname']) for job in service.jobs), list(range(200)))
+        self.assertEqual(self.outbox.counts(), {SENT: 200})
+
+    def test_batches_shrink_under_errors(self):
+        self.queue([str(n) for n in range(8)])
+        sizes = []
+        flusher = Flusher(self.outbox, FakeService(down=1).send, batch_size=8, concurrency=1, initial=0.001, is_transient=is_transient)
+        flusher.delay = lambda attempts: 0
+        due = self.outbox.due
+        self.outbox.due = lambda limit: sizes.append(limit) or due(limit)
+        flusher.close()
+        flusher.run()
+        self.assertEqual(flusher.sent, 8)
+        self.assertEqual(sizes[:3], [8, 4, 8])
@@ -0,0 +1,150 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+
+import os
+import tempfile
+import threading
+import unittest
+
+from scripts.utils.pipeline import DONE, FAILED, RUNNING, Checkpoint, Stage, run_pipeline
+
+
+class FakeStage:
+    """Jobs finishing after ``polls`` polls, failing for the items in ``failing``."""
+
+    def __init__(self, name, log, clock, polls=2, failing=(), concurrency=2):
+        self.name = name
+        self.log = log
+        self.clock = clock
+        self.polls = polls
+        self.failing = set(failing)
+        self.concurrency = concurrency
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, item):
+        with self.lock:
+            job_id = f'{self.name}-{item}'
+            self.jobs[job_id] = 0
+            self.log.append((self.clock(), 'submit', self.name, item))
+            return job_id
+
+    def poll(self, item, job_id):
+        with self.lock:
+            self.jobs[job_id] += 1
+            if self.jobs[job_id] < self.polls:
+                return RUNNING
+            self.log.append((self.clock(), 'end', self.name, item))
+            return FAILED if item in self.failing else DONE
+
+    def in_flight(self, time):
+        """Number of jobs of this stage running at ``time``."""
+        submitted = {item: at for at, event, name, item in self.log if event == 'submit' and name == self.name}
+        ended = {item: at for at, event, name, item in self.log if event == 'end' and name == self.name}
+        return sum(1 for item, at in submitted.items() if at <= time and ended.get(item, float('inf')) > time)
+
+    def stage(self, group=None):
+        return Stage(self.name, self.submit, self.poll, self.concurrency, group)
+
+
+class TestRunPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.log = []
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'pipeline.sqlite')
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def stages(self, **kwargs):
+        return [FakeStage(name, self.log, self.clock, **kwargs.get(name, {})) for name in ('copy', 'check')]
+
+    def run_pipeline(self, items, stages, **kwargs):
+        with Checkpoint(self.path) as checkpoint:
+            return run_pipeline(items, [stage.stage() for stage in stages], checkpoint, initial=1, maximum=1,
+                                clock=self.clock, sleep=self.sleep, **kwargs)
+
+    def test_items_move_on_independently(self):
+        copy, check = self.stages(copy={'failing': ['b']})
+        results = self.run_pipeline(['a', 'b', 'c'], [copy, check])
+        self.assertEqual(results, {'a': ('check', DONE), 'b': ('copy', FAILED), 'c': ('check', DONE)})
+        self.assertNotIn('check-b', check.jobs)
+        # The check of the first copied item starts while the third item is still being copied
+        first_check = min(at for at, event, name, _ in self.log if event == 'submit' and name == 'check')
+        last_copy = max(at for at, event, name, _ in self.log if event == 'end' and name == 'copy')
+        self.assertLess(first_check, last_copy)
+
+    def test_concurrency_per_stage(self):
+        copy, check = self.stages(copy={'concurrency': 2, 'polls': 3}, check={'concurrency': 1})
+        results = self.run_pipeline([str(n) for n in range(6)], [copy, check])
+        self.assertTrue(all(status == DONE for _, status in results.values()))
+        times = {at for at, *_ in self.log}
+        self.assertLessEqual(max(copy.in_flight(time) for time in times), 2)
+        self.assertLessEqual(max(check.in_flight(time) for time in times), 1)
+
+    def test_concurrency_per_group(self):
+        (copy,) = [FakeStage('copy', self.log, self.clock, polls=2, concurrency=1)]
+        targets = {'a': 't1', 'b': 't1', 'c': 't2', 'd': 't1'}
+        with Checkpoint(self.path) as checkpoint:
+            results = run_pipeline(list(targets), [copy.stage(targets.get)], checkpoint, initial=1, maximum=1,
+                                   clock=self.clock, sleep=self.sleep)
+        self.assertEqual(set(results.values()), {('copy', DONE)})
+        submitted = {item: at for at, event, _, item in self.log if event == 'submit'}
+        ended = {item: at for at, event, _, item in self.log if event == 'end'}
+        # One copy at a time on t1, while the copy to t2 runs alongside
+        self.assertEqual(submitted['c'], submitted['a'])
+        self.assertGreaterEqual(submitted['b'], ended['a'])
+        self.assertGreaterEqual(submitted['d'], ended['b'])
+
+    def test_resume_from_checkpoint(self):
+        copy, check = self.stages(copy={'polls': 5})
+        results = self.run_pipeline(['a', 'b'], [copy, check], timeout=2)
+        self.assertEqual(results, {'a': ('copy', RUNNING), 'b': ('copy', RUNNING)})
+        # Submitted jobs are polled again rather than submitted again
+        results = self.run_pipeline(['a', 'b'], [copy, check])
+        self.assertEqual(results, {'a': ('check', DONE), 'b': ('check', DONE)})
+        self.assertEqual(sum(1 for _, event, name, _ in self.log if event == 'submit' and name == 'copy'), 2)
+        # Items done are not run again
+        self.log.clear()
+        self.assertEqual(self.run_pipeline(['a', 'b'], [copy, check]), results)
+        self.assertEqual(self.log, [])
+
+    def test_retry_failed(self):
+        copy, check = self.stages(check={'failing': ['a']})
+        self.assertEqual(self.run_pipeline(['a'], [copy, check]), {'a': ('check', FAILED)})
+        self.assertEqual(self.run_pipeline(['a'], [copy, check]), {'a': ('check', FAILED)})
+        check.failing.clear()
+        self.log.clear()
+        self.assertEqual(self.run_pipeline(['a'], [copy, check], retry_failed=True), {'a': ('check', DONE)})
+        self.assertEqual([(event, name) for _, event, name, _ in self.log], [('submit', 'check'), ('end', 'check')])
+
+    def test_submission_error(self):
+        copy, check = self.stages()
+
+        def broken(item):
+            raise RuntimeError('service unavailable')
+
+        stages = [copy.stage()._replace(submit=broken), check.stage()]
+        with Checkpoint(self.path) as checkpoint:
+            results = run_pipeline(['a'], stages, checkpoint, clock=self.clock, sleep=self.sleep)
+            self.assertEqual(results, {'a': ('copy', FAILED)})
+            (row,) = checkpoint.rows()
+        self.assertEqual(row[:3], ('a', 'copy', FAILED))
+        self.assertIn('service unavailable', row[4])
@@ -0,0 +1,75 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import unittest
+
+from scripts.utils.polling import Backoff, watch
+from tests.fakes import FakeClock
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_growth_and_reset(self):
+        backoff = Backoff(initial=1, maximum=5, factor=2)
+        self.assertEqual([backoff.next() for _ in range(5)], [1, 2, 4, 5, 5])
+        backoff.reset()
+        self.assertEqual(backoff.next(), 1)
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.polls = {'a': 0, 'b': 0}
+        self.transitions = []
+
+    def fetch(self, key):
+        self.polls[key] += 1
+        if key == 'a':
+            return {'status': 'Complete' if self.clock.now >= 3 else 'Running'}
+        if self.clock.now >= 100:
+            return {'status': 'Failed'}
+        return {'status': 'Running'}
+
+    def run_watch(self, **kwargs):
+        return watch(['a', 'b', 'a'], self.fetch, lambda job: job['status'],
+                     lambda status: status in ('Complete', 'Failed'),
+                     lambda key, old, new, job: self.transitions.append((key, old, new)),
+                     initial=1, maximum=20, factor=2, clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_transitions(self):
+        states = self.run_watch()
+        self.assertEqual(states, {'a': 'Complete', 'b': 'Failed'})
+        self.assertCountEqual(self.transitions, [('a', None, 'Running'), ('a', 'Running', 'Complete'),
+                                                 ('b', None, 'Running'), ('b', 'Running', 'Failed')])
+        # Backoff means the long running job is polled far less than once per second
+        self.assertLess(self.polls['b'], 20)
+
+    def test_timeout(self):
+        states = self.run_watch(timeout=10)
+        self.assertEqual(states, {'a': 'Complete', 'b': 'Running'})
+        self.assertLessEqual(self.clock.now, 10)
+
+    def test_fetch_errors_are_retried(self):
+        failures = []
+
+        def flaky(key):
+            if len(failures) < 2:
+                failures.append(key)
+                raise RuntimeError('unavailable')
+            return {'status': 'Complete'}
+
+        states = watch(['a'], flaky, lambda job: job['status'], lambda status: status == 'Complete',
+                       lambda *args: None, initial=1, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(states, {'a': 'Complete'})
+        self.assertEqual(len(failures), 2)
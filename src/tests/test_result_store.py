@@ -0,0 +1,98 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import importlib.util
+import os
+import tempfile
+import types
+import unittest
+
+from scripts.utils.datachecks import iter_results
+from scripts.utils.result_store import DatacheckResultStore
+
+
+def job(job_id, tag, status='complete', results=None):
+    return {'id': job_id, 'status': status, 'input': {'tag': tag}, 'output': {'databases': results or {}}}
+
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'results.sqlite')
+        self.store = DatacheckResultStore(self.path)
+        self.addCleanup(self.store.close)
+
+    def test_incremental_sync(self):
+        listing = [job(1, 't1', results={'db_a': {'DC1': {'passed': 1}, 'DC2': {'passed': 0}}}),
+                   job(2, 't1', results={'db_b': {'DC1': {'passed': 1}}}),
+                   job(3, 't2', status='running')]
+        self.assertEqual(self.store.sync(listing), ['1', '2', '3'])
+        self.assertEqual(self.store.sync(listing), [])
+        listing[2] = job(3, 't2', results={'db_c': {'DC1': {'status': 'failed'}}})
+        self.assertEqual(self.store.sync(listing), ['3'])
+
+        self.assertEqual([j['id'] for j in self.store.jobs('t1')], [1, 2])
+        self.assertEqual([j['id'] for j in self.store.jobs(failure_only=True)], [1, 3])
+        self.assertEqual(list(self.store.results(datacheck='DC1', status='failed')), [('3', 't2', 'db_c', 'DC1', 'failed')])
+
+    def test_details_only_for_changed_jobs(self):
+        fetched = []
+
+        def detail(listed):
+            fetched.append(listed['id'])
+            return job(listed['id'], 't', results={'db': {'DC': {'status': 'failed'}}})
+
+        listing = [job(1, 't'), job(2, 't')]
+        self.store.sync(listing, detail)
+        self.store.sync(listing, detail)
+        self.assertEqual(sorted(fetched), [1, 2])
+        self.assertEqual(self.store.results(datacheck='DC').fetchall(),
+                         [('1', 't', 'db', 'DC', 'failed'), ('2', 't', 'db', 'DC', 'failed')])
+
+    def test_numeric_order_and_watermark(self):
+        self.store.sync([job(10, 't'), job(2, 't'), job(9, 't')])
+        self.assertEqual([j['id'] for j in self.store.jobs()], [2, 9, 10])
+        self.assertIsNone(self.store.watermark('t'))
+        self.store.set_watermark('t', 9)
+        self.assertEqual(self.store.watermark('t'), 9)
+        self.assertIsNone(self.store.watermark())
+
+    @unittest.skipUnless(importlib.util.find_spec('requests'), 'requires requests')
+    def test_sync_store_watermark(self):
+        from scripts.datacheck_client import sync_store
+        from tests.stub_services import StubService
+        from tests.test_stub_services import call
+
+        with StubService('datacheck', records=3, failure_rate=0) as service:
+            running = call(service.uri + 'jobs', 'POST', {'dbname': 'a_core_1_1'})['job_id']
+            client = types.SimpleNamespace(uri=service.uri, jobs='{}jobs',
+                                           retrieve_job=lambda job_id: call(f'{service.uri}jobs/{job_id}'))
+            sync_store(client, self.store)
+            self.assertEqual(self.store.watermark(), int(running))
+            self.assertEqual(len(list(self.store.jobs())), 4)
+
+    def test_persistence(self):
+        self.store.sync([job(1, 't')])
+        with DatacheckResultStore(self.path) as store:
+            self.assertEqual(len(list(store.jobs('t'))), 1)
+
+    def test_iter_results(self):
+        self.assertEqual(list(iter_results({'output': {'databases': {'db': {'DC': {'ok': 0}, 'DC2': 'PASSED'}}}})),
+                         [('db', None, 'failed'), ('db', 'DC', 'failed'), ('db', 'DC2', 'passed')])
+        summary = {'output': {'databases': {'db1': {'passed_total': 3, 'failed_total': 1, 'failed': {'DC': {}}},
+                                            'db2': {'passed_total': 4, 'failed_total': 0, 'failed': {}}}}}
+        self.assertEqual(list(iter_results(summary)),
+                         [('db1', None, 'failed'), ('db1', 'DC', 'failed'), ('db2', None, 'passed')])
+        self.assertEqual(list(iter_results({'status': 'running'})), [])
@@ -0,0 +1,120 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+
+import contextlib
+import io
+import sqlite3
+import unittest
+
+from scripts.dbcopy_client import check_hosts, host_error, main
+from scripts.utils.mysql import SIZE_QUERY, sizes_from_rows
+from scripts.utils.scheduling import format_size, plan_copies, target_loads
+
+GB = 1024 ** 3
+
+
+class TestPlanCopies(unittest.TestCase):
+
+    def test_largest_first_balanced(self):
+        sizes = {'variation_a': 500 * GB, 'variation_b': 500 * GB, 'variation_c': 400 * GB,
+                 'core_a': 10 * GB, 'core_b': 5 * GB}
+        plan = plan_copies(sizes, ['t1:3306', 't2:3306'])
+        self.assertEqual([assignment.dbname for assignment in plan],
+                         ['variation_a', 'variation_b', 'variation_c', 'core_a', 'core_b'])
+        targets = {assignment.dbname: assignment.target for assignment in plan}
+        # The two largest databases do not share a target
+        self.assertNotEqual(targets['variation_a'], targets['variation_b'])
+        loads = target_loads(plan)
+        self.assertEqual(sum(total for _, total, _ in loads.values()), sum(sizes.values()))
+        self.assertEqual(max(end for _, _, end in loads.values()), 900 * GB)
+
+    def test_slots_per_target(self):
+        plan = plan_copies({name: GB for name in 'abcdef'}, ['t1', 't2'], slots=2)
+        self.assertEqual([assignment.start for assignment in plan], [0, 0, 0, 0, GB, GB])
+        self.assertEqual({target: count for target, (count, _, _) in target_loads(plan).items()}, {'t1': 3, 't2': 3})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            plan_copies({'a': 1}, [])
+        with self.assertRaises(ValueError):
+            plan_copies({'a': 1}, ['t1'], slots=0)
+
+    def test_format_size(self):
+        self.assertEqual(format_size(512), '512 B')
+        self.assertEqual(format_size(1536), '1.5 KB')
+        self.assertEqual(format_size(500 * GB), '500.0 GB')
+        self.assertEqual(format_size(2048 * GB), '2.0 TB')
+
+    def test_planned_copies_keep_database_names(self):
+        argv = ['-u', 'http://localhost:1/', '-a', 'submit-plan', '--src_host', 'src:3306', '--tgt_host', 't1:3306',
+                '--src_server_url', 'mysql://user@src:3306/', '-n', 'renamed', '-e', 'me@ebi', '-r', 'me']
+        with contextlib.redirect_stderr(io.StringIO()) as err, self.assertRaises(SystemExit) as raised:
+            main(argv)
+        self.assertEqual(raised.exception.code, 2)
+        self.assertIn('--tgt_db_name cannot be used with submit-plan', err.getvalue())
+
+
+class TestDatabaseSizes(unittest.TestCase):
+
+    def test_size_query(self):
+        # SQLite stand-in for the information_schema of a MySQL server
+        connection = sqlite3.connect(':memory:')
+        self.addCleanup(connection.close)
+        connection.execute("ATTACH DATABASE ':memory:' AS information_schema")
+        connection.execute('CREATE TABLE information_schema.tables '
+                           '(table_schema TEXT, table_name TEXT, data_length INTEGER, index_length INTEGER)')
+        connection.executemany('INSERT INTO information_schema.tables VALUES (?, ?, ?, ?)', [
+            ('homo_sapiens_core_110_38', 'gene', 1000, 200),
+            ('homo_sapiens_core_110_38', 'transcript', 3000, None),
+            ('homo_sapiens_variation_110_38', 'variation', 90000, 10000),
+            ('mus_musculus_core_110_39', 'gene', 500, 50),
+            ('mysql', 'user', 10, 10),
+            ('information_schema', 'TABLES', None, None),
+        ])
+        rows = connection.execute(SIZE_QUERY).fetchall()
+        self.assertEqual(sizes_from_rows(rows), {'homo_sapiens_core_110_38': 4200,
+                                                 'homo_sapiens_variation_110_38': 100000,
+                                                 'mus_musculus_core_110_39': 550})
+        self.assertEqual(sizes_from_rows(rows, 'homo_sapiens_*,mus_musculus_core_110_39'),
+                         {'homo_sapiens_core_110_38': 4200, 'homo_sapiens_variation_110_38': 100000,
+                          'mus_musculus_core_110_39': 550})
+        self.assertEqual(sizes_from_rows(rows, '*_core_*'), {'homo_sapiens_core_110_38': 4200,
+                                                             'mus_musculus_core_110_39': 550})
+
+
+class HostClient:
+    uri = 'http://dbcopy/'
+
+    def retrieve_host_list(self, role):
+        return {'results': [{'name': {'source': 'src-1', 'target': 'tgt-1'}[role], 'port': 3306}]}
+
+
+class TestCheckHosts(unittest.TestCase):
+
+    def test_host_error(self):
+        hosts = {'src-1': 3306}
+        self.assertIsNone(host_error('src-1:3306', hosts))
+        self.assertIsNone(host_error('src-1.internal:3306', hosts))
+        self.assertEqual(host_error('src-1.ebi.ac.uk:3306', hosts), 'Invalid domain: src-1.ebi.ac.uk')
+        self.assertEqual(host_error('src-2:3306', hosts), 'Invalid hostname: src-2')
+        self.assertIn('Please use port: 3306', host_error('src-1:3307', hosts))
+
+    def test_check_hosts_cached(self):
+        cache = {}
+        cache_store = type('Cache', (), {'get': lambda self, key: cache.get(key),
+                                         'set': lambda self, key, value: cache.__setitem__(key, value)})()
+        self.assertTrue(check_hosts(HostClient(), ['src-1:3306'], ['tgt-1:3306'], cache_store))
+        self.assertEqual(sorted(cache), ['http://dbcopy/|source|src-1:3306', 'http://dbcopy/|target|tgt-1:3306'])
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(check_hosts(HostClient(), ['src-1:3306'], ['tgt-2:3306'], cache_store))
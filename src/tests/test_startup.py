@@ -0,0 +1,58 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import os
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+from scripts.prodinf import SERVICES, parse_command
+
+SRC = str(Path(__file__).resolve().parents[1])
+HEAVY_MODULES = ('ensembl', 'kombu', 'requests', 'sqlalchemy', 'urllib3')
+# Sum of the ``-X importtime`` self times of a ``--help`` run, in microseconds. Loading requests and
+# SQLAlchemy alone takes several times this.
+STARTUP_BUDGET_US = 300000
+
+
+def imported_modules(*args):
+    env = dict(os.environ, PYTHONPATH=SRC)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'scripts.prodinf', *args],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            self_time, _, name = line[len('import time:'):].split('|')
+            if self_time.strip().isdigit():
+                modules[name.strip()] = int(self_time)
+    return modules
+
+
+class TestProdinf(unittest.TestCase):
+
+    def test_parse_command(self):
+        self.assertEqual(parse_command(['dbcopy', 'list', '-u', 'http://host/']),
+                         ('scripts.dbcopy_client', ['--action', 'list', '-u', 'http://host/']))
+        self.assertEqual(parse_command(['metadata', '--help']), ('scripts.genomemetadata_client', ['--help']))
+        with self.assertRaises(ValueError):
+            parse_command(['nope', 'list'])
+
+    def test_help_is_fast(self):
+        for service in SERVICES:
+            with self.subTest(service=service):
+                modules = imported_modules(service, '--help')
+                self.assertIn('scripts.utils.daemon', modules)
+                heavy = [name for name in modules if name.split('.')[0] in HEAVY_MODULES]
+                self.assertEqual(heavy, [])
+                self.assertLess(sum(modules.values()), STARTUP_BUDGET_US)
@@ -0,0 +1,174 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from scripts.utils import fastjson
+from scripts.utils.streaming import (copy_response, iter_json_array, iter_json_file, iter_json_records, iter_pages,
+                                     parse_datetime, project, write_ndjson)
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class FakeResponse:
+
+    def __init__(self, body):
+        self.body = body
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, size):
+        return iter(split(self.body, 7))
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeSession:
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url, params=None, stream=False):
+        self.requested.append((url, params))
+        return FakeResponse(self.pages[url])
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def test_chunk_boundaries(self):
+        records = [{'id': i, 'name': 'ĥandover ✓', 'tags': [i, None, True]} for i in range(50)] + [12345, 'x']
+        data = json.dumps(records).encode('utf-8')
+        for size in (1, 3, 64, len(data)):
+            self.assertEqual(list(iter_json_array(split(data, size))), records)
+
+    def test_empty_and_whitespace(self):
+        self.assertEqual(list(iter_json_array([' [', ' ', ']  '])), [])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"a": 1}']))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['[{"a": 1}, ']))
+
+
+class TestIterJsonRecords(unittest.TestCase):
+
+    def test_array(self):
+        session = FakeSession({'u': b'[{"a": 1}, {"a": 2}]'})
+        self.assertEqual(list(iter_json_records(session, 'u', {'user': 'me'})), [{'a': 1}, {'a': 2}])
+        self.assertEqual(session.requested, [('u', {'user': 'me'})])
+
+    def test_paginated(self):
+        session = FakeSession({'u': b'{"next": "p2", "results": [{"a": 1}]}',
+                               'p2': b'{"next": null, "results": [{"a": 2}]}'})
+        self.assertEqual(list(iter_json_records(session, 'u')), [{'a': 1}, {'a': 2}])
+
+
+class TestIterPages(unittest.TestCase):
+
+    def test_pages(self):
+        session = FakeSession({'u': b'{"next": "p2", "results": [{"a": 1}, {"a": 2}]}',
+                               'p2': b'{"next": null, "results": [{"a": 3}]}'})
+        self.assertEqual(list(iter_pages(session, 'u', {'page_size': 2})), [[{'a': 1}, {'a': 2}], [{'a': 3}]])
+        self.assertEqual(session.requested, [('u', {'page_size': 2}), ('p2', None)])
+
+    def test_unpaginated(self):
+        session = FakeSession({'u': b'[{"a": 1}]'})
+        self.assertEqual(list(iter_pages(session, 'u')), [[{'a': 1}]])
+
+    def test_project(self):
+        record = {'uuid': 'x', 'organism': {'name': 'human', 'taxon': 9606}, 'extra': [1]}
+        self.assertEqual(project(record, ['uuid', 'organism.name', 'missing.key']),
+                         {'uuid': 'x', 'organism.name': 'human', 'missing.key': None})
+
+
+class TestHelpers(unittest.TestCase):
+
+    def test_parse_datetime(self):
+        expected = datetime(2024, 1, 2, tzinfo=timezone.utc)
+        self.assertEqual(parse_datetime('2024-01-02'), expected)
+        self.assertEqual(parse_datetime('2024-01-02T00:00:00Z'), expected)
+        self.assertEqual(parse_datetime('2024-01-02T01:00:00+01:00'), expected)
+
+    def test_write_ndjson(self):
+        out = io.StringIO()
+        self.assertEqual(write_ndjson(iter([{'a': 1}, {'b': [2]}]), out), 2)
+        self.assertEqual(out.getvalue(), '{"a":1}\n{"b":[2]}\n')
+
+    def test_write_ndjson_flushes_in_batches(self):
+        out = io.StringIO()
+        flushes = []
+        out.flush = lambda: flushes.append(out.tell())
+        self.assertEqual(write_ndjson(({'n': n} for n in range(5)), out, flush_every=2), 5)
+        self.assertEqual(flushes, [16, 32, 40])
+
+    def test_iter_json_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            array = os.path.join(tmp, 'jobs.json')
+            lines = os.path.join(tmp, 'jobs.jsonl')
+            empty = os.path.join(tmp, 'empty.json')
+            with open(array, 'w') as fh:
+                json.dump([{'id': 1}, {'id': 2}], fh, indent=2)
+            with open(lines, 'w') as fh:
+                fh.write('{"id": 1}\n\n{"id": 2}\n')
+            open(empty, 'w').close()
+            self.assertEqual(list(iter_json_file(array)), [{'id': 1}, {'id': 2}])
+            self.assertEqual(list(iter_json_file(lines)), [{'id': 1}, {'id': 2}])
+            self.assertEqual(list(iter_json_file(empty)), [])
+
+    def test_copy_response(self):
+        body = b'[{"id": 1}, {"id": 2}]'
+        out = io.BytesIO()
+        self.assertEqual(copy_response(FakeSession({'u': body}), 'u', out), len(body))
+        self.assertEqual(out.getvalue(), body)
+
+
+class TestFastJson(unittest.TestCase):
+
+    def check(self):
+        self.assertEqual(fastjson.loads(b'{"a": [1, "\\u00e9"]}'), {'a': [1, '\u00e9']})
+        self.assertEqual(fastjson.dumps({'a': 1, 'b': None}), '{"a":1,"b":null}')
+        self.assertEqual(json.loads(fastjson.dumps([datetime(2024, 1, 2)], indent=2)), ['2024-01-02 00:00:00'])
+        with self.assertRaises(ValueError):
+            fastjson.loads('{')
+
+    def test_fast(self):
+        if fastjson.orjson is None:
+            self.skipTest('orjson is not installed')
+        self.check()
+
+    def test_fallback(self):
+        orjson = fastjson.orjson
+        self.addCleanup(setattr, fastjson, 'orjson', orjson)
+        fastjson.orjson = None
+        self.check()
@@ -0,0 +1,75 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import gzip
+import json
+import unittest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from scripts.datacheck_client import is_finished
+from scripts.utils.polling import watch
+from tests.stub_services import StubService
+
+
+def call(url, method='GET', document=None, headers=None):
+    data = None if document is None else json.dumps(document).encode('utf-8')
+    request = Request(url, data=data, method=method, headers={'Content-Type': 'application/json', **(headers or {})})
+    with urlopen(request) as response:
+        body = response.read()
+        if response.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body) if body else None
+
+
+class TestStubService(unittest.TestCase):
+
+    def test_dbcopy(self):
+        with StubService('dbcopy', records=3, failure_rate=0, steps=2) as service:
+            self.assertEqual(len(call(service.uri)), 3)
+            self.assertEqual(call(service.uri.rsplit('/', 1)[0] + '/srchost')['results'][0]['port'], 3306)
+            job_id = call(service.uri, 'POST', {'src_host': 'a:1', 'tgt_host': 'b:2', 'user': 'me'})['job_id']
+            statuses = [call(f'{service.uri}/{job_id}')['overall_status'] for _ in range(3)]
+            self.assertEqual(statuses, ['Running', 'Complete', 'Complete'])
+            self.assertEqual(service.submissions[0]['user'], 'me')
+
+    def test_datacheck_incomplete_is_running(self):
+        with StubService('datacheck', records=0, failure_rate=0, steps=3) as service:
+            job_id = call(service.uri + 'jobs', 'POST', {'dbname': 'a_core_1_1'})['job_id']
+            changes = []
+            statuses = watch([job_id], lambda key: call(f'{service.uri}jobs/{key}'), lambda job: job['status'],
+                             is_finished, lambda key, old, new, job: changes.append(new), initial=0.01)
+            self.assertEqual(changes, ['running', 'incomplete', 'complete'])
+            self.assertEqual(statuses, {job_id: 'complete'})
+
+    def test_handover(self):
+        with StubService('handover', records=2, failure_rate=1) as service:
+            reports = call(service.uri + 'jobs/00000001-2222-4000-8000-000000000000')
+            self.assertEqual(reports[0]['current_message'], 'Handover failed: datachecks found problems')
+
+    def test_metadata_pages(self):
+        with StubService('metadata', records=5, payload_size=2000) as service:
+            url = service.uri + 'api/genome_metadata/datasets/?page_size=2'
+            records = []
+            while url:
+                page = call(url, headers={'Accept-Encoding': 'gzip'})
+                records.extend(page['results'])
+                url = page['next']
+            self.assertEqual(len(records), 5)
+            self.assertEqual(len(records[0]['padding']), 2000)
+
+    def test_errors(self):
+        with StubService('datacheck', records=1, error_rate=1) as service:
+            with self.assertRaises(HTTPError) as error:
+                call(service.uri + 'jobs')
+            self.assertEqual(error.exception.code, 503)
+            self.assertEqual(service.requests, 1)
@@ -0,0 +1,74 @@
+# .. See the NOTICE file distributed with this work for additional information
+#    regarding copyright ownership.
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+
+from scripts.utils import timing
+
+
+class TestTimings(unittest.TestCase):
+
+    def test_endpoint_name(self):
+        self.assertEqual(timing.endpoint_name('GET', 'http://host/api/dbcopy/requestjob/123?x=1'),
+                         'GET /api/dbcopy/requestjob/{id}')
+        self.assertEqual(timing.endpoint_name('GET', 'http://host/datasets/a3c5e1f2-0000-4000-8000-000000000000'),
+                         'GET /datasets/{id}')
+        self.assertEqual(timing.endpoint_name('POST', 'http://host/jobs'), 'POST /jobs')
+        self.assertEqual(timing.endpoint_name('GET', 'http://host/api/genome_metadata/datasets/'),
+                         'GET /api/genome_metadata/datasets/')
+        self.assertEqual(timing.endpoint_name('GET', 'http://host/jobs/a3c5e1f2-0000-4000-8000-000000000000-extra'),
+                         'GET /jobs/a3c5e1f2-0000-4000-8000-000000000000-extra')
+
+    def test_histogram(self):
+        counts = timing.histogram([0.001, 0.007, 0.007, 20])
+        self.assertEqual(counts['le_5ms'], 1)
+        self.assertEqual(counts['le_10ms'], 2)
+        self.assertEqual(counts['inf'], 1)
+
+    def test_summary(self):
+        now = [0.0]
+        timings = timing.Timings(clock=lambda: now[0])
+        for total, decode in ((0.1, 0.01), (0.3, 0.02)):
+            call = timings.new_call('GET', 'http://host/jobs/1')
+            call.update(total=total, decode=decode, ttfb=total / 2, bytes=100)
+        now[0] = 1.0
+        summary = timings.summary()
+        self.assertEqual(summary['totals']['calls'], 2)
+        self.assertEqual(summary['totals']['bytes'], 200)
+        self.assertAlmostEqual(summary['totals']['post_processing'], 0.57)
+        self.assertEqual(summary['endpoints']['GET /jobs/{id}']['p90'], 0.3)
+        self.assertIn('2 HTTP call(s)', timings.format_text())
+
+    def test_timed(self):
+        timings = timing.Timings()
+        call = timings.new_call('GET', 'http://host/jobs')
+        inner = timing.timed(lambda: 'done', 'dns')
+        outer = timing.timed(lambda: inner(), 'dns')
+        self.assertEqual(outer(), 'done')
+        self.assertEqual(call['dns'], 0.0)
+        timing.set_active_call(call)
+        self.addCleanup(timing.set_active_call, None)
+        self.assertEqual(outer(), 'done')
+        self.assertGreater(call['dns'], 0.0)
+
+    def test_report(self):
+        timings = timing.Timings()
+        timings.new_call('GET', 'http://host/jobs')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'timings.json')
+            timing.report_at_exit(timings, json_path=path)
+            timing.flush()
+            with open(path) as f:
+                self.assertEqual(json.load(f)['totals']['calls'], 1)